@@ -2,17 +2,41 @@
 # pylint: disable=locally-disabled, missing-docstring, import-error, invalid-name
 
 from secrets import token_hex
+import os
 import json
-from flask import Flask, jsonify, request, abort, make_response
+import time
+from flask import Flask, Response, jsonify, request, abort, make_response
 from waitress import serve
 import uwsgi
-from lib.main import execute_tests
+from lib.main import execute_tests, get_cancel_key, get_concurrency_key
 from lib.config import get_config_options
+from lib.concurrency import ConcurrencyController
+from lib.wrappers import (
+    _get_child_pids,
+    _get_int_option,
+    _get_process_memory,
+    _get_process_start_time,
+)
+import lib.utilities as utilities
+import lib.constants as constants
+import lib.results as results
+import lib.engine as engine
 
 app = Flask(__name__)
 
 CONFIG = get_config_options()
 
+# Import the test modules in the uWSGI master, before it forks the workers, so that the workers
+# and their test processes share them copy-on-write rather than each importing them again.
+PRELOAD_MS = utilities.preload(CONFIG["preload"])
+engine.set_capture(CONFIG["capture"])
+# Every worker adapts its own limits, starting from a copy of this controller.
+CONTROLLER = (
+    ConcurrencyController(CONFIG["max_process_count"]) if CONFIG["adaptive_concurrency"] else None
+)
+START_TIME = _get_process_start_time(os.getpid())
+STARTUP_MS = (time.time() - START_TIME) * 1000 if START_TIME is not None else None
+
 
 @app.before_request
 def check_auth_header():
@@ -34,9 +58,19 @@ def create_tests():
     payload = request.get_json()
     if payload is None:
         return make_response(jsonify({"error": "Valid request payload not found."}), 400)
+    # The optional deadline of the whole payload, in milliseconds from now.
+    try:
+        payload["deadline_ms"] = _get_int_option(
+            payload, "deadline_ms", None, 1, constants.MAX_DEADLINE_MS
+        )
+    except (TypeError, ValueError) as error:
+        return make_response(jsonify({"error": str(error)}), 400)
+    if payload["deadline_ms"] is None:
+        del payload["deadline_ms"]
     test_count = 0
-    for tests in payload.values():
-        test_count += len(tests)
+    for (test_type, tests) in payload.items():
+        if test_type != "deadline_ms":
+            test_count += len(tests)
     if test_count > CONFIG["max_test_count"]:
         return make_response(
             jsonify(
@@ -47,7 +81,7 @@ def create_tests():
     # Generate the client's receipt and pass the test payload to a background thread to be executed.
     receipt = token_hex(16)
     uwsgi.cache_set(receipt, "{}", 600, "receipts")
-    execute_tests(receipt, payload, CONFIG["max_process_count"])
+    execute_tests(receipt, payload, CONFIG["max_process_count"], CONTROLLER)
     return jsonify({"receipt": receipt})
 
 
@@ -61,18 +95,77 @@ def get_tests():
         return make_response(
             jsonify({"error": "Required 'receipt' parameter found with an empty value."}), 400
         )
+    try:
+        (tree, layout) = _get_rendering()
+    except ValueError as error:
+        return make_response(jsonify({"error": str(error)}), 400)
     test_status = uwsgi.cache_get(receipt, "receipts")
     if test_status is None:
         return make_response(jsonify({"error": "Provided 'receipt' not found."}), 404)
-    return jsonify(json.loads(test_status))
+    return jsonify(results.render(json.loads(test_status), tree, layout))
+
+
+@app.route("/api/v1.0/tests/bulk", methods=["POST"])
+def get_tests_bulk():
+    """Retrieve the test execution status of many receipts at once, streamed as NDJSON."""
+    payload = request.get_json()
+    receipts = payload.get("receipts") if isinstance(payload, dict) else None
+    if not isinstance(receipts, list) or not all(isinstance(item, str) for item in receipts):
+        return make_response(
+            jsonify({"error": "Required 'receipts' list of receipts not found."}), 400
+        )
+    if len(receipts) > constants.BULK_MAX_RECEIPTS:
+        return make_response(
+            jsonify(
+                {
+                    "error": "Provided number of receipts is too high. "
+                    f"Max: {constants.BULK_MAX_RECEIPTS}"
+                }
+            ),
+            400,
+        )
+    try:
+        (tree, layout) = _get_rendering()
+    except ValueError as error:
+        return make_response(jsonify({"error": str(error)}), 400)
+
+    def generate():
+        for receipt in receipts:
+            test_status = uwsgi.cache_get(receipt, "receipts")
+            if test_status is None:
+                line = {"receipt": receipt, "error": "Provided 'receipt' not found."}
+            else:
+                # Every line is tagged with its receipt, whatever the projection.
+                line = dict(results.render(json.loads(test_status), tree, layout))
+                line["receipt"] = receipt
+            yield json.dumps(line, separators=(",", ":")) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+def _get_rendering():
+    """Get the fields projection tree and the layout of the retrieved test results."""
+    tree = results.parse_fields(request.args.get("fields", None))
+    layout = request.args.get("layout", "rows")
+    if layout not in results.LAYOUTS:
+        raise ValueError(f"Provided 'layout' of '{layout}' is not supported. {results.LAYOUTS}.")
+    return tree, layout
 
 
 @app.route("/api/v1.0/tests", methods=["DELETE"])
 def delete_tests():
-    """Delete test data from cache upon successful DELETE."""
+    """Delete test data from cache upon successful DELETE, cancelling the tests still running."""
     if "receipt" not in request.args:
         return make_response(jsonify({"error": "Required 'receipt' parameter not found."}), 400)
     receipt = request.args.get("receipt")
+    if not uwsgi.cache_exists(receipt, "receipts"):
+        return make_response(jsonify({"error": "Provided 'receipt' not found."}), 404)
+    # Flag the running tests as cancelled first, so that they aren't written back once deleted.
+    # The flag is only cleared by the tests, so it would be left behind for finished ones. A
+    # receipt is "{}" until its tests have started.
+    test_status = uwsgi.cache_get(receipt, "receipts")
+    if test_status is not None and json.loads(test_status).get("is_running", True):
+        uwsgi.cache_update(get_cancel_key(receipt), "1", 600, "receipts")
     if not uwsgi.cache_del(receipt, "receipts"):
         return make_response(jsonify({"error": "Provided 'receipt' not found."}), 404)
     return jsonify({"message": "Provided 'receipt' has been successfully deleted."})
@@ -85,8 +178,25 @@ def get_status():
     for worker in uwsgi.workers():
         del worker["apps"]
         worker["status"] = worker["status"].decode("utf-8")
+        # The concurrency limits that the worker adapted, once it ran some tests.
+        concurrency = uwsgi.cache_get(get_concurrency_key(worker["pid"]), "receipts")
+        worker["concurrency"] = json.loads(concurrency) if concurrency is not None else None
         status["worker_status"].append(worker)
     status["total_requests"] = uwsgi.total_requests()
+    preloaded = utilities.TEST_MODULES if CONFIG["preload"] is None else CONFIG["preload"]
+    status["startup"] = {
+        "startup_ms": STARTUP_MS,
+        "preload_ms": PRELOAD_MS,
+        "preloaded": sorted(preloaded),
+    }
+    # The memory of the master, the workers and the test processes of the workers' pools.
+    processes = [{"pid": uwsgi.masterpid(), "role": "master"}]
+    for worker in status["worker_status"]:
+        processes.append({"pid": worker["pid"], "role": "worker"})
+        processes.extend({"pid": pid, "role": "test"} for pid in _get_child_pids(worker["pid"]))
+    for process in processes:
+        process.update(_get_process_memory(process["pid"]))
+    status["processes"] = processes
     return jsonify(status)
 
 
@@ -0,0 +1,3 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+__version__ = "1.0.0"
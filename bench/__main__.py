@@ -0,0 +1,155 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import os
+import sys
+import json
+import argparse
+import contextlib
+from bench import cases as bench_cases, checks, measure, standins
+from bench.netns import Topology, NetnsError
+
+# The ports of the stand-ins when they run on loopback, next to whatever else is running.
+LOOPBACK_TARGET = {
+    "address": "127.0.0.1",
+    "address6": "::1",
+    "dns_port": 15353,
+    "http_port": 18081,
+    "https_port": 18443,
+}
+
+
+def _start_loopback_standins():
+    target = dict(LOOPBACK_TARGET)
+    standins.start_dns(target["address"], target["dns_port"], target["address"])
+    if len(standins.start_web(target["address"], target["http_port"], target["https_port"])) < 2:
+        target["https_port"] = None
+    return target
+
+
+def _run(args):
+    meta = {
+        "iterations": args.iterations,
+        "processes": args.processes,
+        "netns": False,
+        "netem": False,
+        "delay_ms": args.delay,
+        "loss": args.loss,
+        "bup_stub": standins.start_bup() is not None,
+    }
+    with contextlib.ExitStack() as stack:
+        if args.netns and Topology.available():
+            topology = stack.enter_context(Topology(args.delay, args.loss))
+            target = topology.target
+            meta["netns"], meta["netem"] = True, topology.netem
+        else:
+            if args.netns:
+                print("warning: namespaces need root and iproute2, using loopback", file=sys.stderr)
+            target = _start_loopback_standins()
+        report = {"meta": measure.get_meta(**meta), "cases": {}}
+        for case in bench_cases.get_cases(target):
+            if args.cases and case.name not in args.cases:
+                continue
+            print(f"running {case.name} ...", file=sys.stderr, flush=True)
+            report["cases"][case.name] = measure.run_case(case, args.iterations, args.processes)
+    print(measure.format_report(report))
+    if args.save:
+        print(f"\nSaved to {os.path.relpath(measure.save(report))}")
+    if args.compare:
+        with open(args.compare) as baseline:
+            return _report_comparison(json.load(baseline), report, args.threshold)
+    return 0
+
+
+def _report_comparison(old, new, threshold):
+    rows = measure.compare(old, new, threshold)
+    print(f"\nCompared against {old['meta']['git_rev']} of {old['meta']['timestamp']}:")
+    print(measure.format_comparison(rows, threshold))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+def _compare(args):
+    with open(args.old) as old, open(args.new) as new:
+        return _report_comparison(json.load(old), json.load(new), args.threshold)
+
+
+def _check(args):
+    return checks.run_checks(args.checks)
+
+
+def main(argv=None):
+    """Benchmark the Scouter test types against local stand-ins, and compare results."""
+    parser = argparse.ArgumentParser(prog="python -m bench", description=main.__doc__)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    run = subparsers.add_parser("run", help="Run the benchmarks.")
+    run.add_argument(
+        "--cases",
+        nargs="+",
+        metavar="CASE",
+        help="Only run these cases: ping, ping6, traceroute, dns_lookup, dns_bulk, "
+        "dns_traceroute, http_request, https_request, browser_request and api. Defaults to all "
+        "of them.",
+    )
+    run.add_argument(
+        "-n", "--iterations", type=int, default=20, help="Measured runs per case. Defaults to 20."
+    )
+    run.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Pool processes for the throughput phase. Defaults to the number of CPUs.",
+    )
+    run.add_argument(
+        "--no-netns",
+        dest="netns",
+        action="store_false",
+        help="Run the stand-ins on loopback rather than behind a router namespace.",
+    )
+    run.add_argument(
+        "--delay", type=float, default=5, help="netem delay per router hop in ms. Defaults to 5."
+    )
+    run.add_argument(
+        "--loss", type=float, default=0, help="netem loss per router hop in %%. Defaults to 0."
+    )
+    run.add_argument(
+        "--no-save", dest="save", action="store_false", help="Don't store the results."
+    )
+    run.add_argument("--compare", metavar="BASELINE", help="A stored result to compare with.")
+    run.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="The change in percent that counts as a regression. Defaults to 10.",
+    )
+    run.set_defaults(function=_run)
+    compare = subparsers.add_parser("compare", help="Compare two stored results.")
+    compare.add_argument("old", help="The baseline result.")
+    compare.add_argument("new", help="The result to check against the baseline.")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="The change in percent that counts as a regression. Defaults to 10.",
+    )
+    compare.set_defaults(function=_compare)
+    check = subparsers.add_parser("check", help="Run the self-contained checks.")
+    check.add_argument(
+        "checks",
+        nargs="*",
+        metavar="CHECK",
+        help=f"Only run these checks: {', '.join(checks.CHECKS)}. Defaults to all of them.",
+    )
+    check.set_defaults(function=_check)
+    args = parser.parse_args(argv)
+    if getattr(args, "iterations", 1) < 1:
+        parser.error("The number of iterations must be at least 1.")
+    try:
+        return args.function(args)
+    except NetnsError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import os
+import json
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+from lib.runner import iter_tests, normalize_test
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASN_MMDB = os.path.join(REPO, "mmdb", "GeoLite2-ASN.mmdb")
+API_SECRET = "scouter-bench"
+
+
+def _requires_mmdb():
+    if not os.path.exists(ASN_MMDB):
+        return f"{os.path.relpath(ASN_MMDB, REPO)} is missing"
+    return None
+
+
+def _requires_root():
+    return None if os.geteuid() == 0 else "raw sockets require root"
+
+
+def _requires_browser():
+    if shutil.which("chromedriver") is None:
+        return "chromedriver is not installed"
+    try:
+        socket.create_connection(("127.0.0.1", 8080), timeout=1).close()
+    except OSError:
+        return "no BUP (or BUP stub) is listening on localhost:8080"
+    return None
+
+
+def _requires_https(target):
+    return None if target.get("https_port") else "openssl is not installed"
+
+
+class Case:
+    """A single benchmarked test.
+
+    Args:
+        name      (str) : The name the case is reported under.
+        test_type (str) : The Scouter test type.
+        options   (dict): The test options.
+        requires  (list): A list of callables that return why the case can't run here, or
+                          None if it can.
+
+    """
+
+    def __init__(self, name, test_type, options, requires=()):
+        self.name = name
+        self.test = normalize_test(test_type, options)
+        self.requires = requires
+
+    def skip_reason(self):
+        for requirement in self.requires:
+            reason = requirement()
+            if reason is not None:
+                return reason
+        return None
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        pass
+
+    def run(self):
+        """Run the test once in this process.
+
+        Returns:
+            bool: Returns whether or not the test failed.
+
+        """
+        # Options are consumed by the handlers, so every run gets its own copy.
+        test = {"type": self.test["type"], "options": dict(self.test["options"])}
+        (result,) = iter_tests([test], 0)
+        return result["results"]["failed"]
+
+    def tests(self, count):
+        """The tests run by the throughput phase."""
+        return [
+            {"type": self.test["type"], "options": dict(self.test["options"])}
+            for _ in range(count)
+        ]
+
+
+class ApiCase(Case):
+    """The full POST -> poll -> result path through app.py, served by uWSGI.
+
+    Every run POSTs a payload of `batch` tests and polls its receipt until the results are in.
+
+    """
+
+    def __init__(self, name, test_type, options, batch=4, processes=2):
+        super().__init__(name, test_type, options, requires=(self._requires_uwsgi,))
+        self.batch = batch
+        self.processes = processes
+        self.server = None
+        self.directory = None
+        self.url = None
+
+    @staticmethod
+    def _requires_uwsgi():
+        if shutil.which("uwsgi") is None:
+            return "uwsgi is not installed"
+        return None
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp(prefix="scouter-bench-")
+        with open(os.path.join(self.directory, "config.cfg"), "w") as config:
+            config.write(
+                f"[Scouter]\napi_secret = {API_SECRET}\nmax_test_count = {self.batch}\n"
+                f"max_process_count = {self.processes}\n"
+            )
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/api/v1.0/tests"
+        self.server = subprocess.Popen(
+            ["uwsgi", "--http", f"127.0.0.1:{port}", "--master", "-p", "2", "--enable-threads"]
+            + ["--cache2", "name=receipts,items=100,blocksize=1000000"]
+            + ["--pythonpath", REPO, "--chdir", self.directory, "-w", "app:app"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                self._request("GET", "?receipt=none")
+            except urllib.error.HTTPError:
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.teardown()
+        raise RuntimeError("uWSGI didn't come up within 30 seconds.")
+
+    def teardown(self):
+        if self.server is not None:
+            self.server.terminate()
+            self.server.wait()
+            self.server = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def _request(self, method, query="", data=None):
+        request = urllib.request.Request(
+            self.url + query,
+            data=json.dumps(data).encode() if data is not None else None,
+            method=method,
+            headers={"Authorization": API_SECRET, "Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return json.loads(response.read())
+
+    def run(self):
+        payload = {self.test["type"]: [self.test["options"]] * self.batch}
+        receipt = self._request("POST", data=payload)["receipt"]
+        while True:
+            status = self._request("GET", f"?receipt={receipt}")
+            if status and not status["is_running"]:
+                break
+            time.sleep(0.01)
+        self._request("DELETE", f"?receipt={receipt}")
+        return any(result["failed"] for result in status["results"][self.test["type"]])
+
+    def tests(self, count):
+        return None
+
+    def server_pids(self):
+        """The PIDs of the uWSGI master and all of its descendants."""
+        pids = [self.server.pid]
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/task/{pid}/children") as children:
+                    pids.extend(int(child) for child in children.read().split())
+            except OSError:
+                pass
+        return pids
+
+
+def get_cases(target):
+    """Build the benchmark cases against the stand-ins described by `target`.
+
+    Args:
+        target (dict): The stand-in addresses and ports: "address", "address6", "dns_port",
+                       "http_port" and "https_port". The HTTPS port is None if no HTTPS
+                       stand-in is running.
+
+    Returns:
+        list: Returns a list of Case objects.
+
+    """
+    address = target["address"]
+    http_url = f"http://{address}:{target['http_port']}/"
+    cases = [
+        Case("ping", "ping", {"dst": address, "count": 3}, (_requires_root,)),
+        Case("ping6", "ping", {"dst": target["address6"], "count": 3}, (_requires_root,)),
+        Case(
+            "traceroute",
+            "traceroute",
+            {"dst": address, "proto": "icmp", "max_ttl": 4},
+            (_requires_root, _requires_mmdb),
+        ),
+        Case(
+            "dns_lookup",
+            "dns_lookup",
+            {"qname": "bench.scouter.test", "ns": address, "port": target["dns_port"]},
+        ),
+        Case(
+            "dns_bulk",
+            "dns_bulk",
+            {
+                "queries": [f"{index}.bench.scouter.test" for index in range(100)],
+                "ns": address,
+                "port": target["dns_port"],
+            },
+        ),
+        Case(
+            "dns_traceroute",
+            "dns_traceroute",
+            {
+                "qname": "bench.scouter.test",
+                "ns": address,
+                "dport": target["dns_port"],
+                "max_ttl": 4,
+            },
+            (_requires_root, _requires_mmdb),
+        ),
+        Case("http_request", "http_request", {"url": http_url}),
+        Case(
+            "https_request",
+            "http_request",
+            {"url": f"https://{address}:{target['https_port']}/"},
+            (lambda: _requires_https(target),),
+        ),
+        Case(
+            "browser_request",
+            "browser_request",
+            {"url": http_url, "driver": "chrome"},
+            (_requires_browser,),
+        ),
+        ApiCase("api", "http_request", {"url": http_url}),
+    ]
+    return cases
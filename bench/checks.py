@@ -0,0 +1,136 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+"""Self-contained checks of behaviors that the benchmarks don't assert on.
+
+Every check either returns None when it passes, returns a string explaining why it can't run
+here, or raises an AssertionError. Run `python -m bench check` to run them.
+"""
+
+import socket
+import traceback
+import pycurl
+from lib.utilities import http
+from bench import standins
+
+
+def check_http_percentile():
+    """http_request's `repeat` statistics use the nearest-rank percentile."""
+    ten = list(range(1, 11))
+    hundred = list(range(1, 101))
+    cases = [
+        (ten, 50, 5),
+        (ten, 90, 9),
+        (ten, 99, 10),
+        (hundred, 50, 50),
+        (hundred, 90, 90),
+        (hundred, 99, 99),
+        ([7], 50, 7),
+        ([7], 0, 7),
+        ([], 50, None),
+    ]
+    for (values, percent, expected) in cases:
+        actual = http._percentile(values, percent)  # pylint: disable=protected-access
+        assert actual == expected, f"p{percent} of {len(values)} values: {actual} != {expected}"
+
+
+def _has_ipv6_loopback():
+    try:
+        with socket.socket(socket.AF_INET6) as sock:
+            sock.bind(("::1", 0))
+    except OSError:
+        return False
+    return True
+
+
+def check_http_happy_eyeballs():
+    """http_request's `happy_eyeballs` races both families and names the first to connect.
+
+    cURL resolves "localhost" to both 127.0.0.1 and ::1 on its own, so a stand-in listening on
+    both is a dual-stack server, and one listening on 127.0.0.1 only is IPv4-only.
+
+    """
+    if not _has_ipv6_loopback():
+        return "there's no IPv6 loopback address"
+    (server,) = standins.start_web("127.0.0.1", 0)
+    port = server.server_address[1]
+    try:
+        result = http.http_request(f"http://localhost:{port}/", happy_eyeballs=True)
+        assert result["results"]["ipv6"]["failed"], "IPv4-only: the IPv6 request succeeded"
+        assert result["winner"] == "ipv4", f"IPv4-only: the winner is {result['winner']}"
+        assert result["margin_ms"] is None, "IPv4-only: there's a margin with a single winner"
+        assert not result["failed"], "IPv4-only: the test failed"
+        (server6,) = standins.start_web("::1", port)
+        try:
+            result = http.http_request(f"http://localhost:{port}/", happy_eyeballs=True)
+        finally:
+            server6.shutdown()
+            server6.server_close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    for family in ("ipv4", "ipv6", "auto"):
+        assert not result["results"][family]["failed"], f"Dual-stack: the {family} request failed"
+    assert result["results"]["ipv6"]["primary_ip"] == "::1", "Dual-stack: IPv6 used IPv4"
+    assert result["winner"] in ("ipv4", "ipv6"), f"Dual-stack: the winner is {result['winner']}"
+    assert result["margin_ms"] is not None and result["margin_ms"] >= 0, "Dual-stack: no margin"
+    assert result["auto_family"] in ("ipv4", "ipv6"), "Dual-stack: no family for cURL's choice"
+    assert not result["failed"], "Dual-stack: the test failed"
+    return None
+
+
+def check_http3_version():
+    """http_request's HTTP/3 requests never fall back to TCP, or are refused without HTTP/3."""
+    (server,) = standins.start_web("127.0.0.1", 0)
+    url = f"https://127.0.0.1:{server.server_address[1]}/"
+    try:
+        try:
+            version = http._get_http3_version()  # pylint: disable=protected-access
+        except Exception:  # pylint: disable=broad-except
+            version = None
+        if version is None:
+            try:
+                http.http_request(url, version="3")
+            except Exception as error:  # pylint: disable=broad-except
+                assert "HTTP/3 is not supported" in str(error), f"Unexpected error: {error}"
+                return None
+            raise AssertionError("An HTTP/3 request was sent without HTTP/3 support.")
+        if version != getattr(pycurl, "CURL_HTTP_VERSION_3ONLY", None):
+            return "libcurl only supports HTTP/3 with a fallback to TCP"
+        # The stand-in only listens on TCP, so an HTTP/3 only request must fail.
+        result = http.http_request(url, version="3", ignore_ssl=True)
+        assert result["failed"], "An HTTP/3 request succeeded against a TCP-only server."
+    finally:
+        server.shutdown()
+        server.server_close()
+    return None
+
+
+CHECKS = {
+    "http_percentile": check_http_percentile,
+    "http_happy_eyeballs": check_http_happy_eyeballs,
+    "http3_version": check_http3_version,
+}
+
+
+def run_checks(names=None):
+    """Run the checks and print a line per check.
+
+    Args:
+        names (list): The names of the checks to run. Defaults to all of them.
+
+    Returns:
+        int: Returns 1 if any check failed, and 0 otherwise.
+
+    """
+    failed = False
+    for (name, check) in CHECKS.items():
+        if names and name not in names:
+            continue
+        try:
+            reason = check()  # pylint: disable=assignment-from-none, assignment-from-no-return
+        except Exception:  # pylint: disable=broad-except
+            failed = True
+            print(f"FAIL {name}\n{traceback.format_exc()}")
+            continue
+        print(f"SKIP {name}: {reason}" if reason else f"ok   {name}")
+    return 1 if failed else 0
@@ -0,0 +1,242 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import platform
+import resource
+import traceback
+import subprocess
+import multiprocessing
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Audit events of everything that creates a process.
+FORK_EVENTS = frozenset(("os.fork", "os.forkpty", "os.posix_spawn", "subprocess.Popen"))
+
+# Metrics compared by `compare`, and whether a higher value is better.
+METRICS = {"p50_ms": False, "p99_ms": False, "throughput": True, "rss_kb": False}
+
+
+def _percentile(values, percent):
+    """The nearest-rank percentile of the already sorted `values`."""
+    if not values:
+        return None
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def _summarize(times):
+    times = sorted(times)
+    if not times:
+        return {"min_ms": None, "p50_ms": None, "p99_ms": None, "max_ms": None, "mean_ms": None}
+    return {
+        "min_ms": times[0],
+        "p50_ms": _percentile(times, 50),
+        "p99_ms": _percentile(times, 99),
+        "max_ms": times[-1],
+        "mean_ms": sum(times) / len(times),
+    }
+
+
+def _count_forks():
+    """Count the processes created by this process from now on, through audit hooks.
+
+    Returns:
+        list: Returns a single item list holding the running count, or None if this Python
+              has no audit hooks.
+
+    """
+    if not hasattr(sys, "addaudithook"):
+        return None
+    forks = [0]
+
+    def hook(event, _):
+        if event in FORK_EVENTS:
+            forks[0] += 1
+
+    sys.addaudithook(hook)
+    return forks
+
+
+def _get_tree_rss(pids):
+    """Sum the peak RSS in KiB of the provided processes."""
+    rss = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        rss += int(line.split()[1])
+        except OSError:
+            pass
+    return rss
+
+
+def _run_case(case, iterations, processes, connection):
+    """Benchmark a single case in this, freshly forked, process and send back its results."""
+    result = {"skipped": None, "error": None, "iterations": iterations, "failed": 0}
+    try:
+        case.setup()
+        forks = _count_forks()
+        # The first run pays for imports, caches and connection setup; report it on its own.
+        start_time = time.perf_counter()
+        case.run()
+        result["first_ms"] = (time.perf_counter() - start_time) * 1000
+        if forks is not None:
+            forks[0] = 0
+        times = []
+        for _ in range(iterations):
+            start_time = time.perf_counter()
+            result["failed"] += bool(case.run())
+            times.append((time.perf_counter() - start_time) * 1000)
+        result.update(_summarize(times))
+        result["forks_per_test"] = forks[0] / iterations if forks is not None else None
+        tests = case.tests(iterations)
+        result["throughput"] = None
+        if tests is not None:
+            # Throughput goes through the same process pool as the API and the command line.
+            from lib.runner import iter_tests  # pylint: disable=import-outside-toplevel
+
+            start_time = time.perf_counter()
+            for _ in iter_tests(tests, processes, ordered=False):
+                pass
+            result["throughput"] = len(tests) / (time.perf_counter() - start_time)
+        if hasattr(case, "server_pids"):
+            result["rss_kb"] = _get_tree_rss(case.server_pids())
+        else:
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["rss_kb"] = max(usage, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    except Exception:  # pylint: disable=broad-except
+        result["error"] = traceback.format_exc(limit=3).strip().splitlines()[-1]
+    finally:
+        case.teardown()
+    connection.send(result)
+    connection.close()
+
+
+def run_case(case, iterations, processes):
+    """Benchmark a case in a fresh child process, so that the RSS and fork counts of one case
+    don't leak into the next.
+
+    Args:
+        case       (Case): The case to benchmark.
+        iterations (int) : The number of measured runs, after one warm-up run.
+        processes  (int) : The number of pool processes used by the throughput phase.
+
+    Returns:
+        dict: Returns a dictionary object with the case results.
+
+    """
+    reason = case.skip_reason()
+    if reason is not None:
+        return {"skipped": reason}
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case, args=(case, iterations, processes, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"skipped": None, "error": f"Benchmark process died with {process.exitcode}."}
+    process.join()
+    return result
+
+
+def get_meta(**kwargs):
+    """Describe the machine and code that a benchmark ran on."""
+    try:
+        git_rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(RESULTS_DIRECTORY),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_rev = "unknown"
+    meta = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_rev": git_rev,
+        "hostname": socket.gethostname(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+    meta.update(kwargs)
+    return meta
+
+
+def save(report, directory=RESULTS_DIRECTORY):
+    """Store a report as <timestamp>-<git rev>.json for later comparison."""
+    os.makedirs(directory, exist_ok=True)
+    meta = report["meta"]
+    name = f"{meta['timestamp'].replace(':', '')}-{meta['git_rev']}.json"
+    path = os.path.join(directory, name)
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
+    return path
+
+
+def compare(old, new, threshold):
+    """Compare two reports metric by metric.
+
+    Args:
+        old       (dict) : The baseline report.
+        new       (dict) : The report to check against the baseline.
+        threshold (float): The change in percent beyond which a metric is flagged.
+
+    Returns:
+        list: Returns a list of (case, metric, old, new, change, regressed) tuples, where the
+              change is in percent and positive when the metric got worse.
+
+    """
+    rows = []
+    for (name, new_case) in new["cases"].items():
+        old_case = old["cases"].get(name)
+        if not old_case or old_case.get("skipped") or new_case.get("skipped"):
+            continue
+        for (metric, higher_is_better) in METRICS.items():
+            old_value, new_value = old_case.get(metric), new_case.get(metric)
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value * 100
+            if higher_is_better:
+                change = -change
+            rows.append((name, metric, old_value, new_value, change, change > threshold))
+    return rows
+
+
+def _column(value, width, scale=1, digits=2):
+    return f"{value / scale:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+
+
+def format_report(report):
+    lines = [f"{'case':<16}{'p50 ms':>10}{'p99 ms':>10}{'tests/s':>10}{'RSS MiB':>10}{'forks':>7}"]
+    for (name, case) in report["cases"].items():
+        if case.get("skipped"):
+            lines.append(f"{name:<16}  skipped: {case['skipped']}")
+        elif case.get("error"):
+            lines.append(f"{name:<16}  error: {case['error']}")
+        else:
+            lines.append(
+                f"{name:<16}{_column(case['p50_ms'], 10)}{_column(case['p99_ms'], 10)}"
+                f"{_column(case['throughput'], 10, digits=1)}"
+                f"{_column(case['rss_kb'], 10, 1024, 1)}"
+                f"{_column(case['forks_per_test'], 7, digits=1)}"
+                + (f"  ({case['failed']}/{case['iterations']} failed)" if case["failed"] else "")
+            )
+    return "\n".join(lines)
+
+
+def format_comparison(rows, threshold):
+    lines = [f"{'case':<16}{'metric':<12}{'old':>12}{'new':>12}{'change':>9}"]
+    for (name, metric, old_value, new_value, change, regressed) in rows:
+        flag = "  REGRESSION" if regressed else ("  improved" if change < -threshold else "")
+        lines.append(
+            f"{name:<16}{metric:<12}{old_value:>12.2f}{new_value:>12.2f}{change:>+8.1f}%{flag}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,145 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+"""A throwaway network topology for the probe benchmarks.
+
+    root namespace            sb-r (router)                sb-h (host)
+    10.77.1.1/fd77:1::1 <-> 10.77.1.2/fd77:1::2
+                            10.77.2.1/fd77:2::1  <->  10.77.2.2/fd77:2::2
+
+The host namespace runs the stand-ins, so probes from the root namespace cross one router
+hop. When netem is available the router delays (and optionally drops) packets in both
+directions.
+"""
+
+import os
+import json
+import sys
+import time
+import shutil
+import subprocess
+
+ROUTER = "sb-r"
+HOST = "sb-h"
+HOST_ADDRESS = "10.77.2.2"
+HOST_ADDRESS6 = "fd77:2::2"
+ROUTER_ADDRESS = "10.77.1.2"
+
+
+class NetnsError(Exception):
+    """Raised when the benchmark topology can't be created."""
+
+
+def _ip(*args, netns=None, check=True):
+    command = ["ip"] + (["netns", "exec", netns, "ip"] if netns else []) + list(args)
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if check and process.returncode:
+        raise NetnsError(f"'{' '.join(command)}' failed: {process.stderr.decode().strip()}")
+    return process.returncode == 0
+
+
+def _sysctl(netns, name, value):
+    subprocess.run(
+        ["ip", "netns", "exec", netns, "sysctl", "-qw", f"{name}={value}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _add_netem(netns, dev, delay, loss):
+    command = ["ip", "netns", "exec", netns, "tc", "qdisc", "replace", "dev", dev, "root"]
+    command += ["netem", "delay", f"{delay}ms"] + (["loss", f"{loss}%"] if loss else [])
+    return subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+
+class Topology:
+    """Create the router and host namespaces, and run the stand-ins in the host namespace.
+
+    Once entered, `target` describes the stand-ins as expected by `bench.cases.get_cases`.
+    Use it as a context manager so that everything is torn down again, even on errors.
+
+    Args:
+        delay (float): The one way delay in milliseconds added on each router egress.
+        loss  (float): The packet loss in percent added on each router egress.
+
+    """
+
+    def __init__(self, delay=0, loss=0):
+        self.delay = delay
+        self.loss = loss
+        self.netem = False
+        self.standins = None
+        self.target = None
+
+    @staticmethod
+    def available():
+        """Whether or not the topology can be created here at all."""
+        return os.geteuid() == 0 and shutil.which("ip") is not None
+
+    def __enter__(self):
+        if not self.available():
+            raise NetnsError("Creating network namespaces requires root and iproute2.")
+        self.teardown()
+        try:
+            self._create()
+        except BaseException:
+            self.teardown()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        self.teardown()
+
+    def _create(self):
+        for netns in (ROUTER, HOST):
+            _ip("netns", "add", netns)
+            _ip("link", "set", "lo", "up", netns=netns)
+        _ip("link", "add", "sb-c0", "type", "veth", "peer", "name", "sb-r0")
+        _ip("link", "set", "sb-r0", "netns", ROUTER)
+        _ip("link", "add", "sb-r1", "netns", ROUTER, "type", "veth", "peer", "name", "sb-h0")
+        _ip("link", "set", "sb-h0", "netns", HOST)
+        for (netns, dev, addresses) in (
+            (None, "sb-c0", ("10.77.1.1/24", "fd77:1::1/64")),
+            (ROUTER, "sb-r0", ("10.77.1.2/24", "fd77:1::2/64")),
+            (ROUTER, "sb-r1", ("10.77.2.1/24", "fd77:2::1/64")),
+            (HOST, "sb-h0", (f"{HOST_ADDRESS}/24", f"{HOST_ADDRESS6}/64")),
+        ):
+            for address in addresses:
+                _ip("address", "add", address, "dev", dev, "nodad", netns=netns)
+            _ip("link", "set", dev, "up", netns=netns)
+        _sysctl(ROUTER, "net.ipv4.ip_forward", 1)
+        _sysctl(ROUTER, "net.ipv6.conf.all.forwarding", 1)
+        # Keep ICMP errors unthrottled, or traceroute hops would be randomly missing.
+        _sysctl(ROUTER, "net.ipv4.icmp_ratelimit", 0)
+        _sysctl(ROUTER, "net.ipv6.icmp.ratelimit", 0)
+        _ip("route", "add", "10.77.2.0/24", "via", ROUTER_ADDRESS)
+        _ip("-6", "route", "add", "fd77:2::/64", "via", "fd77:1::2")
+        _ip("route", "add", "default", "via", "10.77.2.1", netns=HOST)
+        _ip("-6", "route", "add", "default", "via", "fd77:2::1", netns=HOST)
+        if self.delay or self.loss:
+            self.netem = not any(
+                _add_netem(ROUTER, dev, self.delay, self.loss) for dev in ("sb-r0", "sb-r1")
+            )
+            if not self.netem:
+                print("warning: netem is unavailable, running without delay/loss", file=sys.stderr)
+        self.standins = subprocess.Popen(
+            ["ip", "netns", "exec", HOST, sys.executable, "-m", "bench.standins"]
+            + ["--address", HOST_ADDRESS],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdout=subprocess.PIPE,
+        )
+        try:
+            self.target = json.loads(self.standins.stdout.readline())
+        except ValueError:
+            raise NetnsError("The stand-ins failed to start in the host namespace.")
+        self.target["address6"] = HOST_ADDRESS6
+        # Wait for the IPv6 neighbours and routes to settle.
+        time.sleep(0.5)
+
+    def teardown(self):
+        if self.standins is not None:
+            self.standins.terminate()
+            self.standins.wait()
+            self.standins = None
+        for netns in (ROUTER, HOST):
+            _ip("netns", "delete", netns, check=False)
+        _ip("link", "delete", "sb-c0", check=False)
@@ -0,0 +1,361 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+"""Local stand-ins for the services that Scouter probes: a DNS responder, an HTTP and HTTPS
+server, and a stub of the BrowserUp proxy (BUP) REST API that browser_request talks to.
+
+Run `python -m bench.standins --help` to serve them from another network namespace.
+"""
+
+import os
+import ssl
+import sys
+import json
+import select
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import lib.dnswire as dnswire
+
+PAGE = (
+    b"<!DOCTYPE html><html><head><title>Scouter bench</title>"
+    b'<link rel="stylesheet" href="/style.css"></head><body>bench</body></html>'
+)
+STYLE = b"body { color: black; }"
+
+
+class _DNSHandler(socketserver.BaseRequestHandler):
+    """Answer every A query with the configured address and everything else with an empty
+    NOERROR response, over both UDP and TCP."""
+
+    def handle(self):
+        if isinstance(self.request, tuple):
+            query, sock = self.request
+            sock.sendto(self._answer(query), self.client_address)
+            return
+        length = self.request.recv(2)
+        if len(length) == 2:
+            query = self.request.recv(int.from_bytes(length, "big"))
+            response = self._answer(query)
+            self.request.sendall(len(response).to_bytes(2, "big") + response)
+
+    def _answer(self, query):
+        try:
+            parsed = dnswire.parse_response(query)
+        except dnswire.DNSWireError:
+            return b""
+        question_end = dnswire.decode_name(query, dnswire.HEADER.size)[1] + dnswire.QUESTION.size
+        question = bytes(query[dnswire.HEADER.size : question_end])
+        answers = b""
+        if parsed["question"][1] == 1:
+            # A compression pointer back to the question name at offset 12.
+            answers = b"\xc0\x0c" + dnswire.RECORD.pack(1, 1, 60, 4)
+            answers += socket.inet_aton(self.server.answer_address)
+        flags = 0x8180 | (0x0100 & dnswire.parse_header(query)[1])
+        header = dnswire.HEADER.pack(parsed["id"], flags, 1, 1 if answers else 0, 0, 0)
+        return header + question + answers
+
+
+class _UDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _WebHandler(BaseHTTPRequestHandler):
+    """Serve a page with a single child resource, and /bytes/<n> for sized bodies."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _respond(self, body, content_type="text/html"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.startswith("/bytes/") and self.path[7:].isdigit():
+            self._respond(bytes(min(int(self.path[7:]), 64 * 1024 * 1024)), "application/binary")
+        elif self.path == "/style.css":
+            self._respond(STYLE, "text/css")
+        else:
+            self._respond(PAGE)
+
+    do_HEAD = do_GET
+
+
+class _WebServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class):
+        if ":" in server_address[0]:
+            self.address_family = socket.AF_INET6
+        super().__init__(server_address, handler_class)
+
+
+class _Proxy(ThreadingHTTPServer):
+    """A minimal forwarding HTTP proxy that records a HAR entry for every request."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _ProxyHandler)
+        self.entries = []
+        self.headers = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    """Forward plain HTTP requests and blindly tunnel CONNECT requests. Unlike BUP, tunneled
+    HTTPS requests aren't intercepted and so don't show up in the HAR."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urlsplit(self.path)
+        start_time = time.time()
+        connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=10)
+        headers = {key: value for (key, value) in self.headers.items() if key.lower() != "host"}
+        headers.update(self.server.headers)
+        connection.connect()
+        connect_time = time.time()
+        connection.request(self.command, url.path or "/", headers=headers)
+        response = connection.getresponse()
+        wait_time = time.time()
+        body = response.read()
+        connection.close()
+        self.send_response(response.status, response.reason)
+        for (name, value) in response.getheaders():
+            if name.lower() not in ("transfer-encoding", "connection"):
+                self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.entries.append(
+            {
+                "request": {"url": self.path},
+                "response": {
+                    "status": response.status,
+                    "statusText": response.reason,
+                    "httpVersion": "HTTP/1.1",
+                    "headers": [{"name": n, "value": v} for (n, v) in response.getheaders()],
+                },
+                "timings": {
+                    "comment": "",
+                    "dns": -1,
+                    "connect": (connect_time - start_time) * 1000,
+                    "ssl": -1,
+                    "wait": (wait_time - connect_time) * 1000,
+                },
+                "time": (time.time() - start_time) * 1000,
+            }
+        )
+
+    do_HEAD = do_GET
+
+    def do_CONNECT(self):  # pylint: disable=invalid-name
+        host, port = self.path.rsplit(":", 1)
+        try:
+            upstream = socket.create_connection((host, int(port)), timeout=10)
+        except OSError:
+            self.send_error(502)
+            return
+        self.send_response(200, "Connection Established")
+        self.end_headers()
+        self.close_connection = True
+        with upstream:
+            sockets = [self.connection, upstream]
+            while True:
+                readable, _, _ = select.select(sockets, [], [], 10)
+                if not readable:
+                    return
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    (upstream if sock is self.connection else self.connection).sendall(data)
+
+
+class _BUPHandler(BaseHTTPRequestHandler):
+    """Stub of the BrowserUp proxy REST API calls made by lib.proxy.Proxy."""
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _reply(self, status=200, data=None):
+        body = json.dumps(data if data is not None else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+
+    def _get_proxy(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) >= 2 and parts[1].isdigit():
+            return self.server.proxies.get(int(parts[1])), parts[2:]
+        return None, parts[1:]
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = self._read_body()
+        proxy, rest = self._get_proxy()
+        if self.path.rstrip("/") == "/proxy":
+            proxy = _Proxy()
+            self.server.proxies[proxy.server_address[1]] = proxy
+            return self._reply(data={"port": proxy.server_address[1]})
+        if proxy is None:
+            return self._reply(404)
+        if rest == ["filter", "request"]:
+            # Only the header injections generated by Proxy.inject_headers are understood.
+            for statement in body.decode().split(";"):
+                if statement.startswith("request.headers().add("):
+                    name, value = statement[len("request.headers().add(") : -1].split(", ", 1)
+                    proxy.headers[name.strip("'")] = value.strip("'")
+        return self._reply()
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        self._read_body()
+        proxy, rest = self._get_proxy()
+        if proxy is None:
+            return self._reply(404)
+        if rest == ["har"]:
+            proxy.entries = []
+        return self._reply()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        proxy, rest = self._get_proxy()
+        if proxy is None or rest != ["har"]:
+            return self._reply(404)
+        return self._reply(data={"log": {"entries": proxy.entries}})
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        proxy, _ = self._get_proxy()
+        if proxy is None:
+            return self._reply(404)
+        del self.server.proxies[proxy.server_address[1]]
+        proxy.shutdown()
+        proxy.server_close()
+        return self._reply()
+
+
+def _create_certificate(directory):
+    """Create a throwaway self-signed certificate with openssl, if it's available."""
+    if shutil.which("openssl") is None:
+        return None
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2"]
+        + ["-subj", "/CN=bench.scouter.test", "-keyout", key, "-out", cert],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return cert, key
+
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_dns(address, port, answer_address):
+    """Start the DNS responder over UDP and TCP."""
+    servers = []
+    for server_class in (_UDPServer, _TCPServer):
+        server = server_class((address, port), _DNSHandler)
+        server.answer_address = answer_address
+        servers.append(_serve(server))
+    return servers
+
+
+def start_web(address, http_port, https_port=None):
+    """Start the HTTP server, and the HTTPS server if a certificate could be created.
+
+    Args:
+        address    (str): The IPv4 or IPv6 address to listen on.
+        http_port  (int): The HTTP port, or 0 for any free port.
+        https_port (int): The HTTPS port, or None to only start the HTTP server.
+
+    Returns:
+        list: Returns a list of the started servers.
+
+    """
+    servers = [_serve(_WebServer((address, http_port), _WebHandler))]
+    if https_port is None:
+        return servers
+    certificate = _create_certificate(tempfile.mkdtemp(prefix="scouter-bench-"))
+    if certificate is not None:
+        server = _WebServer((address, https_port), _WebHandler)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*certificate)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        servers.append(_serve(server))
+    return servers
+
+
+def start_bup(port=8080):
+    """Start the BUP API stub on localhost, where browser_request expects BUP to be.
+
+    Returns:
+        ThreadingHTTPServer: Returns the started server, or None if the port is taken, e.g.
+                             by a real BUP.
+
+    """
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _BUPHandler)
+    except OSError:
+        return None
+    server.proxies = {}
+    return _serve(server)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Scouter benchmark stand-ins.")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--dns-port", type=int, default=53)
+    parser.add_argument("--http-port", type=int, default=80)
+    parser.add_argument("--https-port", type=int, default=443)
+    args = parser.parse_args(argv)
+    family = socket.AF_INET6 if ":" in args.address else socket.AF_INET
+    for server_class in (_UDPServer, _TCPServer, ThreadingHTTPServer):
+        server_class.address_family = family
+    start_dns(args.address, args.dns_port, args.address if family == socket.AF_INET else "0.0.0.0")
+    servers = start_web(args.address, args.http_port, args.https_port)
+    # Let the parent know that every stand-in is listening, and where.
+    target = {
+        "address": args.address,
+        "dns_port": args.dns_port,
+        "http_port": args.http_port,
+        "https_port": args.https_port if len(servers) > 1 else None,
+    }
+    print(json.dumps(target), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
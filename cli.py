@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# pylint: disable=locally-disabled, missing-docstring
+
+import os
+import sys
+import json
+import time
+import argparse
+from lib.runner import iter_tests, normalize_test
+from lib.concurrency import ConcurrencyController
+import lib.engine as engine
+
+
+def _read_tests(lines, errors):
+    """Parse the JSONL test lines, reporting every invalid line to `errors` instead of
+    aborting the whole run.
+
+    Every line is a single test of the form {"type": "ping", "options": {"dst": "8.8.8.8"}}.
+
+    """
+    for (number, line) in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            test = json.loads(line)
+            if not isinstance(test, dict) or "type" not in test:
+                raise ValueError("Expected an object with a 'type' and 'options'.")
+            yield normalize_test(test["type"], test.get("options", {}))
+        except (ValueError, TypeError) as error:
+            errors.append(
+                {
+                    "type": None,
+                    "results": {
+                        "id": None,
+                        "failed": True,
+                        "message": f"Line {number} is not a valid test: {error}",
+                        "result": {},
+                    },
+                }
+            )
+
+
+def _write(result, output):
+    output.write(json.dumps(result) + "\n")
+    output.flush()
+
+
+def main(argv=None):
+    """Run the tests of a JSONL file through the Scouter engine and stream their results to
+    stdout as JSONL, without the API, uWSGI or Flask."""
+    parser = argparse.ArgumentParser(
+        description="Run Scouter tests from a JSONL file and stream JSONL results to stdout."
+    )
+    parser.add_argument(
+        "file",
+        nargs="?",
+        default="-",
+        help='The JSONL file of tests, one {"type": ..., "options": {...}} object per line. '
+        "Defaults to stdin.",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="The maximum number of parallel worker processes. 0 runs every test in this "
+        "process, one after the other, which is handy when profiling. Defaults to the number "
+        "of CPUs.",
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        help="Write the results in the order of the input rather than as soon as they complete.",
+    )
+    parser.add_argument(
+        "--capture",
+        choices=engine.CAPTURE_BACKENDS,
+        default="socket",
+        help='The capture backend of ping and traceroute replies. "ring" reads them out of a '
+        "memory-mapped ring shared with the kernel, for high probe rates. Defaults to socket.",
+    )
+    parser.add_argument(
+        "--deadline-ms",
+        type=int,
+        help="The deadline of the whole run, in milliseconds from now. Tests stop at the deadline "
+        "with the results they have so far, and are killed if they don't.",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Adapt the number of tests of every type that run at once to the CPU, memory, "
+        "test latency and capture drops, with --processes as the hard cap.",
+    )
+    args = parser.parse_args(argv)
+    if args.processes < 0:
+        parser.error("The number of processes can't be negative.")
+    if args.deadline_ms is not None and args.deadline_ms <= 0:
+        parser.error("The deadline must be positive.")
+    deadline = time.time() + args.deadline_ms / 1000 if args.deadline_ms is not None else None
+    engine.set_capture(args.capture)
+    errors = []
+    with (sys.stdin if args.file == "-" else open(args.file)) as lines:
+        tests = _read_tests(lines, errors)
+        controller = ConcurrencyController(args.processes) if args.adaptive else None
+        results = iter_tests(
+            tests, args.processes, args.ordered, deadline=deadline, controller=controller
+        )
+        for result in results:
+            while errors:
+                _write(errors.pop(0), sys.stdout)
+            _write(result, sys.stdout)
+    for error in errors:
+        _write(error, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
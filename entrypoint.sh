@@ -5,10 +5,14 @@
 # -----------------------------------------------
 export SCOUTER_MAX_TEST_COUNT=${SCOUTER_MAX_TEST_COUNT:=10}
 export SCOUTER_MAX_PROCESS_COUNT=${SCOUTER_MAX_PROCESS_COUNT:=10}
+export SCOUTER_PRELOAD=${SCOUTER_PRELOAD:=all}
+export SCOUTER_CAPTURE=${SCOUTER_CAPTURE:=socket}
+export SCOUTER_ADAPTIVE_CONCURRENCY=${SCOUTER_ADAPTIVE_CONCURRENCY:=true}
 export API_PORT=${API_PORT:=8000}
 export UWSGI_WORKERS=${UWSGI_WORKERS:=3}
 export UWSGI_CACHE_ITEMS=${UWSGI_CACHE_ITEMS:=100}
 export UWSGI_CACHE_BLOCKSIZE=${UWSGI_CACHE_BLOCKSIZE:=1000000}
+export BUP_ENABLED=${BUP_ENABLED:=true}
 export BUP_PROXY_TTL=${BUP_PROXY_TTL:=300}
 export BUP_PROXY_PORT_RANGE=${BUP_PROXY_PORT_RANGE:=9001-9005}
 
@@ -23,6 +27,9 @@ fi
 /bin/sed -i -e "s/{{SCOUTER_API_SECRET}}/${SCOUTER_API_SECRET}/g" config.cfg
 /bin/sed -i -e "s/{{SCOUTER_MAX_TEST_COUNT}}/${SCOUTER_MAX_TEST_COUNT}/g" config.cfg
 /bin/sed -i -e "s/{{SCOUTER_MAX_PROCESS_COUNT}}/${SCOUTER_MAX_PROCESS_COUNT}/g" config.cfg
+/bin/sed -i -e "s/{{SCOUTER_PRELOAD}}/${SCOUTER_PRELOAD}/g" config.cfg
+/bin/sed -i -e "s/{{SCOUTER_CAPTURE}}/${SCOUTER_CAPTURE}/g" config.cfg
+/bin/sed -i -e "s/{{SCOUTER_ADAPTIVE_CONCURRENCY}}/${SCOUTER_ADAPTIVE_CONCURRENCY}/g" config.cfg
 
 # -----------------------------------------------
 # Pull the latest GeoLite2-ASN MMDB
@@ -47,6 +54,7 @@ echo "===> Configuring Circus"
 /bin/sed -i -e "s/{{UWSGI_WORKERS}}/${UWSGI_WORKERS}/g" /etc/circus.conf
 /bin/sed -i -e "s/{{UWSGI_CACHE_ITEMS}}/${UWSGI_CACHE_ITEMS}/g" /etc/circus.conf
 /bin/sed -i -e "s/{{UWSGI_CACHE_BLOCKSIZE}}/${UWSGI_CACHE_BLOCKSIZE}/g" /etc/circus.conf
+/bin/sed -i -e "s/{{BUP_ENABLED}}/${BUP_ENABLED}/g" /etc/circus.conf
 /bin/sed -i -e "s/{{BUP_PROXY_TTL}}/${BUP_PROXY_TTL}/g" /etc/circus.conf
 /bin/sed -i -e "s/{{BUP_PROXY_PORT_RANGE}}/${BUP_PROXY_PORT_RANGE}/g" /etc/circus.conf
 
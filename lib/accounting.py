@@ -0,0 +1,101 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import os
+import time
+import resource
+import threading
+import lib.constants as constants
+from lib.wrappers import _get_descendant_pids
+
+
+def _get_rss(pid):
+    """Read the RSS of a process in KiB from procfs, or 0 if it's gone."""
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _get_peak_rss():
+    """Read the peak RSS of this process in KiB from procfs, or None."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of this process to its current RSS, see proc(5) clear_refs.
+
+    Returns:
+        bool: Returns whether or not the kernel supports it.
+
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _get_cpu_time():
+    """Get the CPU time in seconds of this process and of its children that it waited for."""
+    cpu_time = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        cpu_time += usage.ru_utime + usage.ru_stime
+    return cpu_time
+
+
+class ResourceMonitor:
+    """Measure what a test costs, from the start to the end of the block.
+
+    The wall and CPU times come from the clock and getrusage(2). The CPU time includes the
+    children that the test waited for, like the browser driver, but not the browser processes
+    that the driver started. The peak RSS of this process is reset at the start where the
+    kernel supports it. The processes that the test starts are sampled every
+    RESOURCE_SAMPLE_INTERVAL seconds, so processes that live for less than that may be missed.
+
+    """
+
+    def __init__(self):
+        self.usage = None
+        self.stopped = threading.Event()
+        self.children = set()
+        self.children_peak_rss = 0
+        self.thread = threading.Thread(target=self._sample, name="resource-monitor", daemon=True)
+
+    def __enter__(self):
+        self.peak_reset = _reset_peak_rss()
+        self.start_time = time.time()
+        self.start_cpu_time = _get_cpu_time()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        self._sample_once()
+        peak_rss = _get_peak_rss() if self.peak_reset else None
+        self.usage = {
+            "wall_ms": round((time.time() - self.start_time) * 1000, 3),
+            "cpu_ms": round((_get_cpu_time() - self.start_cpu_time) * 1000, 3),
+            "peak_rss_kb": peak_rss,
+            "children_peak_rss_kb": self.children_peak_rss,
+            "child_processes": len(self.children),
+        }
+
+    def _sample_once(self):
+        pids = _get_descendant_pids(os.getpid())
+        self.children.update(pids)
+        self.children_peak_rss = max(self.children_peak_rss, sum(_get_rss(pid) for pid in pids))
+
+    def _sample(self):
+        while not self.stopped.wait(constants.RESOURCE_SAMPLE_INTERVAL):
+            self._sample_once()
@@ -0,0 +1,158 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import time
+import threading
+import collections
+import lib.constants as constants
+from lib.wrappers import _get_available_memory, _get_cpu_times
+
+
+def _get_drops(result):
+    """Get the packets dropped by the capture of a test, see `ProbeSession.get_capture`."""
+    test_result = result["results"].get("result")
+    capture = test_result.get("capture") if isinstance(test_result, dict) else None
+    return (capture.get("drops") or 0) if isinstance(capture, dict) else 0
+
+
+class ConcurrencyController:  # pylint: disable=too-many-instance-attributes
+    """Adjust the number of tests of every type that run at once, AIMD-style.
+
+    Limits start at CONCURRENCY_INITIAL_SHARE of the hard cap. Every completed test adds
+    1/limit to the limit of its type, i.e. 1 per `limit` tests, up to the hard cap. The limit is
+    halved instead when the machine or the test is overloaded: the CPU is busier than
+    CONCURRENCY_MAX_CPU, there's less memory available than a test of the type needs, the test
+    took CONCURRENCY_MAX_INFLATION times longer than the fastest of its type, or the kernel
+    dropped some of its replies.
+
+    Controllers are shared by every pool of a process, so that concurrent payloads share the
+    limits. The tests that run are counted across all of those pools, see `acquire`.
+
+    Args:
+        cap (int): The hard cap of every limit.
+
+    """
+
+    def __init__(self, cap):
+        self.cap = cap
+        self.lock = threading.Lock()
+        self.limits = {}
+        self.baselines = {}
+        self.decreased = {}
+        self.running = collections.Counter()
+        self.signals = {"cpu": None, "available_mb": None}
+        self.cpu_times = _get_cpu_times()
+
+    def get_limit(self, test_type):
+        """Get the number of tests of a type that may run at once."""
+        with self.lock:
+            return int(self._get_limit(test_type))
+
+    def _get_limit(self, test_type):
+        initial = max(1, int(self.cap * constants.CONCURRENCY_INITIAL_SHARE))
+        return self.limits.setdefault(test_type, float(initial))
+
+    def can_start(self, test_type):
+        """Check whether or not a test of a type may start, given the tests that are running.
+
+        Args:
+            test_type (str): The type of the test.
+
+        Returns:
+            bool: Returns whether or not the test may start. A test may always start when
+                  nothing else is running, so that every test runs eventually.
+
+        """
+        available = _get_available_memory()
+        with self.lock:
+            return self._can_start(test_type, available)
+
+    def _can_start(self, test_type, available):
+        total = sum(self.running.values())
+        if total == 0:
+            return True
+        if total >= self.cap or self.running[test_type] >= self._get_limit(test_type):
+            return False
+        return available is None or available // 1024 >= self._get_test_memory(test_type)
+
+    def acquire(self, test_type):
+        """Count a test of a type as running if it may start, see `can_start`. Checking and
+        counting at once keeps concurrent payloads from starting tests past the limits.
+
+        Args:
+            test_type (str): The type of the test.
+
+        Returns:
+            bool: Returns whether or not the test may start. Tests that start must be released
+                  once they're done, see `release`.
+
+        """
+        available = _get_available_memory()
+        with self.lock:
+            if not self._can_start(test_type, available):
+                return False
+            self.running[test_type] += 1
+            return True
+
+    def release(self, test_type):
+        """Stop counting a test of a type as running, once it completed or was killed."""
+        with self.lock:
+            self.running[test_type] -= 1
+            if not self.running[test_type]:
+                del self.running[test_type]
+
+    @staticmethod
+    def _get_test_memory(test_type):
+        return constants.CONCURRENCY_TEST_MEMORY_MB.get(
+            test_type, constants.CONCURRENCY_DEFAULT_TEST_MEMORY_MB
+        )
+
+    def _get_cpu(self):
+        """Get the busy fraction of all CPUs since the previous call."""
+        cpu_times = _get_cpu_times()
+        previous, self.cpu_times = self.cpu_times, cpu_times
+        if cpu_times is None or previous is None or cpu_times[1] <= previous[1]:
+            return self.signals["cpu"]
+        return (cpu_times[0] - previous[0]) / (cpu_times[1] - previous[1])
+
+    def record(self, test_type, elapsed, result):
+        """Adjust the limit of a test type with the outcome of one of its tests.
+
+        Args:
+            test_type (str)  : The type of the test.
+            elapsed   (float): The wall time of the test in seconds.
+            result    (dict) : The {"type": ..., "results": ...} result of the test.
+
+        """
+        available = _get_available_memory()
+        with self.lock:
+            limit = self._get_limit(test_type)
+            self.signals["cpu"] = self._get_cpu()
+            self.signals["available_mb"] = available // 1024 if available is not None else None
+            overloaded = bool(_get_drops(result))
+            if (self.signals["cpu"] or 0) > constants.CONCURRENCY_MAX_CPU:
+                overloaded = True
+            if available is not None and available // 1024 < self._get_test_memory(test_type):
+                overloaded = True
+            # Failed tests are often fast failures, which would make for a misleading baseline.
+            if not result["results"].get("failed"):
+                baseline = self.baselines.get(test_type, elapsed)
+                baseline = min(baseline * (1 + constants.CONCURRENCY_BASELINE_DRIFT), elapsed)
+                self.baselines[test_type] = baseline
+                if elapsed > baseline * constants.CONCURRENCY_MAX_INFLATION:
+                    overloaded = True
+            now = time.time()
+            if not overloaded:
+                self.limits[test_type] = min(limit + 1 / limit, float(self.cap))
+            elif now - self.decreased.get(test_type, 0) >= constants.CONCURRENCY_DECREASE_INTERVAL:
+                self.limits[test_type] = max(limit / 2, 1.0)
+                self.decreased[test_type] = now
+
+    def get_state(self):
+        """Get the limits, the hard cap and the latest load signals, for the status endpoint."""
+        with self.lock:
+            return {
+                "cap": self.cap,
+                "limits": {test_type: int(limit) for (test_type, limit) in self.limits.items()},
+                "running": dict(self.running),
+                "signals": dict(self.signals),
+            }
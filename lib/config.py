@@ -28,4 +28,28 @@ def get_config_options(**kwargs):
         config_options["max_process_count"] = int(config.get("Scouter", "max_process_count"))
     except (configparser.NoSectionError, configparser.NoOptionError) as error:
         raise ConfigError(error)
+    # The test types to import before forking the workers. "all" preloads every test type and
+    # "none" leaves every test type to be imported by the first test of its type.
+    preload = config.get("Scouter", "preload", fallback="all").replace(",", " ").split()
+    if preload == ["all"]:
+        config_options["preload"] = None
+    elif preload in ([], ["none"]):
+        config_options["preload"] = []
+    else:
+        config_options["preload"] = preload
+    # The capture backend of the probe engine, see lib.engine.receiver.
+    config_options["capture"] = config.get("Scouter", "capture", fallback="socket") or "socket"
+    if config_options["capture"] not in ("socket", "ring"):
+        raise ConfigError(
+            f"Provided 'capture' of '{config_options['capture']}' is not supported. "
+            "('socket', 'ring')."
+        )
+    # Whether or not to adapt the number of tests of every type that run at once below
+    # max_process_count, see lib.concurrency.
+    adaptive = config.get("Scouter", "adaptive_concurrency", fallback="true") or "true"
+    if adaptive.lower() not in ("true", "false"):
+        raise ConfigError(
+            f"Provided 'adaptive_concurrency' of '{adaptive}' is not supported. ('true', 'false')."
+        )
+    config_options["adaptive_concurrency"] = adaptive.lower() == "true"
     return config_options
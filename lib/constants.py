@@ -2,19 +2,144 @@
 
 # Selenium constants
 WEBPAGE_LOAD_TIMEOUT = 60
+## How browser_request captures the page load. "proxy" collects a HAR from a BUP proxy,
+## "cdp" collects Chrome's DevTools Protocol network events within the browser itself.
+BROWSER_MODES = ("proxy", "cdp")
+## The curl equivalent error codes of the load errors of the BUP proxy and of Chrome.
+BROWSER_ERROR_CODES = {
+    "Unable to resolve host": 6,
+    "net::ERR_NAME_NOT_RESOLVED": 6,
+    "Unable to connect to host": 7,
+    "net::ERR_CONNECTION_REFUSED": 7,
+    "net::ERR_CONNECTION_FAILED": 7,
+    "net::ERR_ADDRESS_UNREACHABLE": 7,
+    "Response timed out": 28,
+    "net::ERR_TIMED_OUT": 28,
+    "net::ERR_CONNECTION_TIMED_OUT": 28,
+    "No response received": 52,
+    "net::ERR_EMPTY_RESPONSE": 52,
+}
 
-# Scapy general constants
+# Packet general constants
 PACKET_PAYLOAD_SIZE = 56
 PACKET_SEND_RETRY = 0
 PACKET_SEND_DELAY = 1
 PACKET_RECV_TIMEOUT = 1
+PACKET_TTL = 64
 
 ## traceroute/dns_traceroute specific constants
+ASN_MMDB_PATH = "mmdb/GeoLite2-ASN.mmdb"
 TRACE_MIN_TTL = 1
 TRACE_MAX_TTL = 32
+# Every hop is probed at once, so this is how long the whole trace waits for replies.
+TRACE_TIMEOUT = 3
+
+## pmtu specific constants
+PMTU_MIN_MTU = {4: 68, 6: 1280}
+PMTU_MAX_MTU = 1500
+PMTU_MAX_MTU_LIMIT = 9216
+PMTU_PROBES = 8
+PMTU_MAX_PROBES = 32
+PMTU_MAX_ROUNDS = 8
+
+## tcp_ping specific constants
+TCP_PING_MODES = ("syn", "connect")
+TCP_PING_COUNT = 3
+TCP_PING_MAX_COUNT = 20
+TCP_PING_MAX_TARGETS = 1000
+TCP_PING_MAX_CONCURRENT = 256
+
+## tls_probe specific constants
+TLS_PROBE_TIMEOUT = 5
+TLS_PROBE_MAX_TARGETS = 500
+TLS_PROBE_MAX_CONCURRENT = 64
+TLS_TICKET_WAIT = 0.25
+## Host names are resolved concurrently by this many threads, and probes check whether their
+## host name was resolved every poll interval in seconds.
+TLS_RESOLVE_WORKERS = 16
+TLS_RESOLVE_POLL = 0.01
+TLS_EXPIRY_WARNING_DAYS = 30
 
 ## dns_lookup specific constants
 DNS_TIMEOUT = 3
+DNS_LOOKUP_MODES = ("sequential", "race", "compare")
+DNS_MAX_CONCURRENT_NS = 16
+
+## dns_bulk specific constants
+DNS_BULK_MAX_QUERIES = 10000
+DNS_BULK_WINDOW = 100
+DNS_BULK_MAX_WINDOW = 1000
+DNS_BULK_TIMEOUT = 2
+DNS_BULK_RETRY = 1
+
+## dns_delegation_trace specific constants
+DNS_ROOT_HINTS = (
+    ("a.root-servers.net.", "198.41.0.4"),
+    ("b.root-servers.net.", "170.247.170.2"),
+    ("c.root-servers.net.", "192.33.4.12"),
+    ("d.root-servers.net.", "199.7.91.13"),
+    ("e.root-servers.net.", "192.203.230.10"),
+    ("f.root-servers.net.", "192.5.5.241"),
+    ("g.root-servers.net.", "192.112.36.4"),
+    ("h.root-servers.net.", "198.97.190.53"),
+    ("i.root-servers.net.", "192.36.148.17"),
+    ("j.root-servers.net.", "192.58.128.30"),
+    ("k.root-servers.net.", "193.0.14.129"),
+    ("l.root-servers.net.", "199.7.83.42"),
+    ("m.root-servers.net.", "202.12.27.33"),
+)
+DNS_DELEGATION_MAX_DEPTH = 16
+DNS_DELEGATION_MAX_NS = 13
+DNS_DELEGATION_MAX_GLUELESS = 4
+DNS_DELEGATION_CACHE_MAX_TTL = 3600
+DNS_DELEGATION_CACHE_MAX_ZONES = 1000
 
 # PycURL constants
 CURL_TIMEOUT = 10
+CURL_MAX_RESOLVE = 64
+CURL_MAX_REPEAT = 100
+
+## http_request streaming specific constants
+CURL_STREAM_BUFFER_SIZE = 262144
+CURL_STREAM_MAX_TIME = 60
+CURL_STREAM_SAMPLE_INTERVAL = 100
+CURL_STREAM_DIGESTS = ("md5", "sha1", "sha256", "sha512")
+
+# Deadline and cancellation constants
+## Test results expire from the cache after 10 minutes, so no test may run for longer.
+MAX_DEADLINE_MS = 600000
+## The number of seconds that tests get to stop on their own after their deadline, before
+## they're interrupted and then killed along with their browsers.
+DEADLINE_GRACE = 2
+CANCEL_POLL_INTERVAL = 0.25
+
+# Result retrieval constants
+BULK_MAX_RECEIPTS = 1000
+
+# Adaptive concurrency constants
+## The limits start at this fraction of the hard cap, max_process_count. They start at the cap,
+## as fixed limits used to, and are only backed off from once a test type sees congestion.
+CONCURRENCY_INITIAL_SHARE = 1.0
+## Limits are halved when the CPU is busier than this, as a fraction of all CPUs.
+CONCURRENCY_MAX_CPU = 0.9
+## Limits are halved when tests take this many times longer than the fastest of their type.
+CONCURRENCY_MAX_INFLATION = 3.0
+## The fastest time of a test type slowly drifts up, so that it's never stale for long.
+CONCURRENCY_BASELINE_DRIFT = 0.01
+## Limits are halved at most once per interval in seconds, rather than once per completed test
+## of a burst of slow tests.
+CONCURRENCY_DECREASE_INTERVAL = 5
+## The memory in MiB that a test of a type needs to start while other tests are running.
+CONCURRENCY_TEST_MEMORY_MB = {"browser_request": 400}
+CONCURRENCY_DEFAULT_TEST_MEMORY_MB = 50
+
+# Resource accounting and watchdog constants
+RESOURCE_SAMPLE_INTERVAL = 0.1
+## Pool processes are replaced after this many tests, or once their RSS grows past this many
+## KiB, so that leaks don't build up in them.
+POOL_MAX_TASKS_PER_CHILD = 100
+POOL_MAX_RSS_KB = 524288
+## Browser drivers left behind by killed tests, once they've been reparented to init. They're
+## looked for every interval in seconds, and once a pool is done.
+ORPHAN_PROCESS_NAMES = ("chromedriver", "geckodriver")
+ORPHAN_CHECK_INTERVAL = 10
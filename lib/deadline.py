@@ -0,0 +1,69 @@
+# pylint: disable=locally-disabled, missing-docstring, global-statement
+
+import time
+import signal
+import threading
+import contextlib
+
+# The deadline of the test running in this process, as a time.time() timestamp. Test
+# processes run a single test at a time, so there's no need for anything finer grained.
+_DEADLINE = None
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a test keeps running past its deadline."""
+
+
+def get_remaining():
+    """Get the number of seconds left until the deadline of the running test.
+
+    Returns:
+        float: Returns the remaining seconds, no less than 0, or None if there's no deadline.
+
+    """
+    if _DEADLINE is None:
+        return None
+    return max(_DEADLINE - time.time(), 0.0)
+
+
+def clamp(timeout):
+    """Shorten a timeout in seconds so that it doesn't run past the deadline."""
+    remaining = get_remaining()
+    return timeout if remaining is None else min(timeout, remaining)
+
+
+def is_expired():
+    """Check whether or not the deadline of the running test has passed."""
+    return _DEADLINE is not None and time.time() >= _DEADLINE
+
+
+def _raise_deadline_exceeded(*_):
+    raise DeadlineExceeded("Test was stopped at its deadline.")
+
+
+@contextlib.contextmanager
+def deadline(timestamp, grace):
+    """Set the deadline of the test running in the block.
+
+    Tests stop cooperatively at their deadline with whatever results they have, see
+    `clamp` and `is_expired`. Tests still running `grace` seconds later are interrupted with a
+    DeadlineExceeded exception, which is only possible in the main thread.
+
+    Args:
+        timestamp (float): The deadline, as a time.time() timestamp, or None for no deadline.
+        grace     (float): The number of seconds that tests get to stop on their own.
+
+    """
+    global _DEADLINE
+    previous, _DEADLINE = _DEADLINE, timestamp
+    alarm = timestamp is not None and threading.current_thread() is threading.main_thread()
+    if alarm:
+        handler = signal.signal(signal.SIGALRM, _raise_deadline_exceeded)
+        signal.setitimer(signal.ITIMER_REAL, max(timestamp - time.time(), 0.0) + grace)
+    try:
+        yield
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, handler)
+        _DEADLINE = previous
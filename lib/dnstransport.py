@@ -0,0 +1,250 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import os
+import ssl
+import time
+import socket
+import struct
+import http.client
+import multiprocessing.util
+
+TRANSPORTS = ("udp", "tcp", "tls", "https")
+DEFAULT_PORTS = {"udp": 53, "tcp": 53, "tls": 853, "https": 443}
+
+# Connections are kept per process and reused by every later query sent to the same server.
+# Pool processes only live for a payload, and are recycled within it, so a connection is only
+# reused by the tests of one payload that happen to run in the same pool process. They're
+# closed when the process exits, see `_get_connection`.
+_CONNECTIONS = {}
+# The PID of the process that registered `close_connections` to run at its exit.
+_FINALIZED_PID = None
+
+
+class DNSTransportError(Exception):
+    """Raised when a DNS query can't be sent or answered over a stream transport."""
+
+
+def _recv_exactly(sock, size):
+    """Read exactly `size` bytes from a stream socket."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            raise ConnectionResetError("Connection closed by the nameserver.")
+        received += count
+    return bytes(buffer)
+
+
+class _StreamConnection:
+    """A persistent DNS over TCP connection, optionally wrapped in TLS (DoT).
+
+    Attributes:
+        timings (dict): The connect and handshake times in milliseconds of the last
+                        established connection.
+
+    """
+
+    def __init__(self, host, port, timeout, tls_context=None, server_hostname=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.tls_context = tls_context
+        self.server_hostname = server_hostname
+        self.sock = None
+        self.timings = {"connect_ms": None, "handshake_ms": None}
+
+    def connect(self):
+        """Open the TCP connection and perform the TLS handshake if required."""
+        start_time = time.time()
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.timings["connect_ms"] = (time.time() - start_time) * 1000
+        self.timings["handshake_ms"] = None
+        if self.tls_context is not None:
+            start_time = time.time()
+            try:
+                sock = self.tls_context.wrap_socket(sock, server_hostname=self.server_hostname)
+            except (ssl.SSLError, OSError):
+                sock.close()
+                raise
+            self.timings["handshake_ms"] = (time.time() - start_time) * 1000
+        self.sock = sock
+
+    def query(self, message):
+        """Send a DNS message with the two byte length prefix and read the response."""
+        self.sock.sendall(struct.pack("!H", len(message)) + bytes(message))
+        length = struct.unpack("!H", _recv_exactly(self.sock, 2))[0]
+        return _recv_exactly(self.sock, length)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class _HTTPSConnection(_StreamConnection):
+    """A persistent DNS over HTTPS (RFC 8484) connection using HTTP/1.1 keep-alive."""
+
+    def __init__(self, host, port, timeout, tls_context, server_hostname=None, path=None):
+        super().__init__(host, port, timeout, tls_context, server_hostname)
+        self.path = path or "/dns-query"
+        self.http = None
+
+    def connect(self):
+        super().connect()
+        self.http = http.client.HTTPSConnection(
+            self.server_hostname or self.host, self.port, timeout=self.timeout
+        )
+        # Hand our already established and timed TLS socket to http.client.
+        self.http.sock = self.sock
+
+    def query(self, message):
+        self.http.request(
+            "POST",
+            self.path,
+            body=bytes(message),
+            headers={
+                "Content-Type": "application/dns-message",
+                "Accept": "application/dns-message",
+            },
+        )
+        response = self.http.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise DNSTransportError(
+                f"DoH server responded with '{response.status} {response.reason}'."
+            )
+        return body
+
+    def close(self):
+        if self.http is not None:
+            self.http.close()
+            self.http = None
+        self.sock = None
+
+
+def _create_tls_context(ignore_ssl, alpn):
+    context = ssl.create_default_context()
+    if ignore_ssl:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols([alpn])
+    return context
+
+
+def _get_connection(transport, host, port, timeout, **kwargs):
+    """Get an established connection for the provided server, reusing a previously opened
+    one if available.
+
+    Returns:
+        tuple: Returns a tuple of the connection and whether or not it was reused.
+
+    """
+    server_hostname = kwargs.get("server_hostname", None)
+    path = kwargs.get("path", None)
+    ignore_ssl = bool(kwargs.get("ignore_ssl", False))
+    if transport == "tcp":
+        key = (transport, host, port)
+    else:
+        key = (transport, host, port, server_hostname, path, ignore_ssl)
+    connection = _CONNECTIONS.get(key)
+    if connection is not None:
+        # Every query has its own timeout, e.g. shortened to its test's deadline.
+        connection.sock.settimeout(timeout)
+        return connection, True
+    if transport == "tcp":
+        connection = _StreamConnection(host, port, timeout)
+    elif transport == "tls":
+        context = _create_tls_context(ignore_ssl, "dot")
+        connection = _StreamConnection(host, port, timeout, context, server_hostname)
+    else:
+        context = _create_tls_context(ignore_ssl, "http/1.1")
+        connection = _HTTPSConnection(host, port, timeout, context, server_hostname, path)
+    connection.connect()
+    _CONNECTIONS[key] = connection
+    _register_exit()
+    return connection, False
+
+
+def _register_exit():
+    """Close the connections of this process when it exits. Pool processes don't run atexit
+    handlers but do run multiprocessing finalizers, which also run at interpreter exit."""
+    global _FINALIZED_PID  # pylint: disable=global-statement
+    if _FINALIZED_PID != os.getpid():
+        multiprocessing.util.Finalize(None, close_connections, exitpriority=0)
+        _FINALIZED_PID = os.getpid()
+
+
+def query(transport, message, host, port=None, timeout=3, **kwargs):
+    """Send a wire format DNS query over a persistent TCP, TLS or HTTPS connection.
+
+    A connection that was closed by the server since it was last used is transparently
+    re-established once. Connections are only reused within this process, see _CONNECTIONS.
+    A response whose transaction id doesn't match the query's is treated like a broken
+    connection, as the stream can no longer be trusted to be in sync.
+
+    Args:
+        transport          (str)  : One of "tcp", "tls" or "https".
+        message            (bytes): The wire format DNS query.
+        host               (str)  : The nameserver IP address.
+        port               (int)  : The nameserver port. Defaults to the transport's port.
+        timeout            (int)  : The socket timeout in seconds.
+        **server_hostname  (str)  : The TLS server name (SNI) and HTTP host to use.
+        **path             (str)  : The DoH URL path. Defaults to "/dns-query".
+        **ignore_ssl       (bool) : Whether or not to disable certificate checks.
+
+    Returns:
+        tuple: Returns a tuple of the raw DNS response and a dict of timings with the
+               connect, handshake and query times in milliseconds plus whether or not the
+               connection was reused.
+
+    """
+    port = port if port is not None else DEFAULT_PORTS[transport]
+    if transport != "tcp" and not kwargs.get("ignore_ssl") and not kwargs.get("server_hostname"):
+        raise DNSTransportError(
+            f"A TLS server name is required to verify the certificate of '{host}'. "
+            "Provide a nameserver name or disable certificate checks."
+        )
+    for attempt in range(2):
+        try:
+            connection, reused = _get_connection(transport, host, port, timeout, **kwargs)
+        except (ssl.SSLError, OSError) as error:
+            raise DNSTransportError(
+                f"Unable to connect to '{host}:{port}' over {transport.upper()}: {error}"
+            )
+        start_time = time.time()
+        try:
+            response = connection.query(message)
+            if len(response) < 2 or response[:2] != bytes(message[:2]):
+                raise ConnectionError("The response's transaction id doesn't match the query.")
+        except (OSError, http.client.HTTPException) as error:
+            close_connection(connection)
+            if reused and attempt == 0:
+                continue
+            raise DNSTransportError(
+                f"Unable to query '{host}:{port}' over {transport.upper()}: {error}"
+            )
+        timings = {
+            "connect_ms": None if reused else connection.timings["connect_ms"],
+            "handshake_ms": None if reused else connection.timings["handshake_ms"],
+            "query_ms": (time.time() - start_time) * 1000,
+            "reused": reused,
+        }
+        return response, timings
+    return None
+
+
+def close_connection(connection):
+    """Close a connection and forget about it."""
+    for (key, value) in list(_CONNECTIONS.items()):
+        if value is connection:
+            del _CONNECTIONS[key]
+    connection.close()
+
+
+def close_connections():
+    """Close every persistent connection opened by this process."""
+    for connection in list(_CONNECTIONS.values()):
+        close_connection(connection)
@@ -0,0 +1,293 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import socket
+import struct
+import functools
+
+RDTYPES = {
+    "A": 1,
+    "NS": 2,
+    "CNAME": 5,
+    "SOA": 6,
+    "PTR": 12,
+    "HINFO": 13,
+    "MX": 15,
+    "TXT": 16,
+    "AAAA": 28,
+    "SRV": 33,
+    "NAPTR": 35,
+    "DS": 43,
+    "SSHFP": 44,
+    "RRSIG": 46,
+    "NSEC": 47,
+    "DNSKEY": 48,
+    "NSEC3": 50,
+    "TLSA": 52,
+    "SVCB": 64,
+    "HTTPS": 65,
+    "ANY": 255,
+    "CAA": 257,
+}
+RDTYPE_NAMES = {value: key for (key, value) in RDTYPES.items()}
+
+RCLASSES = {1: "IN", 2: "CS", 3: "CH", 4: "HS", 255: "ANY"}
+
+RCODES = {
+    0: "ok",
+    1: "format-error",
+    2: "server-failure",
+    3: "name-error",
+    4: "not-implemented",
+    5: "refused",
+}
+
+HEADER = struct.Struct("!HHHHHH")
+QUESTION = struct.Struct("!HH")
+RECORD = struct.Struct("!HHIH")
+
+# Record types whose rdata is decoded into its presentation format by `decode_rdata`.
+DECODED_RDTYPES = frozenset((1, 2, 5, 6, 12, 15, 16, 28, 33))
+
+
+class DNSWireError(Exception):
+    """Raised when a DNS message can't be encoded or decoded."""
+
+
+def get_rdtype(rdtype):
+    """Translate a record type name such as "AAAA" or "TYPE28", or a number, into its
+    numeric value."""
+    if isinstance(rdtype, int):
+        return rdtype
+    rdtype = str(rdtype).upper()
+    if rdtype in RDTYPES:
+        return RDTYPES[rdtype]
+    if rdtype.isdigit():
+        return int(rdtype)
+    if rdtype.startswith("TYPE") and rdtype[4:].isdigit():
+        return int(rdtype[4:])
+    raise DNSWireError(f"Provided record type of '{rdtype}' is not a recognized type.")
+
+
+def get_rdtype_name(rdtype):
+    """Translate a numeric record type into its name."""
+    return RDTYPE_NAMES.get(rdtype, f"TYPE{rdtype}")
+
+
+def encode_name(name):
+    """Encode a domain name into its uncompressed wire format."""
+    encoded = bytearray()
+    for label in name.rstrip(".").split("."):
+        if not label:
+            if name.strip(".") == "":
+                break
+            raise DNSWireError(f"Provided name of '{name}' contains an empty label.")
+        label = label.encode("idna") if not label.isascii() else label.encode()
+        if len(label) > 63:
+            raise DNSWireError(f"Provided name of '{name}' contains a label over 63 bytes.")
+        encoded.append(len(label))
+        encoded += label
+    encoded.append(0)
+    if len(encoded) > 255:
+        raise DNSWireError(f"Provided name of '{name}' is longer than 255 bytes.")
+    return bytes(encoded)
+
+
+@functools.lru_cache(maxsize=4096)
+def _encode_question(qname, rdtype):
+    """Encode and cache the question section for a qname and numeric record type."""
+    return encode_name(qname) + QUESTION.pack(rdtype, 1)
+
+
+def build_query(qname, rdtype="A", txid=0, recursion=True):
+    """Build a DNS query in wire format.
+
+    The question section is cached per qname and record type, so repeated queries only
+    cost a header pack and a copy.
+
+    Args:
+        qname     (str) : The domain name to query.
+        rdtype    (str) : The record type name or number to query for. Defaults to "A".
+        txid      (int) : The transaction id. Defaults to 0 so that callers can patch it in
+                          place with `set_txid` before sending.
+        recursion (bool): Whether or not to set the recursion desired flag.
+
+    Returns:
+        bytearray: Returns a mutable bytearray containing the DNS query.
+
+    """
+    flags = 0x0100 if recursion else 0
+    query = bytearray(HEADER.pack(txid, flags, 1, 0, 0, 0))
+    query += _encode_question(qname, get_rdtype(rdtype))
+    return query
+
+
+def set_txid(message, txid):
+    """Patch the transaction id of a wire format DNS message in place."""
+    struct.pack_into("!H", message, 0, txid)
+
+
+def get_txid(message):
+    """Get the transaction id of a wire format DNS message."""
+    return struct.unpack_from("!H", message, 0)[0]
+
+
+def decode_name(message, offset):
+    """Decode a possibly compressed domain name.
+
+    Args:
+        message (memoryview): The DNS message.
+        offset  (int)       : The offset of the name within the message.
+
+    Returns:
+        tuple: Returns a tuple of the decoded name and the offset right after it.
+
+    """
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(message):
+            raise DNSWireError("Truncated domain name.")
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise DNSWireError("Compression pointer loop.")
+            offset = struct.unpack_from("!H", message, offset)[0] & 0x3FFF
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(str(message[offset : offset + length], "ascii", "replace"))
+        offset += length
+    return ".".join(labels) + ".", end if end is not None else offset
+
+
+def _decode_character_strings(rdata):
+    """Decode the <character-string> list used by TXT records."""
+    strings = []
+    offset = 0
+    while offset < len(rdata):
+        length = rdata[offset]
+        strings.append(str(rdata[offset + 1 : offset + 1 + length], "utf-8", "replace"))
+        offset += 1 + length
+    return strings
+
+
+def decode_rdata(message, rdtype, offset, rdlen):
+    """Decode the rdata of a resource record into its presentation format.
+
+    Record types that aren't in `DECODED_RDTYPES` are returned as a hex string.
+
+    Args:
+        message (memoryview): The DNS message. Names in rdata may point anywhere in it.
+        rdtype  (int)       : The numeric record type.
+        offset  (int)       : The offset of the rdata within the message.
+        rdlen   (int)       : The length of the rdata.
+
+    Returns:
+        str: Returns a str object of the decoded rdata.
+
+    """
+    rdata = message[offset : offset + rdlen]
+    if rdtype == 1 and rdlen == 4:
+        return socket.inet_ntop(socket.AF_INET, rdata)
+    if rdtype == 28 and rdlen == 16:
+        return socket.inet_ntop(socket.AF_INET6, rdata)
+    if rdtype in (2, 5, 12):
+        return decode_name(message, offset)[0]
+    if rdtype == 15:
+        preference = struct.unpack_from("!H", message, offset)[0]
+        return f"{preference} {decode_name(message, offset + 2)[0]}"
+    if rdtype == 16:
+        return " ".join(_decode_character_strings(rdata))
+    if rdtype == 6:
+        mname, next_offset = decode_name(message, offset)
+        rname, next_offset = decode_name(message, next_offset)
+        timers = struct.unpack_from("!IIIII", message, next_offset)
+        return " ".join([mname, rname] + [str(timer) for timer in timers])
+    if rdtype == 33:
+        priority, weight, port = struct.unpack_from("!HHH", message, offset)
+        return f"{priority} {weight} {port} {decode_name(message, offset + 6)[0]}"
+    return rdata.hex()
+
+
+def parse_header(message):
+    """Parse only the header of a wire format DNS message.
+
+    Returns:
+        tuple: Returns a tuple of (id, flags, qdcount, ancount, nscount, arcount).
+
+    """
+    if len(message) < HEADER.size:
+        raise DNSWireError("DNS message is shorter than its header.")
+    return HEADER.unpack_from(message, 0)
+
+
+def _parse_records(message, offset, count):
+    """Parse `count` resource records starting at `offset`.
+
+    Returns:
+        tuple: Returns a tuple of the list of (rrname, type, rclass, ttl, rdlen, rdata)
+               tuples and the offset right after the last record.
+
+    """
+    records = []
+    for _ in range(count):
+        rrname, offset = decode_name(message, offset)
+        rdtype, rclass, ttl, rdlen = RECORD.unpack_from(message, offset)
+        offset += RECORD.size
+        if offset + rdlen > len(message):
+            raise DNSWireError("Truncated resource record.")
+        rdata = decode_rdata(message, rdtype, offset, rdlen)
+        records.append((rrname, rdtype, rclass, ttl, rdlen, rdata))
+        offset += rdlen
+    return records, offset
+
+
+def parse_response(message, full=False):
+    """Parse a wire format DNS response.
+
+    The message is walked through a memoryview, so nothing is copied apart from the
+    decoded names and rdata strings themselves.
+
+    Args:
+        message (bytes): The raw DNS response. Any bytes-like object is accepted.
+        full    (bool) : Whether or not to also parse the authority and additional sections.
+                         Defaults to False.
+
+    Returns:
+        dict: Returns a dictionary object with the transaction id, rcode, authoritative and
+              truncation flags, the (qname, qtype, qclass) question and a list of
+              (rrname, type, rclass, ttl, rdlen, rdata) answer tuples. The authority and
+              additional sections are included in the same format if `full` is set.
+
+    """
+    message = memoryview(message)
+    txid, flags, qdcount, ancount, nscount, arcount = parse_header(message)
+    offset = HEADER.size
+    question = None
+    try:
+        for _ in range(qdcount):
+            qname, offset = decode_name(message, offset)
+            qtype, qclass = QUESTION.unpack_from(message, offset)
+            offset += QUESTION.size
+            if question is None:
+                question = (qname, qtype, qclass)
+        answer, offset = _parse_records(message, offset, ancount)
+        response = {
+            "id": txid,
+            "rcode": flags & 0x000F,
+            "aa": bool(flags & 0x0400),
+            "tc": bool(flags & 0x0200),
+            "question": question,
+            "answer": answer,
+        }
+        if full:
+            response["authority"], offset = _parse_records(message, offset, nscount)
+            response["additional"], offset = _parse_records(message, offset, arcount)
+    except struct.error:
+        raise DNSWireError("Truncated DNS message.")
+    return response
@@ -0,0 +1,33 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+__version__ = "1.0.0"
+
+from .packets import (
+    ProbeTemplate,
+    Reply,
+    checksum,
+    get_dispatch_key,
+    get_source_address,
+    parse_reply,
+)
+from .sender import ProbeBatch, RawSender
+from .receiver import CAPTURE_BACKENDS, Receiver, get_receiver, set_capture
+from .probes import ProbeSession, ProbeSet, send_probes
+
+__all__ = [
+    "CAPTURE_BACKENDS",
+    "ProbeBatch",
+    "ProbeSession",
+    "ProbeSet",
+    "ProbeTemplate",
+    "RawSender",
+    "Receiver",
+    "Reply",
+    "checksum",
+    "get_dispatch_key",
+    "get_receiver",
+    "get_source_address",
+    "parse_reply",
+    "send_probes",
+    "set_capture",
+]
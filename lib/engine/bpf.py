@@ -0,0 +1,53 @@
+# pylint: disable=locally-disabled, missing-docstring, too-few-public-methods
+
+import socket
+import struct
+import ctypes
+
+SO_ATTACH_FILTER = 26
+
+# Classic BPF opcodes.
+BPF_LD_W_ABS = 0x20
+BPF_LD_B_ABS = 0x30
+BPF_LD_B_IND = 0x50
+BPF_LDX_B_MSH = 0xB1
+BPF_AND_K = 0x54
+BPF_JA = 0x05
+BPF_JEQ_K = 0x15
+BPF_JSET_K = 0x45
+BPF_RET_K = 0x06
+# Ancillary loads of the packet's protocol and type, relative to SKF_AD_OFF.
+SKF_AD_PROTOCOL = (-0x1000 + 0) & 0xFFFFFFFF
+SKF_AD_PKTTYPE = (-0x1000 + 4) & 0xFFFFFFFF
+
+# A program that drops every packet, for sockets that are only ever sent from.
+DROP_ALL = [("", BPF_RET_K, None, None, 0)]
+
+
+def assemble(program):
+    """Resolve the labels of a BPF program and pack it into an array of sock_filter.
+
+    Programs are lists of (label, opcode, jump if true, jump if false, operand) tuples, where
+    jumps and the operand of unconditional jumps are label names. Jumps can only go forward.
+
+    """
+    labels = {label: index for (index, (label, *_)) in enumerate(program) if label}
+    instructions = b""
+    for (index, (_, code, true, false, operand)) in enumerate(program):
+        if code == BPF_JA:
+            operand = labels[operand] - index - 1
+        jump_true = labels[true] - index - 1 if true else 0
+        jump_false = labels[false] - index - 1 if false else 0
+        instructions += struct.pack("HBBI", code, jump_true, jump_false, operand)
+    return instructions
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.c_void_p)]
+
+
+def attach_filter(sock, program):
+    """Attach a BPF program to a socket, see `assemble`."""
+    instructions = ctypes.create_string_buffer(assemble(program))
+    fprog = _SockFprog(len(program), ctypes.addressof(instructions))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(fprog))
@@ -0,0 +1,418 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import sys
+import array
+import random
+import socket
+import struct
+import ipaddress
+
+# The size of the IP header, keyed by IP version.
+IP_HEADER_SIZE = {4: 20, 6: 40}
+# The IP protocol number and transport header size, keyed by protocol name.
+PROTO_NUMBERS = {"ICMP": 1, "TCP": 6, "UDP": 17}
+PROTO_HEADER_SIZE = {"ICMP": 8, "TCP": 20, "UDP": 8}
+# The protocol number of ICMP, keyed by IP version.
+ICMP_NUMBERS = {4: 1, 6: 58}
+# The echo request and reply types, keyed by IP version.
+ECHO_REQUEST = {4: 8, 6: 128}
+ECHO_REPLY = {4: 0, 6: 129}
+# The ICMP error types that quote the offending packet, keyed by IP version.
+ICMP_ERRORS = {4: frozenset((3, 4, 5, 11, 12)), 6: frozenset((1, 2, 3, 4))}
+TCP_SYN = 0x02
+TCP_RST = 0x04
+
+
+def checksum(data):
+    """Compute the internet checksum (RFC 1071) of the provided bytes."""
+    if len(data) % 2:
+        data = bytes(data) + b"\0"
+    # Summing native 16-bit words and swapping the folded result is equivalent to summing
+    # network order words (RFC 1071, section 2.B), and a lot faster than a Python loop.
+    total = sum(array.array("H", bytes(data)))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    if sys.byteorder == "little":
+        total = ((total << 8) & 0xFF00) | (total >> 8)
+    return ~total & 0xFFFF
+
+
+def _adjust_checksum(buffer, offset, old_words, new_words):
+    """Update the checksum at `offset` in place after 16-bit words changed (RFC 1624)."""
+    total = ~struct.unpack_from("!H", buffer, offset)[0] & 0xFFFF
+    for word in old_words:
+        total += ~word & 0xFFFF
+    total += sum(new_words)
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    struct.pack_into("!H", buffer, offset, ~total & 0xFFFF)
+
+
+def _words(value, count):
+    """Split an integer into `count` 16-bit words, most significant first."""
+    return [(value >> (16 * index)) & 0xFFFF for index in reversed(range(count))]
+
+
+def get_source_address(dst):
+    """Get the local address that the kernel would send packets to `dst` from.
+
+    Connecting a UDP socket doesn't send anything, it only resolves the route.
+
+    """
+    family = socket.AF_INET6 if ipaddress.ip_address(dst).version == 6 else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.connect((dst, 33434))
+        return sock.getsockname()[0]
+
+
+class ProbeTemplate:
+    """A probe that is serialized once and only patched per send.
+
+    Every probe of a template carries its own sequence number, which is written where it
+    survives in the replies and in the packet quoted by ICMP errors: the echo sequence number
+    for ICMP, the sequence number for TCP SYNs and the source port for UDP. The TTL, the IPv4
+    id and the checksums are patched in place, without rebuilding the packet.
+
+    IPv4 probes include the IP header, which is sent as is. IPv6 probes start at the
+    transport header, as the kernel builds the IPv6 header (and the checksum) itself and the
+    hop limit is passed along with every packet.
+
+    Args:
+        dst      (str)  : The destination IP address.
+        proto    (str)  : The protocol, one of ICMP, TCP or UDP.
+        payload  (bytes): The payload after the transport header.
+        sport    (int)  : The base source port of TCP and UDP probes. Defaults to a random
+                          port.
+        dport    (int)  : The destination port of TCP and UDP probes.
+        ident    (int)  : The ICMP echo identifier, and the base IPv4 id. Defaults to random.
+        df       (bool) : Whether or not to keep the probes from being fragmented. The IPv4
+                          don't fragment flag is set, and the sender neither fragments nor
+                          refuses probes because of the path MTU that it knows of.
+        flags    (int)  : The flags of TCP probes. Defaults to SYN.
+        base_seq (int)  : The sequence number of the TCP probe 0. Defaults to random.
+
+    """
+
+    def __init__(
+        self,
+        dst,
+        proto,
+        payload=b"",
+        sport=None,
+        dport=0,
+        ident=None,
+        df=False,
+        flags=TCP_SYN,
+        base_seq=None,
+    ):
+        self.dst = dst
+        self.proto = proto
+        self.df = df
+        self.flags = flags
+        self.version = ipaddress.ip_address(dst).version
+        self.family = socket.AF_INET6 if self.version == 6 else socket.AF_INET
+        self.dst_packed = socket.inet_pton(self.family, dst)
+        self.src = get_source_address(dst)
+        self.ident = random.randint(1, 0xFFFF) if ident is None else ident & 0xFFFF
+        self.sport = random.randint(1024, 0xFFFF - 1024) if sport is None else sport
+        self.dport = dport
+        self.base_seq = random.randint(0, 0x7FFFFFFF) if base_seq is None else base_seq
+        self.ip_size = IP_HEADER_SIZE[4] if self.version == 4 else 0
+        self.payload_size = len(payload)
+        l4 = self._build_transport(payload)
+        self.l4_offset = self.ip_size
+        if self.version == 4:
+            self.buffer = self._build_ip_header(len(l4), df) + l4
+        else:
+            self.buffer = l4
+        self.length = len(self.buffer)
+        # Offsets of the patched fields, relative to the start of the probe.
+        offset = self.l4_offset
+        self.checksum_offset = offset + {"ICMP": 2, "TCP": 16, "UDP": 6}[proto]
+        self.seq_offset = offset + {"ICMP": 6, "TCP": 4, "UDP": 0}[proto]
+        self.seq_size = 4 if proto == "TCP" else 2
+
+    def _build_transport(self, payload):
+        if self.proto == "ICMP":
+            header = struct.pack("!BBHHH", ECHO_REQUEST[self.version], 0, 0, self.ident, 0)
+        elif self.proto == "TCP":
+            # A SYN with a 64 KiB window and no options, by default.
+            header = struct.pack(
+                "!HHIIBBHHH",
+                self.sport,
+                self.dport,
+                self.base_seq,
+                0,
+                5 << 4,
+                self.flags,
+                65535,
+                0,
+                0,
+            )
+        else:
+            header = struct.pack("!HHHH", self.sport, self.dport, 8 + len(payload), 0)
+        l4 = bytearray(header + payload)
+        # The kernel computes the checksums of IPv6 raw sockets.
+        if self.version == 4:
+            pseudo_header = b""
+            if self.proto != "ICMP":
+                pseudo_header = socket.inet_pton(socket.AF_INET, self.src) + self.dst_packed
+                pseudo_header += struct.pack("!BBH", 0, PROTO_NUMBERS[self.proto], len(l4))
+            value = checksum(pseudo_header + l4)
+            if self.proto == "UDP" and not value:
+                value = 0xFFFF
+            struct.pack_into("!H", l4, {"ICMP": 2, "TCP": 16, "UDP": 6}[self.proto], value)
+        return l4
+
+    def _build_ip_header(self, l4_size, df):
+        header = bytearray(
+            struct.pack(
+                "!BBHHHBBH4s4s",
+                0x45,
+                0,
+                IP_HEADER_SIZE[4] + l4_size,
+                self.ident,
+                0x4000 if df else 0,
+                64,
+                PROTO_NUMBERS[self.proto],
+                0,
+                socket.inet_pton(socket.AF_INET, self.src),
+                self.dst_packed,
+            )
+        )
+        struct.pack_into("!H", header, 10, checksum(header))
+        return header
+
+    def write(self, buffer, offset, ttl, seq):
+        """Write the probe with sequence number `seq` and time-to-live `ttl` into `buffer`.
+
+        The template is copied into place and only the changing fields and their checksums
+        are patched. The TTL of IPv6 probes is sent along with the packet instead.
+
+        """
+        end = offset + self.length
+        buffer[offset:end] = self.buffer
+        if self.version == 4:
+            old_ttl_word, old_id = struct.unpack_from("!HH", self.buffer, 8)[0], self.ident
+            new_ttl_word = (ttl << 8) | PROTO_NUMBERS[self.proto]
+            new_id = (self.ident + seq) & 0xFFFF
+            buffer[offset + 8] = ttl
+            struct.pack_into("!H", buffer, offset + 4, new_id)
+            _adjust_checksum(
+                buffer, offset + 10, (old_ttl_word, old_id), (new_ttl_word, new_id)
+            )
+        if self.proto == "TCP":
+            old_value, value = self.base_seq, (self.base_seq + seq) & 0xFFFFFFFF
+            struct.pack_into("!I", buffer, offset + self.seq_offset, value)
+        else:
+            old_value = self.sport if self.proto == "UDP" else 0
+            value = (old_value + seq) & 0xFFFF
+            struct.pack_into("!H", buffer, offset + self.seq_offset, value)
+        if self.version == 4:
+            _adjust_checksum(
+                buffer,
+                offset + self.checksum_offset,
+                _words(old_value, self.seq_size // 2),
+                _words(value, self.seq_size // 2),
+            )
+
+    def get_reset(self):
+        """Get the template of the RSTs that tear down the connections accepted by the TCP
+        probes of this template.
+
+        The RST of the probe `seq` is the probe `seq` of the returned template, whose sequence
+        number is the one acknowledged by the SYN/ACK.
+
+        """
+        return ProbeTemplate(
+            self.dst,
+            "TCP",
+            sport=self.sport,
+            dport=self.dport,
+            flags=TCP_RST,
+            base_seq=(self.base_seq + 1 + self.payload_size) & 0xFFFFFFFF,
+        )
+
+    def keys(self, seqs):
+        """Get the dispatch keys of the probes with the provided sequence numbers.
+
+        Replies are routed to the waiting probes by their protocol, the destination of the
+        probes and the echo id or source port, which is all that every reply to a probe has
+        in common. UDP probes carry their sequence number in the source port, so they have a
+        key each.
+
+        Returns:
+            set: Returns a set of (proto, packed destination, identifier) tuples.
+
+        """
+        if self.proto == "UDP":
+            return {("UDP", self.dst_packed, (self.sport + seq) & 0xFFFF) for seq in seqs}
+        ident = self.ident if self.proto == "ICMP" else self.sport
+        return {(self.proto, self.dst_packed, ident)}
+
+    def match(self, reply):
+        """Match a reply to the probe it answers.
+
+        Returns:
+            int: Returns the sequence number of the probe that `reply` answers, or None if
+                 it's unrelated.
+
+        """
+        l4 = reply.l4
+        if reply.error:
+            # ICMP errors quote the probe itself.
+            if reply.quoted_dst != self.dst_packed or reply.proto != self.proto or len(l4) < 8:
+                return None
+            if self.proto == "ICMP":
+                kind, _, _, ident, seq = struct.unpack_from("!BBHHH", l4)
+                return seq if kind == ECHO_REQUEST[self.version] and ident == self.ident else None
+            sport, dport, seq = struct.unpack_from("!HHI", l4)
+            if dport != self.dport:
+                return None
+            if self.proto == "TCP":
+                return (seq - self.base_seq) & 0xFFFFFFFF if sport == self.sport else None
+            return (sport - self.sport) & 0xFFFF
+        if reply.src_packed != self.dst_packed or reply.proto != self.proto or len(l4) < 8:
+            return None
+        if self.proto == "ICMP":
+            kind, _, _, ident, seq = struct.unpack_from("!BBHHH", l4)
+            return seq if kind == ECHO_REPLY[self.version] and ident == self.ident else None
+        sport, dport = struct.unpack_from("!HH", l4)
+        if sport != self.dport:
+            return None
+        if self.proto == "TCP":
+            if dport != self.sport or len(l4) < 12:
+                return None
+            # A SYN/ACK acknowledges the probe's sequence number plus one, while a RST also
+            # acknowledges the payload of the SYN.
+            ack = struct.unpack_from("!I", l4, 8)[0] - 1 - self.base_seq
+            if len(l4) > 13 and l4[13] & TCP_RST:
+                ack -= self.payload_size
+            return ack & 0xFFFFFFFF
+        return (dport - self.sport) & 0xFFFF
+
+
+class Reply:
+    """A received packet, decoded just enough to match it to a probe.
+
+    For ICMP errors `proto` and `l4` describe the quoted probe and `quoted_dst` holds its
+    packed destination. For anything else they describe the received packet itself.
+
+    """
+
+    __slots__ = (
+        "src_packed",
+        "ttl",
+        "size",
+        "proto",
+        "icmp_type",
+        "icmp_code",
+        "mtu",
+        "error",
+        "quoted_dst",
+        "l4",
+        "times",
+    )
+
+    def __init__(self):
+        self.mtu = None
+        self.error = False
+        self.quoted_dst = None
+        self.icmp_type = None
+        self.icmp_code = None
+        self.times = None
+
+    @property
+    def src(self):
+        family = socket.AF_INET6 if len(self.src_packed) == 16 else socket.AF_INET
+        return socket.inet_ntop(family, self.src_packed)
+
+
+def _get_proto_name(number, version):
+    if number == ICMP_NUMBERS[version]:
+        return "ICMP"
+    return {6: "TCP", 17: "UDP"}.get(number)
+
+
+def parse_reply(data, version):
+    """Decode a received IP packet.
+
+    Args:
+        data    (memoryview): The received bytes, starting at the IP header.
+        version (int)       : The IP version.
+
+    Returns:
+        Reply: Returns the decoded reply, or None if it's truncated or of no interest.
+
+    """
+    reply = Reply()
+    if len(data) < IP_HEADER_SIZE[version]:
+        return None
+    if version == 4:
+        header_size = (data[0] & 0x0F) * 4
+        reply.size = struct.unpack_from("!H", data, 2)[0] - IP_HEADER_SIZE[4]
+        reply.ttl = data[8]
+        proto_number = data[9]
+        reply.src_packed = bytes(data[12:16])
+    else:
+        # Extension headers aren't followed, the capture filter doesn't let them through.
+        header_size = IP_HEADER_SIZE[6]
+        reply.size = struct.unpack_from("!H", data, 4)[0]
+        proto_number = data[6]
+        reply.ttl = data[7]
+        reply.src_packed = bytes(data[8:24])
+    l4 = data[header_size:]
+    reply.proto = _get_proto_name(proto_number, version)
+    if reply.proto is None:
+        return None
+    if reply.proto == "ICMP":
+        if len(l4) < 8:
+            return None
+        reply.icmp_type, reply.icmp_code = l4[0], l4[1]
+        if reply.icmp_type in ICMP_ERRORS[version]:
+            quoted = l4[8:]
+            if version == 4:
+                if len(quoted) < IP_HEADER_SIZE[4]:
+                    return None
+                quoted_size = (quoted[0] & 0x0F) * 4
+                reply.quoted_dst = bytes(quoted[16:20])
+                quoted_proto = quoted[9]
+                if reply.icmp_type == 3 and reply.icmp_code == 4:
+                    reply.mtu = struct.unpack_from("!H", l4, 6)[0]
+            else:
+                if len(quoted) < IP_HEADER_SIZE[6]:
+                    return None
+                quoted_size = IP_HEADER_SIZE[6]
+                reply.quoted_dst = bytes(quoted[24:40])
+                quoted_proto = quoted[6]
+                if reply.icmp_type == 2:
+                    reply.mtu = struct.unpack_from("!I", l4, 4)[0]
+            reply.error = True
+            reply.proto = _get_proto_name(quoted_proto, version)
+            l4 = quoted[quoted_size:]
+    # Keep no more than the transport header, the receive buffer is reused.
+    reply.l4 = bytes(l4[:PROTO_HEADER_SIZE["TCP"]])
+    return reply
+
+
+def get_dispatch_key(reply):
+    """Get the key of the probes that a reply may answer, see `ProbeTemplate.keys`.
+
+    Returns:
+        tuple: Returns a (proto, packed destination, identifier) tuple, or None if the reply
+               can't be the answer to any probe.
+
+    """
+    l4 = reply.l4
+    if len(l4) < 8:
+        return None
+    if reply.error:
+        # ICMP errors quote the probe, whose identifier is its echo id or source port.
+        offset = 4 if reply.proto == "ICMP" else 0
+        return (reply.proto, reply.quoted_dst, struct.unpack_from("!H", l4, offset)[0])
+    if reply.proto == "ICMP":
+        if reply.icmp_type not in ECHO_REPLY.values():
+            return None
+        return ("ICMP", reply.src_packed, struct.unpack_from("!H", l4, 4)[0])
+    # The answers of the destination are addressed to the source port of the probe.
+    return (reply.proto, reply.src_packed, struct.unpack_from("!H", l4, 2)[0])
@@ -0,0 +1,229 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import time
+import queue
+import lib.engine.timestamps as timestamps
+from lib.engine.packets import get_dispatch_key
+from lib.engine.sender import ProbeBatch, RawSender
+from lib.engine.receiver import get_receiver
+
+
+class ProbeSet:
+    """The socket used to send the probes of any number of templates, and wait for them at once.
+
+    The templates must share their IP version, protocol and don't fragment flag, as they're
+    all sent over the same raw socket. Every template gets its own preallocated batch the
+    first time it's used. Replies are received by the shared receiver of the process. Use it
+    as a context manager, and call `run` for every batch of probes.
+
+    Args:
+        version (int) : The IP version of the templates.
+        proto   (str) : The protocol of the templates, one of ICMP, TCP or UDP.
+        df      (bool): Whether or not the templates are sent with the don't fragment flag.
+
+    """
+
+    def __init__(self, version, proto, df=False):
+        self.batches = {}
+        self.receiver = get_receiver()
+        self.sender = RawSender(version, proto, df)
+        self.start_stats = self.receiver.get_stats()
+        self.sources = set()
+
+    def close(self):
+        self.sender.close()
+        for batch in self.batches.values():
+            batch.release()
+
+    def get_capture(self):
+        """Get the capture backend, the number of packets the kernel dropped since the set
+        was created and the timestamp source of the RTTs.
+
+        Drops are counted for the receiver of the whole process, so they may belong to other
+        probes running concurrently. Any drop means that replies may have been lost and the
+        loss reported by the test may be overstated.
+
+        The timestamp source is the least accurate of the sources of every RTT, see
+        `timestamps.TIMESTAMP_SOURCES`, or None if there was no reply.
+
+        Returns:
+            dict: Returns a dictionary object with the "backend", the "drops" count and the
+                  "timestamp_source".
+
+        """
+        drops = self.receiver.get_stats()["drops"] - self.start_stats["drops"]
+        return {
+            "backend": self.receiver.backend,
+            "drops": drops,
+            "timestamp_source": timestamps.get_least_accurate(self.sources),
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_batch(self, template, size):
+        """Get the batch of a template, allocating it if it holds fewer than `size` probes."""
+        batch = self.batches.get(template)
+        if batch is None or batch.size < size:
+            if batch is not None:
+                batch.release()
+            batch = self.batches[template] = ProbeBatch(template, size)
+        return batch
+
+    def send(self, probes):
+        """Send probes without waiting for their replies, a batch per template.
+
+        Args:
+            probes (list): A list of (template, seq, ttl) tuples, one per probe.
+
+        Returns:
+            dict: Returns a dictionary object of the number of the probe on the socket, see
+                  `RawSender.count`, and its send time, keyed by (template, seq).
+
+        """
+        grouped = {}
+        for (template, seq, ttl) in probes:
+            grouped.setdefault(template, []).append((seq, ttl))
+        sent = {}
+        for (template, template_probes) in grouped.items():
+            batch = self.get_batch(template, len(template_probes))
+            for (index, (seq, ttl)) in enumerate(template_probes):
+                batch.set(index, ttl, seq)
+            first = self.sender.count
+            send_times = self.sender.send(batch, len(template_probes))
+            for (index, (seq, _)) in enumerate(template_probes):
+                sent[(template, seq)] = (first + index, send_times[index])
+        return sent
+
+    def run(self, probes, timeout, done=None):
+        """Send probes at once and collect the first reply to each of them.
+
+        Args:
+            probes  (list)    : A list of (template, seq, ttl) tuples, one per probe.
+            timeout (float)   : The number of seconds to wait for replies after sending.
+            done    (callable): Optionally called with the replies so far after every matched
+                                reply. Waiting stops early once it returns True. By default
+                                waiting stops once every probe got a reply.
+
+        RTTs are computed from the kernel's (or the network card's) send and receive
+        timestamps where available, and from this process' own clock otherwise.
+
+        Returns:
+            dict: Returns a dictionary object of (reply, rtt_ms) tuples keyed by the
+                  (template, seq) of the probe they answer.
+
+        """
+        if not probes:
+            return {}
+        # The templates that a reply may answer, keyed by the dispatch key of the reply.
+        candidates = {}
+        for (template, seq, _) in probes:
+            for key in template.keys((seq,)):
+                if template not in candidates.setdefault(key, []):
+                    candidates[key].append(template)
+        replies_queue = queue.SimpleQueue()
+        # Register before sending anything, so that no reply can slip through.
+        self.receiver.register(candidates, replies_queue)
+        try:
+            sent = self.send(probes)
+            replies = {}
+            deadline = time.time() + timeout
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    reply = replies_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                key = _match(candidates, reply, sent, replies)
+                if key is None:
+                    continue
+                replies[key] = (reply, (reply.times["user"] - sent[key][1]) * 1000)
+                if done(replies) if done is not None else len(replies) == len(sent):
+                    break
+        finally:
+            self.receiver.unregister(candidates, replies_queue)
+        self._set_rtts(replies, sent)
+        return replies
+
+    def _set_rtts(self, replies, sent):
+        """Replace the RTTs of the replies with the ones of the most accurate timestamps."""
+        # The replies came after the probes left, so their transmit timestamps are in by now.
+        tx_times = self.sender.read_tx_times()
+        for (key, (reply, _)) in replies.items():
+            (number, send_time) = sent[key]
+            probe_times = dict(tx_times.get(number, {}), user=send_time)
+            rtt_ms, source = timestamps.get_rtt(probe_times, reply.times)
+            replies[key] = (reply, rtt_ms)
+            self.sources.add(source)
+
+
+def _match(candidates, reply, sent, replies):
+    """Match a reply to the first probe it answers that didn't get a reply yet.
+
+    Returns:
+        tuple: Returns the (template, seq) of the probe, or None if the reply is unrelated.
+
+    """
+    for template in candidates.get(get_dispatch_key(reply), ()):
+        key = (template, template.match(reply))
+        if key in sent and key not in replies:
+            return key
+    return None
+
+
+class ProbeSession(ProbeSet):
+    """A probe set of a single template, whose probes are keyed by their sequence number.
+
+    Args:
+        template (ProbeTemplate): The template of the probes.
+        size     (int)          : The largest number of probes sent in a single batch.
+
+    """
+
+    def __init__(self, template, size):
+        super().__init__(template.version, template.proto, template.df)
+        self.template = template
+        self.batch = self.get_batch(template, size)
+
+    def run(self, probes, timeout, done=None):
+        """Send a batch of probes at once and collect the first reply to each of them.
+
+        Args:
+            probes  (list)    : A list of (seq, ttl) tuples, one per probe.
+            timeout (float)   : The number of seconds to wait for replies after sending.
+            done    (callable): See `ProbeSet.run`, with the replies keyed by seq.
+
+        Returns:
+            dict: Returns a dictionary object of (reply, rtt_ms) tuples keyed by the sequence
+                  number of the probe they answer.
+
+        """
+        replies = super().run(
+            [(self.template, seq, ttl) for (seq, ttl) in probes],
+            timeout,
+            None if done is None else lambda replies: done(_by_seq(replies)),
+        )
+        return _by_seq(replies)
+
+
+def _by_seq(replies):
+    """Key the replies to the probes of a single template by their sequence number."""
+    return {seq: value for ((_, seq), value) in replies.items()}
+
+
+def send_probes(template, probes, timeout, done=None):
+    """Send a single batch of probes from a template and collect their replies.
+
+    See `ProbeSession.run` for the arguments and the result.
+
+    Returns:
+        tuple: Returns a tuple of the replies and the capture of `ProbeSet.get_capture`.
+
+    """
+    with ProbeSession(template, max(len(probes), 1)) as session:
+        return session.run(probes, timeout, done), session.get_capture()
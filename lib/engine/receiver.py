@@ -0,0 +1,265 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import os
+import mmap
+import time
+import select
+import socket
+import struct
+import threading
+import lib.engine.bpf as bpf
+import lib.engine.timestamps as timestamps
+from lib.engine.packets import parse_reply, get_dispatch_key
+
+RECV_BUFFER_SIZE = 65535
+# The kernel receive buffer of the capture socket, sized for bursts of replies.
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Linux socket and packet constants that Python doesn't export.
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+SOL_PACKET = 263
+PACKET_OUTGOING = 4
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_TIMESTAMP = 17
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_TS_RAW_HARDWARE = 1 << 31
+
+# The capture backends. "socket" reads every packet with its own recvfrom(2), "ring" reads
+# them straight out of a TPACKET_V3 ring shared with the kernel.
+CAPTURE_BACKENDS = ("socket", "ring")
+# The geometry of the ring: RING_BLOCK_COUNT blocks of RING_BLOCK_SIZE bytes. The kernel
+# hands a block over once it's full, or after RING_BLOCK_TIMEOUT milliseconds.
+RING_BLOCK_SIZE = 1 << 20
+RING_BLOCK_COUNT = 16
+RING_FRAME_SIZE = 2048
+RING_BLOCK_TIMEOUT = 4
+
+# The capture filter, see `bpf.assemble`. It only lets through received IPv4 and IPv6 ICMP and
+# UDP packets, and TCP packets with SYN/ACK or RST set. That's every kind of reply to a probe.
+_FILTER = [
+    ("", bpf.BPF_LD_W_ABS, None, None, bpf.SKF_AD_PKTTYPE),
+    ("", bpf.BPF_JEQ_K, "drop", None, PACKET_OUTGOING),
+    ("", bpf.BPF_LD_W_ABS, None, None, bpf.SKF_AD_PROTOCOL),
+    ("", bpf.BPF_JEQ_K, "ipv6", None, ETH_P_IPV6),
+    ("", bpf.BPF_JEQ_K, "ipv4", "drop", ETH_P_IP),
+    ("ipv6", bpf.BPF_LD_B_ABS, None, None, 6),
+    ("", bpf.BPF_JEQ_K, "accept", None, 58),
+    ("", bpf.BPF_JEQ_K, "accept", None, 17),
+    ("", bpf.BPF_JEQ_K, None, "drop", 6),
+    ("", bpf.BPF_LD_B_ABS, None, None, 40 + 13),
+    ("", bpf.BPF_JA, None, None, "tcp"),
+    ("ipv4", bpf.BPF_LD_B_ABS, None, None, 9),
+    ("", bpf.BPF_JEQ_K, "accept", None, 1),
+    ("", bpf.BPF_JEQ_K, "accept", None, 17),
+    ("", bpf.BPF_JEQ_K, None, "drop", 6),
+    ("", bpf.BPF_LDX_B_MSH, None, None, 0),
+    ("", bpf.BPF_LD_B_IND, None, None, 13),
+    ("tcp", bpf.BPF_JSET_K, "accept", None, 0x04),
+    ("", bpf.BPF_AND_K, None, None, 0x12),
+    ("", bpf.BPF_JEQ_K, "accept", "drop", 0x12),
+    ("accept", bpf.BPF_RET_K, None, None, RECV_BUFFER_SIZE),
+    ("drop", bpf.BPF_RET_K, None, None, 0),
+]
+
+
+class _Ring:
+    """A TPACKET_V3 receive ring mapped from a packet socket.
+
+    The kernel fills whole blocks of packets and flags them as owned by user space. Packets
+    are parsed right out of the mapping, and a block is handed back by flagging it as owned
+    by the kernel again, so there's no system call per packet.
+
+    """
+
+    def __init__(self, sock):
+        sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        try:
+            # Use the card's timestamps where it provides them, they're flagged per packet.
+            sock.setsockopt(SOL_PACKET, PACKET_TIMESTAMP, timestamps.SOF_TIMESTAMPING_RAW_HARDWARE)
+        except OSError:
+            pass
+        # struct tpacket_req3.
+        request = struct.pack(
+            "7I",
+            RING_BLOCK_SIZE,
+            RING_BLOCK_COUNT,
+            RING_FRAME_SIZE,
+            RING_BLOCK_SIZE * RING_BLOCK_COUNT // RING_FRAME_SIZE,
+            RING_BLOCK_TIMEOUT,
+            0,
+            0,
+        )
+        sock.setsockopt(SOL_PACKET, PACKET_RX_RING, request)
+        self.map = mmap.mmap(sock.fileno(), RING_BLOCK_SIZE * RING_BLOCK_COUNT)
+        self.view = memoryview(self.map)
+        self.poll = select.poll()
+        self.poll.register(sock, select.POLLIN | select.POLLERR)
+        self.block = 0
+
+    def __iter__(self):
+        """Yield the data and the timestamps of every received packet, forever."""
+        view = self.view
+        while True:
+            offset = self.block * RING_BLOCK_SIZE
+            # struct tpacket_block_desc: version, offset_to_priv, then block_status,
+            # num_pkts and offset_to_first_pkt.
+            status, count, packet = struct.unpack_from("3I", view, offset + 8)
+            if not status & TP_STATUS_USER:
+                self.poll.poll()
+                continue
+            packet += offset
+            for _ in range(count):
+                # struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len,
+                # tp_status, tp_mac and tp_net, the offset of the IP header.
+                header = struct.unpack_from("6I2H", view, packet)
+                (next_offset, sec, nsec, size, status, net) = header[:4] + header[5:6] + header[7:]
+                source = "hardware" if status & TP_STATUS_TS_RAW_HARDWARE else "kernel"
+                times = {source: sec + nsec / 1e9, "user": time.time()}
+                yield view[packet + net : packet + net + size], times
+                packet += next_offset
+            struct.pack_into("I", view, offset + 8, TP_STATUS_KERNEL)
+            self.block = (self.block + 1) % RING_BLOCK_COUNT
+
+
+class Receiver:
+    """A single thread receiving the replies to every probe in flight in this process.
+
+    One packet socket with a fixed filter captures the replies of both IP versions and all
+    protocols, and every reply is routed to the probes waiting for it through a dispatch
+    table keyed by `ProbeTemplate.keys`. Waiting probes don't set up anything but a queue, so
+    the cost of receiving doesn't grow with the number of concurrent probes.
+
+    Use `get_receiver` rather than creating one.
+
+    Args:
+        backend (str): The capture backend, one of CAPTURE_BACKENDS. Falls back to "socket"
+                       if the ring can't be set up.
+
+    """
+
+    def __init__(self, backend="socket"):
+        self.pid = os.getpid()
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.lock = threading.Lock()
+        self.table = {}
+        self.totals = {"packets": 0, "drops": 0}
+        self.ring = None
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_ALL))
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+            bpf.attach_filter(self.sock, _FILTER)
+            if backend == "ring":
+                try:
+                    self.ring = _Ring(self.sock)
+                except OSError:
+                    pass
+            if self.ring is None:
+                timestamps.enable_rx(self.sock)
+        except BaseException:
+            self.sock.close()
+            raise
+        self.backend = "ring" if self.ring is not None else "socket"
+        self.thread = threading.Thread(target=self._run, name="probe-receiver", daemon=True)
+        self.thread.start()
+
+    def register(self, keys, queue):
+        """Route the replies matching any of `keys` to `queue` until unregistered."""
+        with self.lock:
+            for key in keys:
+                self.table[key] = self.table.get(key, ()) + (queue,)
+
+    def unregister(self, keys, queue):
+        with self.lock:
+            for key in keys:
+                queues = tuple(item for item in self.table.get(key, ()) if item is not queue)
+                if queues:
+                    self.table[key] = queues
+                else:
+                    self.table.pop(key, None)
+
+    def get_stats(self):
+        """Get the number of packets captured and dropped by the kernel since the start.
+
+        The kernel counts drops when the socket's buffer or the ring is full, i.e. when this
+        thread can't keep up, which would otherwise be mistaken for packet loss.
+
+        Returns:
+            dict: Returns a dictionary object with the "packets" and "drops" counts.
+
+        """
+        # struct tpacket_stats, or tpacket_stats_v3 for a ring. Reading them resets them.
+        size = 12 if self.ring is not None else 8
+        with self.lock:
+            stats = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, size)
+            packets, drops = struct.unpack_from("2I", stats)
+            self.totals["packets"] += packets
+            self.totals["drops"] += drops
+            return dict(self.totals)
+
+    def _iter_socket(self):
+        """Yield the data and the timestamps of every received packet, forever."""
+        view = memoryview(self.buffer)
+        while True:
+            try:
+                size, ancillary, _, _ = self.sock.recvmsg_into(
+                    [self.buffer], timestamps.TIMESTAMPING_SPACE
+                )
+            except InterruptedError:
+                continue
+            times = timestamps.get_rx_times(ancillary)
+            times["user"] = time.time()
+            yield view[:size], times
+
+    def _run(self):
+        packets = iter(self.ring) if self.ring is not None else self._iter_socket()
+        try:
+            for (data, times) in packets:
+                # The first nibble of the IP header holds the IP version.
+                version = data[0] >> 4 if data else None
+                reply = parse_reply(data, version) if version in (4, 6) else None
+                if reply is None:
+                    continue
+                reply.times = times
+                for queue in self.table.get(get_dispatch_key(reply), ()):
+                    queue.put(reply)
+        except OSError:
+            return
+
+
+_CAPTURE = "socket"
+_RECEIVER = None
+_RECEIVER_LOCK = threading.Lock()
+
+
+def set_capture(backend):
+    """Set the capture backend of the receivers started from now on.
+
+    Args:
+        backend (str): One of CAPTURE_BACKENDS.
+
+    """
+    global _CAPTURE  # pylint: disable=global-statement
+    if backend not in CAPTURE_BACKENDS:
+        raise ValueError(
+            f"Provided 'capture' of '{backend}' is not supported. {CAPTURE_BACKENDS}."
+        )
+    _CAPTURE = backend
+
+
+def get_receiver():
+    """Get the receiver of this process, starting it on first use.
+
+    Forked processes don't inherit the receiving thread, so they start their own.
+
+    """
+    global _RECEIVER  # pylint: disable=global-statement
+    with _RECEIVER_LOCK:
+        if _RECEIVER is None or _RECEIVER.pid != os.getpid():
+            _RECEIVER = Receiver(_CAPTURE)
+        return _RECEIVER
@@ -0,0 +1,225 @@
+# pylint: disable=locally-disabled, missing-docstring, too-few-public-methods
+
+import os
+import time
+import errno
+import socket
+import struct
+import ctypes
+import ctypes.util
+import lib.engine.bpf as bpf
+import lib.engine.timestamps as timestamps
+from lib.engine.packets import ICMP_NUMBERS, PROTO_NUMBERS
+
+# Linux's IPV6_CHECKSUM socket option, which Python doesn't export. It makes the kernel
+# compute the checksum of IPv6 raw sockets other than ICMPv6 at the provided offset.
+IPV6_CHECKSUM = 7
+# The path MTU discovery socket options and the mode in which the kernel ignores the path MTU
+# and never fragments, which Python doesn't export either.
+IP_MTU_DISCOVER = 10
+IPV6_MTU_DISCOVER = 23
+PMTUDISC_PROBE = 3
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    """Look up sendmmsg(2) in the C library, or return None if it isn't there."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_SENDMMSG = _load_sendmmsg()
+
+
+def _pack_sockaddr(family, address):
+    """Pack a sockaddr_in or sockaddr_in6 for the provided address."""
+    if family == socket.AF_INET6:
+        return struct.pack(
+            "=HHI16sI", family, 0, 0, socket.inet_pton(family, address.split("%")[0]), 0
+        )
+    return struct.pack("=HH4s8x", family, 0, socket.inet_pton(family, address))
+
+
+class ProbeBatch:
+    """Preallocated buffers and message headers for up to `size` probes of a template.
+
+    Probes are written into the batch with `set` and sent all at once with
+    `RawSender.send`. Nothing is allocated per probe.
+
+    """
+
+    def __init__(self, template, size):
+        self.template = template
+        self.size = size
+        self.buffer = bytearray(template.length * size)
+        self.seqs = [None] * size
+        self.ttls = [None] * size
+        self.sockaddr = ctypes.create_string_buffer(
+            _pack_sockaddr(template.family, template.dst), 28
+        )
+        self.iovecs = (_IOVec * size)()
+        self.msgs = (_MMsgHdr * size)()
+        # IPv6 probes carry their hop limit as ancillary data.
+        self.cmsg_space = socket.CMSG_SPACE(4) if template.version == 6 else 0
+        self.control = ctypes.create_string_buffer(max(self.cmsg_space * size, 1))
+        data = (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer)
+        base = ctypes.addressof(data)
+        self._data = data
+        for index in range(size):
+            self.iovecs[index].iov_base = base + index * template.length
+            self.iovecs[index].iov_len = template.length
+            header = self.msgs[index].msg_hdr
+            header.msg_name = ctypes.addressof(self.sockaddr)
+            header.msg_namelen = 28 if template.version == 6 else 16
+            header.msg_iov = ctypes.pointer(self.iovecs[index])
+            header.msg_iovlen = 1
+            if self.cmsg_space:
+                header.msg_control = ctypes.addressof(self.control) + index * self.cmsg_space
+                header.msg_controllen = self.cmsg_space
+
+    def set(self, index, ttl, seq):
+        """Write the probe with sequence number `seq` and time-to-live `ttl` at `index`."""
+        self.template.write(self.buffer, index * self.template.length, ttl, seq)
+        self.seqs[index] = seq
+        self.ttls[index] = ttl
+        if self.cmsg_space:
+            # struct cmsghdr {size_t cmsg_len; int cmsg_level; int cmsg_type;} + int data.
+            struct.pack_into(
+                "@Niii",
+                self.control,
+                index * self.cmsg_space,
+                socket.CMSG_LEN(4),
+                socket.IPPROTO_IPV6,
+                socket.IPV6_HOPLIMIT,
+                ttl,
+            )
+
+    def release(self):
+        """Release the exported buffer so that the batch can be garbage collected."""
+        self._data = None
+
+
+class RawSender:
+    """A raw socket that sends batches of probes with a single sendmmsg(2) call per batch.
+
+    Falls back to a sendmsg(2) per probe where sendmmsg isn't available. The kernel is asked
+    for transmit timestamps, which `read_tx_times` collects after sending.
+
+    Args:
+        version (int) : The IP version.
+        proto   (str) : The protocol of the probes, one of ICMP, TCP or UDP.
+        df      (bool): Whether or not to send the probes as they are, even when they're
+                        larger than the path MTU known to the kernel, rather than fragment or
+                        refuse them. Defaults to False.
+
+    """
+
+    def __init__(self, version, proto, df=False):
+        if version == 4:
+            # IPPROTO_RAW implies IP_HDRINCL, the probes bring their own IP header.
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
+        else:
+            number = ICMP_NUMBERS[6] if proto == "ICMP" else PROTO_NUMBERS[proto]
+            self.sock = socket.socket(socket.AF_INET6, socket.SOCK_RAW, number)
+            if proto != "ICMP":
+                offset = {"TCP": 16, "UDP": 6}[proto]
+                self.sock.setsockopt(socket.IPPROTO_IPV6, IPV6_CHECKSUM, offset)
+            # The socket would get a copy of every packet of its protocol, which would fill up
+            # the receive buffer that the transmit timestamps are charged to.
+            bpf.attach_filter(self.sock, bpf.DROP_ALL)
+        if df:
+            level, option = (
+                (socket.IPPROTO_IP, IP_MTU_DISCOVER)
+                if version == 4
+                else (socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER)
+            )
+            self.sock.setsockopt(level, option, PMTUDISC_PROBE)
+        self.timestamping = timestamps.enable_tx(self.sock)
+        self.version = version
+        # The number of packets sent so far, by which transmit timestamps are numbered.
+        self.count = 0
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def send(self, batch, count=None):
+        """Send the first `count` probes of a batch.
+
+        The probes are numbered from `self.count` on, in the order of the batch.
+
+        Returns:
+            list: Returns a list of the send time of every probe.
+
+        """
+        count = batch.size if count is None else count
+        times = [0.0] * count
+        sent = 0
+        while sent < count:
+            send_time = time.time()
+            if _SENDMMSG is not None:
+                result = _SENDMMSG(
+                    self.sock.fileno(), ctypes.byref(batch.msgs[sent]), count - sent, 0
+                )
+                if result < 0:
+                    error = ctypes.get_errno()
+                    if error == errno.EINTR:
+                        continue
+                    raise OSError(error, os.strerror(error))
+            else:
+                self._sendmsg(batch, sent)
+                result = 1
+            times[sent : sent + result] = [send_time] * result
+            sent += result
+        self.count += count
+        return times
+
+    def read_tx_times(self):
+        """Read the transmit timestamps of the packets sent so far.
+
+        Returns:
+            dict: Returns a dictionary object of timestamps keyed by source, keyed by the
+                  number of the packet on this socket, see `count`.
+
+        """
+        return timestamps.read_tx_times(self.sock) if self.timestamping else {}
+
+    def _sendmsg(self, batch, index):
+        length = batch.template.length
+        data = memoryview(batch.buffer)[index * length : (index + 1) * length]
+        ancillary = []
+        if batch.cmsg_space:
+            ancillary.append(
+                (socket.IPPROTO_IPV6, socket.IPV6_HOPLIMIT, struct.pack("i", batch.ttls[index]))
+            )
+        self.sock.sendmsg([data], ancillary, 0, (batch.template.dst, 0))
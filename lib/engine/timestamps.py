@@ -0,0 +1,155 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import socket
+import struct
+
+# Linux timestamping constants that Python doesn't export (see timestamping.rst).
+SO_TIMESTAMPING = 37
+SCM_TIMESTAMPING = SO_TIMESTAMPING
+SO_EE_ORIGIN_TIMESTAMPING = 4
+SCM_TSTAMP_SND = 0
+SOF_TIMESTAMPING_TX_HARDWARE = 1 << 0
+SOF_TIMESTAMPING_TX_SOFTWARE = 1 << 1
+SOF_TIMESTAMPING_RX_HARDWARE = 1 << 2
+SOF_TIMESTAMPING_RX_SOFTWARE = 1 << 3
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+SOF_TIMESTAMPING_RAW_HARDWARE = 1 << 6
+SOF_TIMESTAMPING_OPT_ID = 1 << 7
+SOF_TIMESTAMPING_OPT_TSONLY = 1 << 11
+IP_RECVERR = 11
+IPV6_RECVERR = 25
+_RECVERR = ((socket.IPPROTO_IP, IP_RECVERR), (socket.IPPROTO_IPV6, IPV6_RECVERR))
+
+# The timestamp sources, from the most to the least accurate. "hardware" timestamps are taken
+# by the network card, "kernel" timestamps by the kernel as the packet leaves or arrives, and
+# "user" timestamps by this process, which adds its scheduling delays to every RTT.
+TIMESTAMP_SOURCES = ("hardware", "kernel", "user")
+
+# struct scm_timestamping holds three timespecs: software, deprecated and raw hardware.
+_SCM_TIMESTAMPING = struct.Struct("@6l")
+# struct sock_extended_err: ee_errno, ee_origin, ee_type, ee_code, ee_pad, ee_info, ee_data.
+_SOCK_EXTENDED_ERR = struct.Struct("@IBBBBII")
+TIMESTAMPING_SPACE = socket.CMSG_SPACE(_SCM_TIMESTAMPING.size)
+# The error queue also carries the extended error, followed by the offender's address.
+ERRQUEUE_SPACE = TIMESTAMPING_SPACE + socket.CMSG_SPACE(_SOCK_EXTENDED_ERR.size + 28)
+
+
+def enable_rx(sock):
+    """Ask for software and hardware receive timestamps on a socket.
+
+    Returns:
+        bool: Returns whether or not the kernel supports it.
+
+    """
+    flags = (
+        SOF_TIMESTAMPING_RX_SOFTWARE
+        | SOF_TIMESTAMPING_RX_HARDWARE
+        | SOF_TIMESTAMPING_SOFTWARE
+        | SOF_TIMESTAMPING_RAW_HARDWARE
+    )
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING, flags)
+    except OSError:
+        return False
+    return True
+
+
+def enable_tx(sock):
+    """Ask for software and hardware transmit timestamps on a socket.
+
+    They are queued on the socket's error queue, numbered by the order in which the packets
+    were sent on the socket, starting from 0.
+
+    Returns:
+        bool: Returns whether or not the kernel supports it.
+
+    """
+    flags = (
+        SOF_TIMESTAMPING_TX_SOFTWARE
+        | SOF_TIMESTAMPING_TX_HARDWARE
+        | SOF_TIMESTAMPING_SOFTWARE
+        | SOF_TIMESTAMPING_RAW_HARDWARE
+        | SOF_TIMESTAMPING_OPT_ID
+        | SOF_TIMESTAMPING_OPT_TSONLY
+    )
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING, flags)
+    except OSError:
+        return False
+    return True
+
+
+def parse_timestamping(data):
+    """Parse a struct scm_timestamping.
+
+    Returns:
+        dict: Returns a dictionary object of the "kernel" and "hardware" timestamps, in
+              seconds, that are set. Hardware timestamps are in the network card's clock.
+
+    """
+    sw_sec, sw_nsec, _, _, hw_sec, hw_nsec = _SCM_TIMESTAMPING.unpack_from(data)
+    times = {}
+    if sw_sec or sw_nsec:
+        times["kernel"] = sw_sec + sw_nsec / 1e9
+    if hw_sec or hw_nsec:
+        times["hardware"] = hw_sec + hw_nsec / 1e9
+    return times
+
+
+def get_rx_times(ancillary):
+    """Get the receive timestamps out of the ancillary data of a received packet."""
+    for (level, kind, data) in ancillary:
+        if level == socket.SOL_SOCKET and kind == SCM_TIMESTAMPING:
+            return parse_timestamping(data)
+    return {}
+
+
+def read_tx_times(sock):
+    """Read every transmit timestamp queued on a socket's error queue.
+
+    Returns:
+        dict: Returns a dictionary object of timestamps as returned by `parse_timestamping`,
+              keyed by the number of the packet they belong to.
+
+    """
+    tx_times = {}
+    while True:
+        try:
+            _, ancillary, _, _ = sock.recvmsg(
+                0, ERRQUEUE_SPACE, socket.MSG_ERRQUEUE | socket.MSG_DONTWAIT
+            )
+        except (BlockingIOError, InterruptedError):
+            return tx_times
+        times, number = None, None
+        for (level, kind, data) in ancillary:
+            if level == socket.SOL_SOCKET and kind == SCM_TIMESTAMPING:
+                times = parse_timestamping(data)
+            elif (level, kind) in _RECVERR:
+                _, origin, _, _, _, info, number = _SOCK_EXTENDED_ERR.unpack_from(data)
+                if origin != SO_EE_ORIGIN_TIMESTAMPING or info != SCM_TSTAMP_SND:
+                    number = None
+        if times and number is not None:
+            tx_times.setdefault(number, {}).update(times)
+
+
+def get_rtt(tx_times, rx_times):
+    """Compute an RTT from the most accurate timestamp source that both ends have.
+
+    Args:
+        tx_times (dict): The send timestamps of the probe, keyed by source.
+        rx_times (dict): The receive timestamps of the reply, keyed by source.
+
+    Returns:
+        tuple: Returns a tuple of the RTT in milliseconds and the timestamp source.
+
+    """
+    for source in TIMESTAMP_SOURCES:
+        if source in tx_times and source in rx_times:
+            return (rx_times[source] - tx_times[source]) * 1000, source
+    return None, None
+
+
+def get_least_accurate(sources):
+    """Get the least accurate of the provided timestamp sources, or None if there are none."""
+    sources = [source for source in TIMESTAMP_SOURCES if source in sources]
+    return sources[-1] if sources else None
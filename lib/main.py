@@ -1,149 +1,24 @@
-# pylint: disable=locally-disabled, missing-docstring, import-error, wildcard-import, broad-except
+# pylint: disable=locally-disabled, missing-docstring, import-error
 
-from secrets import token_hex
+import os
 import json
+import time
 import threading
-import multiprocessing
 import uwsgi
-from lib.utilities import *
-
-
-def _browser_request(options, test_data):
-    """Execute a browser_request test if all requirements are met."""
-    url = options.get("url")
-    if url is not None:
-        # Remove required arg from options to prevent duplicates.
-        del options["url"]
-        try:
-            test_data["result"] = browser_request(url, **options)
-            if not test_data["result"]["failed"]:
-                test_data["failed"] = False
-        except Exception as error:
-            test_data["message"] = str(error)
-    else:
-        test_data[
-            "message"
-        ] = "Required test option of 'url' was not given. Please pass the required 'url' option."
-
-
-def _dns_lookup(options, test_data):
-    """Execute a dns_lookup test if all requirements are met."""
-    qname = options.get("qname")
-    if qname is not None:
-        # Remove required arg from options to prevent duplicates.
-        del options["qname"]
-        try:
-            test_data["result"] = dns_lookup(qname, **options)
-            if not test_data["result"]["failed"]:
-                test_data["failed"] = False
-        except Exception as error:
-            test_data["message"] = str(error)
-    else:
-        test_data["message"] = (
-            "Required test option of 'qname' was not given. "
-            "Please pass the required 'qname' option."
-        )
-
-
-def _dns_traceroute(options, test_data):
-    """Execute a dns_traceroute test if all requirements are met."""
-    qname = options.get("qname")
-    if qname is not None:
-        # Remove required arg from options to prevent duplicates.
-        del options["qname"]
-        try:
-            test_data["result"] = dns_traceroute(qname, **options)
-            if not test_data["result"]["failed"]:
-                test_data["failed"] = False
-        except Exception as error:
-            test_data["message"] = str(error)
-    else:
-        test_data["message"] = (
-            "Required test option of 'qname' was not given. "
-            "Please pass the required 'qname' option."
-        )
-
-
-def _http_request(options, test_data):
-    """Execute an http_request test if all requirements are met."""
-    url = options.get("url")
-    if url is not None:
-        # Remove required arg from options to prevent duplicates.
-        del options["url"]
-        try:
-            test_data["result"] = http_request(url, **options)
-            if not test_data["result"]["failed"]:
-                test_data["failed"] = False
-        except Exception as error:
-            test_data["message"] = str(error)
-    else:
-        test_data[
-            "message"
-        ] = "Required test option of 'url' was not given. Please pass the required 'url' option."
-
-
-def _ping(options, test_data):
-    """Execute a ping test if all requirements are met."""
-    dst = options.get("dst")
-    if dst is not None:
-        # Remove required arg from options to prevent duplicates.
-        del options["dst"]
-        try:
-            test_data["result"] = ping(dst, **options)
-            if not test_data["result"]["failed"]:
-                test_data["failed"] = False
-        except Exception as error:
-            test_data["message"] = str(error)
-    else:
-        test_data[
-            "message"
-        ] = "Required test option of 'dst' was not given. Please pass the required 'dst' option."
-
-
-def _traceroute(options, test_data):
-    """Execute a traceroute test if all requirements are met."""
-    dst = options.get("dst")
-    if dst is not None:
-        # Remove required arg from options to prevent duplicates.
-        del options["dst"]
-        try:
-            test_data["result"] = traceroute(dst, **options)
-            if not test_data["result"]["failed"]:
-                test_data["failed"] = False
-        except Exception as error:
-            test_data["message"] = str(error)
-    else:
-        test_data[
-            "message"
-        ] = "Required test option of 'dst' was not given. Please pass the required 'dst' option."
-
-
-def _worker(test):
-    """Process pool worker to execute tests."""
-    # Check if a custom identifier was provided in the test; if not, add one.
-    test_id = test["options"]["id"] if test["options"].get("id") else token_hex(3)
-    test_data = {"id": test_id, "failed": True, "message": None, "result": {}}
-    # Perform tests depending on given test type.
-    # Parse options and ensure that requirements have been given;
-    # if not, append an error message to the returned data.
-    if test["type"] == "browser_request":
-        _browser_request(test["options"], test_data)
-    elif test["type"] == "dns_lookup":
-        _dns_lookup(test["options"], test_data)
-    elif test["type"] == "dns_traceroute":
-        _dns_traceroute(test["options"], test_data)
-    elif test["type"] == "http_request":
-        _http_request(test["options"], test_data)
-    elif test["type"] == "traceroute":
-        _traceroute(test["options"], test_data)
-    elif test["type"] == "ping":
-        _ping(test["options"], test_data)
-    else:
-        test_data["message"] = "Provided test type does not exist."
-    return {"type": test["type"], "results": test_data}
-
-
-def _create_worker_pool(receipt, test_data, max_procs, stop_event):
+from lib.runner import parse_tests, iter_tests
+
+
+def get_cancel_key(receipt):
+    """Get the UWSGI cache-key that flags the tests of a receipt as cancelled."""
+    return f"{receipt}:cancelled"
+
+
+def get_concurrency_key(pid):
+    """Get the UWSGI cache-key that holds the concurrency limits of a worker."""
+    return f"concurrency:{pid}"
+
+
+def _create_worker_pool(receipt, test_data, max_procs, stop_event, controller=None):
     """Parse provided test data and ensure that all test options are properly formatted
     before passing off to the worker procs in the pool. Once the tests have been completed;
     update the UWSGI cache-key with the results.
@@ -153,38 +28,47 @@ def _create_worker_pool(receipt, test_data, max_procs, stop_event):
         test_data   (dict) : The tests to execute.
         max_procs   (int)  : The maximum number of parallel processes to be used in the worker pool
         stop_event  (class): Threading event class used to stop the daemon upon completion.
+        controller  (class): The ConcurrencyController of this worker, or None.
 
     """
-    tests = []
+    # The payload's deadline counts from its submission, every test stops by then.
+    deadline_ms = test_data.pop("deadline_ms", None)
+    deadline = time.time() + deadline_ms / 1000 if deadline_ms is not None else None
+    cancel_key = get_cancel_key(receipt)
+
+    def cancelled():
+        return bool(uwsgi.cache_exists(cancel_key, "receipts"))
+
+    tests = parse_tests(test_data)
     test_status = {"receipt": receipt, "is_running": True, "results": {}}
-    for (test_type, test_options) in test_data.items():
-        for options in test_options:
-            # Ensure that all options are lowercase.
-            options = {key.lower(): value for key, value in options.items()}
-            tests.append({"type": test_type, "options": options})
-            if test_type not in test_status["results"]:
-                test_status["results"][test_type] = []
+    for test in tests:
+        test_status["results"].setdefault(test["type"], [])
     uwsgi.cache_update(receipt, json.dumps(test_status), 600, "receipts")
-    # Execute tests in parallel.
-    if len(tests) < max_procs:
-        pool = multiprocessing.Pool(len(tests))
-    else:
-        pool = multiprocessing.Pool(max_procs)
-    result = pool.map(_worker, tests)
-    # Wait for ALL results before terminating the pool.
-    pool.close()
-    pool.join()
-    # Parse test results and append them to our test status.
-    for test in result:
+    # Execute tests in parallel and append their results to our test status as they complete,
+    # so that the results so far can be retrieved while the remaining tests are running.
+    results = iter_tests(
+        tests, max_procs, deadline=deadline, cancelled=cancelled, controller=controller
+    )
+    for test in results:
         test_status["results"][test["type"]].append(test["results"])
+        if controller is not None:
+            # Publish the limits of this worker for the status endpoint. They expire like the
+            # receipts, so that the keys of recycled workers don't take up the cache for good.
+            state = json.dumps(controller.get_state())
+            uwsgi.cache_update(get_concurrency_key(os.getpid()), state, 600, "receipts")
+        # A deleted receipt must not be brought back by the results of its cancelled tests.
+        if not cancelled():
+            uwsgi.cache_update(receipt, json.dumps(test_status), 600, "receipts")
     test_status["is_running"] = False
     # Update the client's receipt with the current test status including test results.
-    uwsgi.cache_update(receipt, json.dumps(test_status), 600, "receipts")
+    if not cancelled():
+        uwsgi.cache_update(receipt, json.dumps(test_status), 600, "receipts")
+    uwsgi.cache_del(cancel_key, "receipts")
     # Ensure that the daemon is stopped after cache update.
     stop_event.set()
 
 
-def execute_tests(receipt, test_data, max_procs):
+def execute_tests(receipt, test_data, max_procs, controller=None):
     """This is a glue function where every part of Scouter comes together into one.
 
     Parse and execute tests in a background daemon thread. Pass all data to a worker pool
@@ -192,13 +76,16 @@ def execute_tests(receipt, test_data, max_procs):
 
     Args:
         receipt     (str) : The UWSGI cache-key to append test results to.
-        test_data   (dict): The tests to execute.
+        test_data   (dict): The tests to execute, optionally along with a "deadline_ms" for all of
+                            them, in milliseconds from now.
         max_procs   (int) : The maximum number of parallel processes to be used in the worker pool.
+        controller  (class): The ConcurrencyController of this worker, which adapts the number
+                             of tests of every type that run at once below `max_procs`, or None.
 
     """
     stop_event = threading.Event()
     thread = threading.Thread(
-        target=_create_worker_pool, args=(receipt, test_data, max_procs, stop_event)
+        target=_create_worker_pool, args=(receipt, test_data, max_procs, stop_event, controller)
     )
     thread.daemon = True
     thread.start()
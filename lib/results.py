@@ -0,0 +1,108 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+# The layouts of retrieved test results. "rows" keeps results as they are stored, "columnar"
+# turns every list of flat records, like ping replies and trace hops, into a list per field.
+LAYOUTS = ("rows", "columnar")
+
+
+def parse_fields(fields):
+    """Parse a `fields` projection into a tree of the keys to keep.
+
+    Fields are comma separated paths of dot separated keys into the test status, e.g.
+    "is_running,results.ping.result.loss". A "*" key matches every key of an object, e.g.
+    "results.*.failed", and lists are traversed transparently.
+
+    Args:
+        fields (str): The fields projection, or None to keep everything.
+
+    Returns:
+        dict: Returns a tree of the keys to keep, in which None keeps a whole value, or None
+              to keep everything.
+
+    """
+    if fields is None:
+        return None
+    tree = {}
+    for field in fields.split(","):
+        keys = field.strip().split(".")
+        if not all(keys):
+            raise ValueError(f"Provided 'fields' of '{fields}' has an empty field or key.")
+        node = tree
+        for key in keys[:-1]:
+            if node.get(key, {}) is None:
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+    return tree
+
+
+def _merge(first, second):
+    """Merge two projection trees, in which None keeps a whole value."""
+    if first is None or second is None:
+        return None
+    merged = dict(first)
+    for (key, node) in second.items():
+        merged[key] = _merge(merged[key], node) if key in merged else node
+    return merged
+
+
+def project(data, tree):
+    """Keep only the fields of a projection tree, as returned by `parse_fields`."""
+    if tree is None:
+        return data
+    if isinstance(data, list):
+        return [project(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    projected = {}
+    for (key, value) in data.items():
+        nodes = [tree[name] for name in (key, "*") if name in tree]
+        if nodes:
+            node = nodes[0] if len(nodes) == 1 else _merge(*nodes)
+            projected[key] = project(value, node)
+    return projected
+
+
+def _is_record(item):
+    return isinstance(item, dict) and not any(
+        isinstance(value, (dict, list)) for value in item.values()
+    )
+
+
+def to_columns(data):
+    """Turn every list of flat records with the same keys into an object of a list per key.
+
+    Field names then appear once per list rather than once per record, e.g. the ping
+    replies [{"seq": 0, "rtt_ms": 1.2}, {"seq": 1, "rtt_ms": 1.3}] become
+    {"seq": [0, 1], "rtt_ms": [1.2, 1.3]}.
+
+    """
+    if isinstance(data, dict):
+        return {key: to_columns(value) for (key, value) in data.items()}
+    if not isinstance(data, list):
+        return data
+    items = [to_columns(item) for item in data]
+    if items and all(_is_record(item) for item in items):
+        keys = list(items[0])
+        if all(item.keys() == items[0].keys() for item in items):
+            return {key: [item[key] for item in items] for key in keys}
+    return items
+
+
+def render(status, tree=None, layout="rows"):
+    """Apply a fields projection and a layout to a test status.
+
+    Args:
+        status (dict): The test status, as stored under the receipt.
+        tree   (dict): The projection tree, as returned by `parse_fields`. Defaults to None.
+        layout (str) : One of LAYOUTS. Defaults to "rows".
+
+    Returns:
+        dict: Returns the rendered test status.
+
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Provided 'layout' of '{layout}' is not supported. {LAYOUTS}.")
+    status = project(status, tree)
+    return to_columns(status) if layout == "columnar" else status
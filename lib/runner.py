@@ -0,0 +1,684 @@
+# pylint: disable=locally-disabled, missing-docstring, import-error, broad-except, global-statement
+
+from secrets import token_hex
+import os
+import time
+import queue
+import signal
+import threading
+import importlib
+import contextlib
+import multiprocessing
+import lib.utilities as utilities
+import lib.constants as constants
+from lib.accounting import ResourceMonitor
+from lib.deadline import DeadlineExceeded, deadline as test_deadline
+from lib.wrappers import (
+    _get_descendant_pids,
+    _get_int_option,
+    _get_orphaned_pids,
+    _get_process_memory,
+)
+
+# The queue that the pool processes report the tests they start on, see `_init_process`.
+_STARTS = None
+# The thread of this process that kills orphaned browser drivers, see `_start_watchdog`.
+_WATCHDOG = None
+_WATCHDOG_LOCK = threading.Lock()
+
+
+def _browser_request(options, test_data):
+    """Execute a browser_request test if all requirements are met."""
+    url = options.get("url")
+    if url is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["url"]
+        try:
+            test_data["result"] = utilities.browser_request(url, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data[
+            "message"
+        ] = "Required test option of 'url' was not given. Please pass the required 'url' option."
+
+
+def _dns_bulk(options, test_data):
+    """Execute a dns_bulk test if all requirements are met."""
+    queries = options.get("queries")
+    if queries is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["queries"]
+        try:
+            test_data["result"] = utilities.dns_bulk(queries, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data["message"] = (
+            "Required test option of 'queries' was not given. "
+            "Please pass the required 'queries' option."
+        )
+
+
+def _dns_delegation_trace(options, test_data):
+    """Execute a dns_delegation_trace test if all requirements are met."""
+    qname = options.get("qname")
+    if qname is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["qname"]
+        try:
+            test_data["result"] = utilities.dns_delegation_trace(qname, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data["message"] = (
+            "Required test option of 'qname' was not given. "
+            "Please pass the required 'qname' option."
+        )
+
+
+def _dns_lookup(options, test_data):
+    """Execute a dns_lookup test if all requirements are met."""
+    qname = options.get("qname")
+    if qname is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["qname"]
+        try:
+            test_data["result"] = utilities.dns_lookup(qname, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data["message"] = (
+            "Required test option of 'qname' was not given. "
+            "Please pass the required 'qname' option."
+        )
+
+
+def _dns_traceroute(options, test_data):
+    """Execute a dns_traceroute test if all requirements are met."""
+    qname = options.get("qname")
+    if qname is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["qname"]
+        try:
+            test_data["result"] = utilities.dns_traceroute(qname, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data["message"] = (
+            "Required test option of 'qname' was not given. "
+            "Please pass the required 'qname' option."
+        )
+
+
+def _http_request(options, test_data):
+    """Execute an http_request test if all requirements are met."""
+    url = options.get("url")
+    if url is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["url"]
+        try:
+            test_data["result"] = utilities.http_request(url, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data[
+            "message"
+        ] = "Required test option of 'url' was not given. Please pass the required 'url' option."
+
+
+def _ping(options, test_data):
+    """Execute a ping test if all requirements are met."""
+    dst = options.get("dst")
+    if dst is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["dst"]
+        try:
+            test_data["result"] = utilities.ping(dst, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data[
+            "message"
+        ] = "Required test option of 'dst' was not given. Please pass the required 'dst' option."
+
+
+def _pmtu(options, test_data):
+    """Execute a pmtu test if all requirements are met."""
+    dst = options.get("dst")
+    if dst is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["dst"]
+        try:
+            test_data["result"] = utilities.pmtu(dst, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data[
+            "message"
+        ] = "Required test option of 'dst' was not given. Please pass the required 'dst' option."
+
+
+def _tcp_ping(options, test_data):
+    """Execute a tcp_ping test if all requirements are met."""
+    targets = options.get("targets")
+    if targets is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["targets"]
+        try:
+            test_data["result"] = utilities.tcp_ping(targets, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data["message"] = (
+            "Required test option of 'targets' was not given. "
+            "Please pass the required 'targets' option."
+        )
+
+
+def _tls_probe(options, test_data):
+    """Execute a tls_probe test if all requirements are met."""
+    targets = options.get("targets")
+    if targets is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["targets"]
+        try:
+            test_data["result"] = utilities.tls_probe(targets, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data["message"] = (
+            "Required test option of 'targets' was not given. "
+            "Please pass the required 'targets' option."
+        )
+
+
+def _traceroute(options, test_data):
+    """Execute a traceroute test if all requirements are met."""
+    dst = options.get("dst")
+    if dst is not None:
+        # Remove required arg from options to prevent duplicates.
+        del options["dst"]
+        try:
+            test_data["result"] = utilities.traceroute(dst, **options)
+            if not test_data["result"]["failed"]:
+                test_data["failed"] = False
+        except Exception as error:
+            test_data["message"] = str(error)
+    else:
+        test_data[
+            "message"
+        ] = "Required test option of 'dst' was not given. Please pass the required 'dst' option."
+
+
+def _worker(test):
+    """Process pool worker to execute tests."""
+    # Check if a custom identifier was provided in the test; if not, add one.
+    test_id = test["options"]["id"] if test["options"].get("id") else token_hex(3)
+    test_data = {"id": test_id, "failed": True, "message": None, "result": {}}
+    # The test's own deadline counts from its start, the payload's from its submission.
+    deadline = test.get("deadline")
+    try:
+        deadline_ms = _get_int_option(
+            test["options"], "deadline_ms", None, 1, constants.MAX_DEADLINE_MS
+        )
+    except (TypeError, ValueError) as error:
+        test_data["message"] = str(error)
+        return {"type": test["type"], "results": test_data}
+    test["options"].pop("deadline_ms", None)
+    # Optionally account for what the test costs, in its results.
+    resources = bool(test["options"].pop("resources", False))
+    if deadline_ms is not None:
+        own_deadline = time.time() + deadline_ms / 1000
+        deadline = own_deadline if deadline is None else min(deadline, own_deadline)
+    if deadline is not None and time.time() >= deadline:
+        test_data["message"] = "Test was not started before its deadline."
+        test_data["deadline_exceeded"] = True
+        return {"type": test["type"], "results": test_data}
+    monitor = ResourceMonitor() if resources else contextlib.nullcontext()
+    try:
+        with monitor, test_deadline(deadline, constants.DEADLINE_GRACE):
+            _run_test(test, test_data)
+    except DeadlineExceeded as error:
+        test_data["message"] = str(error)
+    if deadline is not None and time.time() >= deadline:
+        test_data["deadline_exceeded"] = True
+    if resources:
+        test_data["resources"] = monitor.usage
+    return {"type": test["type"], "results": test_data}
+
+
+def _run_test(test, test_data):
+    """Perform tests depending on given test type."""
+    # Parse options and ensure that requirements have been given;
+    # if not, append an error message to the returned data.
+    if test["type"] == "browser_request":
+        _browser_request(test["options"], test_data)
+    elif test["type"] == "dns_bulk":
+        _dns_bulk(test["options"], test_data)
+    elif test["type"] == "dns_delegation_trace":
+        _dns_delegation_trace(test["options"], test_data)
+    elif test["type"] == "dns_lookup":
+        _dns_lookup(test["options"], test_data)
+    elif test["type"] == "dns_traceroute":
+        _dns_traceroute(test["options"], test_data)
+    elif test["type"] == "http_request":
+        _http_request(test["options"], test_data)
+    elif test["type"] == "tcp_ping":
+        _tcp_ping(test["options"], test_data)
+    elif test["type"] == "tls_probe":
+        _tls_probe(test["options"], test_data)
+    elif test["type"] == "traceroute":
+        _traceroute(test["options"], test_data)
+    elif test["type"] == "ping":
+        _ping(test["options"], test_data)
+    elif test["type"] == "pmtu":
+        _pmtu(test["options"], test_data)
+    else:
+        test_data["message"] = "Provided test type does not exist."
+
+
+def parse_tests(test_data):
+    """Flatten an API test payload into a list of tests for `_worker`.
+
+    Args:
+        test_data (dict): The test payload, keyed by test type with a list of test options for
+                          each type.
+
+    Returns:
+        list: Returns a list of {"type": ..., "options": ...} test dictionaries.
+
+    """
+    tests = []
+    for (test_type, test_options) in test_data.items():
+        for options in test_options:
+            tests.append(normalize_test(test_type, options))
+    return tests
+
+
+def normalize_test(test_type, options):
+    """Build a single test for `_worker`, ensuring that all options are lowercase."""
+    if not isinstance(options, dict):
+        raise TypeError(f"Provided options of a '{test_type}' test must be an object.")
+    return {"type": test_type, "options": {key.lower(): value for key, value in options.items()}}
+
+
+def _init_process(starts):
+    """Pool process initializer, keeping the queue to report the started tests on."""
+    global _STARTS
+    _STARTS = starts
+
+
+def _get_delegations(test):
+    """Get the delegations cached by this process that a dns_delegation_trace test may start
+    from, see `lib.utilities.dns.get_delegations`.
+
+    Returns:
+        dict: Returns the delegations keyed by zone, or None if the test isn't a
+              dns_delegation_trace or the dns module can't be imported.
+
+    """
+    qname = test["options"].get("qname")
+    if test["type"] != "dns_delegation_trace" or not isinstance(qname, str):
+        return None
+    try:
+        return importlib.import_module("lib.utilities.dns").get_delegations(qname)
+    except ImportError:
+        return None
+
+
+def _indexed_worker(indexed_test):
+    """Process pool worker to execute tests, tagging their results with their index and the
+    RSS of the process once done, in KiB. The index and PID of the process are reported to
+    _STARTS on start, so that the process can be killed should the test hang.
+
+    dns_delegation_trace tests start from the delegations of the process running the pool,
+    passed as the test's "delegations", and return the delegations of their qname, so that the
+    cache outlives the pool.
+
+    """
+    (index, test) = indexed_test
+    if _STARTS is not None:
+        _STARTS.put((index, os.getpid()))
+    delegations = test.get("delegations")
+    if delegations is not None:
+        # The qname option is consumed by the test.
+        qname = test["options"]["qname"]
+        importlib.import_module("lib.utilities.dns").merge_delegations(delegations)
+    result = _worker(test)
+    if delegations is not None:
+        delegations = importlib.import_module("lib.utilities.dns").get_delegations(qname)
+    return index, result, _get_process_memory(os.getpid())["rss_kb"], delegations
+
+
+def _expired_result(test):
+    """Build the result of a test that was killed for running past its deadline."""
+    test_data = {
+        "id": test["options"].get("id") or None,
+        "failed": True,
+        "message": "Test was killed after running past its deadline.",
+        "result": {},
+        "deadline_exceeded": True,
+    }
+    return {"type": test["type"], "results": test_data}
+
+
+def _get_hard_deadline(test, start_time):
+    """Get the time after which the process of a started test with its own deadline is killed.
+
+    A test that is stuck in C code doesn't get the DeadlineExceeded exception, so it's given
+    DEADLINE_GRACE seconds to stop on its own and another DEADLINE_GRACE seconds to raise.
+
+    Returns:
+        float: Returns the time as a time.time() timestamp, or None if the test has no valid
+               "deadline_ms" of its own.
+
+    """
+    try:
+        deadline_ms = _get_int_option(
+            test["options"], "deadline_ms", None, 1, constants.MAX_DEADLINE_MS
+        )
+    except (TypeError, ValueError):
+        return None
+    if deadline_ms is None:
+        return None
+    deadline = start_time + deadline_ms / 1000
+    if test.get("deadline") is not None:
+        deadline = min(deadline, test["deadline"])
+    return deadline + 2 * constants.DEADLINE_GRACE
+
+
+def _kill_process(pid):
+    """Kill a process along with everything that it started."""
+    for child in _get_descendant_pids(pid) + [pid]:
+        try:
+            os.kill(child, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def _kill_pool(pool):
+    """Kill the processes of a pool along with everything that they started, such as browsers
+    and their drivers, which would otherwise outlive them."""
+    # Pool keeps its worker processes in its private `_pool` list.
+    for process in list(pool._pool):  # pylint: disable=protected-access
+        for pid in _get_descendant_pids(process.pid):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+    pool.terminate()
+
+
+def _close_pool(pool, killed):
+    """Let the processes of a pool exit once they're done with their tests. A killed process
+    never completes its task, which the pool would wait for forever, so a pool that had one
+    killed is terminated instead."""
+    if killed:
+        pool.terminate()
+    else:
+        pool.close()
+
+
+def _new_pool(max_procs, starts):
+    """Start a pool whose processes are replaced after POOL_MAX_TASKS_PER_CHILD tests, and
+    report the tests that they start to `starts`."""
+    return multiprocessing.Pool(
+        max_procs,
+        initializer=_init_process,
+        initargs=(starts,),
+        maxtasksperchild=constants.POOL_MAX_TASKS_PER_CHILD,
+    )
+
+
+def kill_orphaned_drivers():
+    """Kill the browser drivers orphaned by tests that were killed, along with their browsers.
+
+    Returns:
+        int: Returns the number of drivers killed.
+
+    """
+    orphans = _get_orphaned_pids(constants.ORPHAN_PROCESS_NAMES)
+    for orphan in orphans:
+        _kill_process(orphan)
+    return len(orphans)
+
+
+def _watch_orphaned_drivers():
+    """Kill the orphaned browser drivers every ORPHAN_CHECK_INTERVAL seconds, so that they don't
+    pile up while a long payload is still running."""
+    while True:
+        time.sleep(constants.ORPHAN_CHECK_INTERVAL)
+        try:
+            kill_orphaned_drivers()
+        except Exception:
+            pass
+
+
+def _start_watchdog():
+    """Start the orphaned browser driver watchdog of this process, unless it's running."""
+    global _WATCHDOG
+    with _WATCHDOG_LOCK:
+        if _WATCHDOG is None or not _WATCHDOG.is_alive():
+            _WATCHDOG = threading.Thread(
+                target=_watch_orphaned_drivers, name="orphan-watchdog", daemon=True
+            )
+            _WATCHDOG.start()
+
+
+def iter_tests(tests, max_procs, ordered=True, deadline=None, cancelled=None, controller=None):
+    """Execute tests in a pool of worker processes and yield their results.
+
+    This is the uWSGI independent core of Scouter, shared by the API and the command line.
+
+    Args:
+        tests     (iterable): The tests to execute, as returned by `parse_tests`.
+        max_procs (int)     : The maximum number of parallel processes to use. 0 executes the
+                              tests one after the other in the calling process, which is
+                              handy when profiling.
+        ordered   (bool)    : Whether or not to yield the results in the order of `tests`
+                              rather than as soon as they complete. Defaults to True.
+        deadline  (float)   : The deadline of every test, as a time.time() timestamp. Tests stop
+                              at their deadline with the results they have so far, and tests
+                              that are still running DEADLINE_GRACE seconds later are stopped
+                              with an exception. Should they still be running after another
+                              DEADLINE_GRACE seconds, their processes are killed and they are
+                              reported as failed. Tests with a "deadline_ms" option of their
+                              own are held to it the same way, and only their own process is
+                              killed, see `_get_hard_deadline`. Defaults to None.
+        cancelled (callable): Optionally polled every CANCEL_POLL_INTERVAL seconds. Once it
+                              returns True the running tests are killed and no more results are
+                              yielded.
+        controller (ConcurrencyController): Optionally limits the number of tests of every type
+                              that run at once, counted across every payload that shares it,
+                              see `lib.concurrency`. `max_procs` stays the hard cap of this
+                              payload. Defaults to None.
+
+    Yields:
+        dict: Yields a {"type": ..., "results": ...} dictionary per executed test.
+
+    """
+    if not max_procs:
+        for test in tests:
+            if cancelled is not None and cancelled():
+                return
+            yield _worker(dict(test, deadline=deadline))
+        return
+    if deadline is not None:
+        # The tests that never got to run have to be reported once the deadline has passed.
+        tests = list(tests)
+    if isinstance(tests, list):
+        if not tests:
+            return
+        max_procs = min(len(tests), max_procs)
+        # Fork the pool with the modules of these tests already imported, so that they are
+        # shared rather than imported again by every pool process.
+        try:
+            utilities.preload(
+                {test["type"] for test in tests if test["type"] in utilities.TEST_MODULES}
+            )
+        except ImportError:
+            # Leave it to the tests themselves to report their missing dependencies.
+            pass
+    indexed_tests = ((index, dict(test, deadline=deadline)) for (index, test) in enumerate(tests))
+    _start_watchdog()
+    starts = multiprocessing.SimpleQueue()
+    pool = _new_pool(max_procs, starts)
+    # Once a pool process grows past POOL_MAX_RSS_KB, its pool is retired rather than drained:
+    # the next tests start in a new pool straight away, while the retired pool is closed, so
+    # that its processes exit once its running tests are done, and is then joined.
+    retired = []
+    # The pools that had the process of a test killed, see `_close_pool`.
+    killed = set()
+    # The tests that are running: index -> (test, start time, hard deadline, pool).
+    started = {}
+    try:
+        completed = queue.SimpleQueue()
+        # Tests read ahead of being started, so that tests of other types can start while
+        # the tests of a type are held back by the controller.
+        waiting = []
+        exhausted = False
+        # The PIDs of the processes that run the started tests, once they reported in.
+        pids = {}
+        # Results are collected as they complete and put back in order here, so that the
+        # results of the tests that completed are kept when another one has to be killed.
+        pending = {}
+        done = set()
+        while True:
+            while not exhausted and len(waiting) < max_procs:
+                item = next(indexed_tests, None)
+                exhausted = item is None
+                if item is not None:
+                    waiting.append(item)
+            for old_pool in list(retired):
+                if all(entry[3] is not old_pool for entry in started.values()):
+                    _close_pool(old_pool, old_pool in killed)
+                    old_pool.join()
+                    retired.remove(old_pool)
+            for item in list(waiting):
+                test_type = item[1]["type"]
+                if len(started) >= max_procs:
+                    break
+                if controller is not None and not controller.acquire(test_type):
+                    continue
+                waiting.remove(item)
+                start_time = time.time()
+                hard_deadline = _get_hard_deadline(item[1], start_time)
+                started[item[0]] = (item[1], start_time, hard_deadline, pool)
+                delegations = _get_delegations(item[1])
+                if delegations is not None:
+                    item = (item[0], dict(item[1], delegations=delegations))
+                pool.apply_async(
+                    _indexed_worker, (item,), callback=completed.put, error_callback=completed.put
+                )
+            if exhausted and not waiting and not started:
+                break
+            try:
+                outcome = completed.get(timeout=constants.CANCEL_POLL_INTERVAL)
+            except queue.Empty:
+                outcome = None
+            if cancelled is not None and cancelled():
+                for old_pool in retired + [pool]:
+                    _kill_pool(old_pool)
+                return
+            if isinstance(outcome, BaseException):
+                raise outcome
+            while not starts.empty():
+                (index, pid) = starts.get()
+                if index in started:
+                    pids[index] = pid
+            finished = []
+            if outcome is not None:
+                (index, result, rss_kb, delegations) = outcome
+                if delegations:
+                    importlib.import_module("lib.utilities.dns").merge_delegations(delegations)
+                if rss_kb is not None and rss_kb > constants.POOL_MAX_RSS_KB and index in started:
+                    # Only retire the pool that the process belongs to, and only once.
+                    if started[index][3] is pool:
+                        pool.close()
+                        retired.append(pool)
+                        pool = _new_pool(max_procs, starts)
+                finished.append((index, result))
+            # SIGALRM can't interrupt a test stuck in C code, so its process is killed instead.
+            for (index, (test, _, hard_deadline, test_pool)) in list(started.items()):
+                if hard_deadline is not None and time.time() > hard_deadline and index in pids:
+                    _kill_process(pids[index])
+                    killed.add(test_pool)
+                    finished.append((index, _expired_result(test)))
+            for (index, result) in finished:
+                # The result of a test may still come in after its process was killed.
+                if index not in started:
+                    continue
+                (test, start_time, _, _) = started.pop(index)
+                pids.pop(index, None)
+                if controller is not None:
+                    controller.release(test["type"])
+                    controller.record(test["type"], time.time() - start_time, result)
+                pending[index] = result
+                # Unordered results go out right away, ordered ones once all before them did.
+                ready = [index] if not ordered else []
+                while ordered and len(done) + len(ready) in pending:
+                    ready.append(len(done) + len(ready))
+                for index in ready:
+                    done.add(index)
+                    yield pending.pop(index)
+            payload_expired = deadline is not None and (
+                time.time() > deadline + 2 * constants.DEADLINE_GRACE
+            )
+            if outcome is None and payload_expired:
+                for old_pool in retired + [pool]:
+                    _kill_pool(old_pool)
+                for (index, test) in enumerate(tests):
+                    if index not in done:
+                        yield pending.pop(index, None) or _expired_result(test)
+                return
+        # Wait for ALL results before terminating the pools.
+        for old_pool in retired + [pool]:
+            _close_pool(old_pool, old_pool in killed)
+    except BaseException:
+        for old_pool in retired + [pool]:
+            _kill_pool(old_pool)
+        raise
+    finally:
+        for old_pool in retired + [pool]:
+            old_pool.join()
+        kill_orphaned_drivers()
+        # The tests that were cancelled or cut short no longer count against shared limits.
+        if controller is not None:
+            for (test, _, _, _) in started.values():
+                controller.release(test["type"])
+
+
+def run_tests(tests, max_procs, **kwargs):
+    """Execute tests in a pool of worker processes and return all of their results in order.
+
+    Args:
+        tests     (list): The tests to execute, as returned by `parse_tests`.
+        max_procs (int) : The maximum number of parallel processes to use.
+        **kw      (dict): Keyword arguments to optionally pass on to `iter_tests`.
+
+    Returns:
+        list: Returns a list of {"type": ..., "results": ...} dictionaries.
+
+    """
+    return list(iter_tests(tests, max_procs, **kwargs))
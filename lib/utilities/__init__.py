@@ -2,9 +2,68 @@
 
 __version__ = "1.0.0"
 
-from .browser import browser_request
-from .dns import dns_lookup, dns_traceroute
-from .http import http_request
-from .network import ping, traceroute
+import sys
+import time
+import importlib
 
-__all__ = ["browser_request", "dns_lookup", "dns_traceroute", "http_request", "ping", "traceroute"]
+# The module implementing every test type. A module is only imported once a test of one of
+# its types runs, or once it's preloaded, as scapy, selenium, geoip2 and pycurl take seconds
+# and tens of MB to import.
+TEST_MODULES = {
+    "browser_request": "browser",
+    "dns_bulk": "dns",
+    "dns_delegation_trace": "dns",
+    "dns_lookup": "dns",
+    "dns_traceroute": "dns",
+    "http_request": "http",
+    "ping": "network",
+    "pmtu": "network",
+    "tcp_ping": "network",
+    "tls_probe": "tls",
+    "traceroute": "network",
+}
+
+__all__ = sorted(TEST_MODULES)
+
+
+def __getattr__(name):
+    module = TEST_MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    function = getattr(importlib.import_module(f".{module}", __name__), name)
+    # Bind the function to the package so that its module is only looked up once.
+    globals()[name] = function
+    return function
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+def preload(test_types=None):
+    """Import the modules of the provided test types ahead of time.
+
+    Preloading in a parent process, like the uWSGI master, lets every process forked from it
+    share the imported modules copy-on-write rather than import them again.
+
+    Args:
+        test_types (iterable): The test types to preload. Defaults to all of them.
+
+    Returns:
+        dict: Returns a dictionary object with the import time in milliseconds of every
+              module that wasn't imported yet.
+
+    """
+    timings = {}
+    for test_type in TEST_MODULES if test_types is None else test_types:
+        if test_type not in TEST_MODULES:
+            raise ValueError(
+                f"Provided test type of '{test_type}' does not exist. {sorted(TEST_MODULES)}."
+            )
+        module = TEST_MODULES[test_type]
+        if f"{__name__}.{module}" in sys.modules:
+            continue
+        start_time = time.time()
+        importlib.import_module(f".{module}", __name__)
+        timings[module] = (time.time() - start_time) * 1000
+    return timings
@@ -1,9 +1,11 @@
 # pylint: disable=locally-disabled, missing-docstring, no-member, wildcard-import
 
+import json
 from selenium import webdriver
 from selenium.common.exceptions import WebDriverException
 from lib.proxy import *
 import lib.constants as constants
+import lib.deadline as deadline
 
 
 def _format_har(har):
@@ -13,14 +15,10 @@ def _format_har(har):
         # Return the curl equivalent error codes on errors rather than sending a generic value of 0.
         if "_error" in entry["response"]:
             reason = entry["response"]["_error"]
-            if "Unable to resolve host" in reason:
-                entry["response"]["status"] = 6
-            elif "Unable to connect to host" in reason:
-                entry["response"]["status"] = 7
-            elif "Response timed out" in reason:
-                entry["response"]["status"] = 28
-            elif "No response received" in reason:
-                entry["response"]["status"] = 52
+            for (error, code) in constants.BROWSER_ERROR_CODES.items():
+                if error in reason:
+                    entry["response"]["status"] = code
+                    break
             entry["response"]["statusText"] = reason
             entry["failed"] = True
         else:
@@ -41,14 +39,117 @@ def _format_har(har):
     return formatted_har
 
 
+def _get_har_data(entry):
+    """Get the results of a formatted HAR entry."""
+    return {
+        "url": entry["request"]["url"],
+        "failed": entry["failed"],
+        "status": entry["response"]["status"],
+        "reason": entry["response"]["statusText"],
+        "version": entry["response"]["httpVersion"],
+        "headers": entry["response"]["headers"],
+        "time_namelookup": entry["timings"]["dns"],
+        "time_connect": entry["timings"]["connect"],
+        "time_appconnect": entry["timings"]["ssl"],
+        "time_starttransfer": entry["timings"]["wait"],
+        "time_total": entry["timings"]["total"],
+    }
+
+
+def _get_duration(timing, start, end):
+    """Get the duration in milliseconds between two offsets of a DevTools ResourceTiming, or 0
+    if either of them is unset, e.g. for the connection of a reused connection."""
+    if timing.get(start, -1) < 0 or timing.get(end, -1) < 0:
+        return 0.0
+    return float(timing[end] - timing[start])
+
+
+def _get_devtools_response(url, response):
+    """Get the results of a DevTools Response object, timed like a HAR entry."""
+    timing = response.get("timing") or {}
+    protocol = response.get("protocol", "")
+    return {
+        "url": url,
+        "failed": False,
+        "status": response.get("status"),
+        "reason": response.get("statusText"),
+        "version": {"h2": "HTTP/2", "h3": "HTTP/3"}.get(protocol, protocol.upper()),
+        "headers": {key.lower(): value for (key, value) in response.get("headers", {}).items()},
+        "time_namelookup": _get_duration(timing, "dnsStart", "dnsEnd"),
+        "time_connect": _get_duration(timing, "connectStart", "connectEnd"),
+        "time_appconnect": _get_duration(timing, "sslStart", "sslEnd"),
+        "time_starttransfer": _get_duration(timing, "sendEnd", "receiveHeadersEnd"),
+        "time_total": 0.0,
+    }
+
+
+def _format_devtools_log(log):
+    """Format the DevTools Network events of Chrome's performance log like the HAR data from
+    the proxy, with one entry per request and redirect, in the order that they were sent."""
+    requests = {}
+    entries = []
+    for record in log:
+        message = json.loads(record["message"])["message"]
+        (method, params) = (message.get("method"), message.get("params", {}))
+        request_id = params.get("requestId")
+        if method == "Network.requestWillBeSent":
+            # Redirects are sent under the request ID of the request that was redirected.
+            previous = requests.get(request_id)
+            if previous is not None and "redirectResponse" in params:
+                previous["entry"].update(
+                    _get_devtools_response(previous["entry"]["url"], params["redirectResponse"])
+                )
+                previous["entry"]["time_total"] = (params["timestamp"] - previous["start"]) * 1000
+            # Requests stay failed until they get a response.
+            entry = _get_devtools_response(params["request"]["url"], {})
+            entry.update(failed=True, status=None, version=None)
+            requests[request_id] = {"entry": entry, "start": params["timestamp"]}
+            entries.append(entry)
+        elif request_id not in requests:
+            continue
+        elif method == "Network.responseReceived":
+            entry = requests[request_id]["entry"]
+            entry.update(_get_devtools_response(entry["url"], params["response"]))
+        elif method in ("Network.loadingFinished", "Network.loadingFailed"):
+            entry = requests[request_id]["entry"]
+            entry["time_total"] = (params["timestamp"] - requests[request_id]["start"]) * 1000
+            if method == "Network.loadingFailed":
+                entry["failed"] = True
+                entry["reason"] = params.get("errorText")
+                entry["status"] = constants.BROWSER_ERROR_CODES.get(entry["reason"], 0)
+    return entries
+
+
+def _get_navigation_timing(webdriver_):
+    """Get the Navigation Timing of the loaded page, in milliseconds from its start."""
+    timing = webdriver_.execute_script(
+        "var entry = performance.getEntriesByType('navigation')[0];"
+        "return entry ? entry.toJSON() : null;"
+    )
+    if not timing:
+        return None
+    return {
+        "dom_interactive": timing.get("domInteractive"),
+        "dom_content_loaded": timing.get("domContentLoadedEventEnd"),
+        "load": timing.get("loadEventEnd"),
+        "duration": timing.get("duration"),
+        "transfer_size": timing.get("transferSize"),
+    }
+
+
 def _setup_chrome(proxy):
     """Setup the Google chromedriver to run as minimally as possible"""
     opt = webdriver.ChromeOptions()
+    capabilities = None
     # Setup Chrome options to run as minimal as possible.
     opt.add_argument("--headless")
     opt.add_argument("--incognito")
-    # Instruct Chrome to proxy all requests via our previously created proxy server.
-    opt.add_argument(f"--proxy-server={proxy.proxy}")
+    if proxy is not None:
+        # Instruct Chrome to proxy all requests via our previously created proxy server.
+        opt.add_argument(f"--proxy-server={proxy.proxy}")
+    else:
+        # Record the DevTools Network events of the page load in the performance log instead.
+        capabilities = {"goog:loggingPrefs": {"performance": "ALL"}}
     opt.add_argument("--no-sandbox")
     opt.add_argument("--disable-background-networking")
     opt.add_argument("--enable-features=NetworkService,NetworkServiceInProcess")
@@ -77,9 +178,10 @@ def _setup_chrome(proxy):
     # Accept untrusted certs.
     opt.add_argument("--ignore-certificate-errors")
     try:
-        return webdriver.Chrome(chrome_options=opt)
+        return webdriver.Chrome(chrome_options=opt, desired_capabilities=capabilities)
     except WebDriverException as error:
-        proxy.close()
+        if proxy is not None:
+            proxy.close()
         raise Exception(str(error))
 
 
@@ -127,12 +229,16 @@ def browser_request(url, **kwargs):
     """Execute a browser emulated HTTP request.
 
     Attempt to load a provided webpage via a specified Browser, and return HAR data collected
-    by a newly created proxy server.
+    by a newly created proxy server, or by the browser itself.
 
     Args:
         url       (str)  : The webpage URL to attempt to load via the emulated browser.
         **driver  (str)  : The browser driver to use in the request. Defaults to "chrome".
         **headers (dict) : A key/value dict of HTTP request headers to inject. Defaults to None.
+        **mode    (str)  : Keyword argument to optionally specify how the page load is captured,
+                           one of BROWSER_MODES. "cdp" captures Chrome's DevTools Protocol
+                           network events without a proxy, and requires the chrome driver.
+                           Defaults to "proxy".
 
     Returns:
         dict: Returns a dictionary object with test results.
@@ -141,17 +247,44 @@ def browser_request(url, **kwargs):
     driver = kwargs.get("driver", "chrome").lower()
     headers = kwargs.get("headers", None)
     headers = headers if headers is not None else {}
-    failed = True
-    proxy = _setup_proxy(headers)
-    if driver == "chrome":
-        webdriver_ = _setup_chrome(proxy)
-    elif driver == "firefox":
-        webdriver_ = _setup_firefox(proxy)
-    else:
-        proxy.close()
+    mode = str(kwargs.get("mode", "proxy")).lower()
+    if mode not in constants.BROWSER_MODES:
+        raise ValueError(
+            f"Provided 'mode' of '{mode}' is not supported. {constants.BROWSER_MODES}."
+        )
+    if driver not in ("chrome", "firefox"):
         raise Exception(f"Provided driver of '{driver}' is not supported.")
-    webdriver_.set_page_load_timeout(constants.WEBPAGE_LOAD_TIMEOUT)
-    har = {"driver": driver, "child": []}
+    proxy = None
+    if mode == "cdp":
+        if driver != "chrome":
+            raise Exception(f"Provided 'mode' of '{mode}' is only supported by the chrome driver.")
+        if not isinstance(headers, dict):
+            raise TypeError(f"Provided 'headers' of '{headers}' must be a dictionary.")
+    else:
+        proxy = _setup_proxy(headers)
+    webdriver_ = _setup_chrome(proxy) if driver == "chrome" else _setup_firefox(proxy)
+    # Always quit the browser and close the proxy, even when the test is stopped at its
+    # deadline, so that neither outlives the test.
+    try:
+        if mode == "cdp":
+            # Network events are only recorded once the Network domain is enabled.
+            webdriver_.execute_cdp_cmd("Network.enable", {})
+            if headers:
+                webdriver_.execute_cdp_cmd("Network.setExtraHTTPHeaders", {"headers": headers})
+        return _load_page(url, driver, webdriver_, proxy)
+    finally:
+        webdriver_.quit()
+        if proxy is not None:
+            proxy.close()
+
+
+def _load_page(url, driver, webdriver_, proxy):
+    """Load a webpage and build the test results out of the HAR data collected by the proxy,
+    or by the browser if there's no proxy."""
+    # Shorten the page load timeout to the deadline, and keep whatever was loaded by then.
+    webdriver_.set_page_load_timeout(max(deadline.clamp(constants.WEBPAGE_LOAD_TIMEOUT), 1))
+    har = {"driver": driver, "mode": "proxy" if proxy is not None else "cdp", "child": []}
+    parent_url = None
     try:
         webdriver_.get(url)
     except Exception as error:  # pylint: disable=broad-except
@@ -159,9 +292,9 @@ def browser_request(url, **kwargs):
         # such as DNS resolution and connection failures.
         if driver == "firefox" and "Reached error page" in str(error):
             pass
+        elif deadline.is_expired():
+            har["deadline_exceeded"] = True
         else:
-            proxy.close()
-            webdriver_.quit()
             raise Exception(
                 f"Provided webpage of '{url}' failed to load due to "
                 f"the following reason: {str(error)}"
@@ -175,27 +308,20 @@ def browser_request(url, **kwargs):
             "Unable to get current url from webdriver due " f"to the following error: {str(error)}"
         )
         har["parent"] = {"message": message}
-    formatted_har_data = _format_har(proxy.har)
-    for entry in formatted_har_data:
-        har_data = {
-            "url": entry["request"]["url"],
-            "failed": entry["failed"],
-            "status": entry["response"]["status"],
-            "reason": entry["response"]["statusText"],
-            "version": entry["response"]["httpVersion"],
-            "headers": entry["response"]["headers"],
-            "time_namelookup": entry["timings"]["dns"],
-            "time_connect": entry["timings"]["connect"],
-            "time_appconnect": entry["timings"]["ssl"],
-            "time_starttransfer": entry["timings"]["wait"],
-            "time_total": entry["timings"]["total"],
-        }
-        if entry["request"]["url"] == parent_url:
+    failed = True
+    if proxy is not None:
+        entries = [_get_har_data(entry) for entry in _format_har(proxy.har)]
+    else:
+        entries = _format_devtools_log(webdriver_.get_log("performance"))
+        try:
+            har["navigation"] = _get_navigation_timing(webdriver_)
+        except Exception:  # pylint: disable=broad-except
+            har["navigation"] = None
+    for har_data in entries:
+        if har_data["url"] == parent_url:
             har["parent"] = har_data
             failed = False
         else:
             har["child"].append(har_data)
-    webdriver_.quit()
-    proxy.close()
     har["failed"] = failed
     return har
@@ -1,14 +1,19 @@
 # pylint: disable=locally-disabled, missing-docstring
 
 import time
-import geoip2
-import geoip2.database
-from scapy.layers.inet import IP, UDP, conf
-from scapy.layers.dns import DNS, DNSQR, dnstypes, dnsclasses
-from scapy.volatile import RandShort
-from scapy.sendrecv import sr, sr1
-from lib.wrappers import _resolve, _get_route_dev
+import random
+import socket
+import selectors
+import ipaddress
+import collections
+from scapy.layers.dns import DNS, dnstypes, dnsclasses
+from lib.engine import ProbeTemplate
+from lib.wrappers import _resolve, _get_version, _get_int_option
+from lib.utilities.network import IP_HEADER_SIZE, PROTO_HEADER_SIZE, _trace
 import lib.constants as constants
+import lib.deadline as deadline
+import lib.dnswire as dnswire
+import lib.dnstransport as dnstransport
 
 
 def _get_nameservers(resolv_conf="/etc/resolv.conf"):
@@ -36,6 +41,290 @@ def _get_nameservers(resolv_conf="/etc/resolv.conf"):
     return nameservers
 
 
+def _is_ip_address(addr):
+    """Check whether or not the provided address is an IP address rather than a name."""
+    try:
+        ipaddress.ip_address(addr)
+        return True
+    except ValueError:
+        return False
+
+
+def _get_rdtype(rdtype):
+    """Translate a record type name into its numeric value. Names that the wire codec
+    doesn't know about are looked up in scapy's much larger table."""
+    try:
+        return dnswire.get_rdtype(rdtype)
+    except dnswire.DNSWireError:
+        for (value, name) in dnstypes.items():
+            if name == rdtype:
+                return value
+    raise Exception(f"Provided record type of '{rdtype}' is not a recognized type.")
+
+
+def _format_scapy_record(record):
+    """Format a resource record dissected by scapy. Only used for exotic record types."""
+    # Record types with their own scapy layer don't always have an rdata field.
+    rdata = getattr(record, "rdata", None)
+    if isinstance(rdata, bytes):
+        try:
+            rdata = rdata.decode()
+        except UnicodeDecodeError:
+            # Some record types return a raw byte string for rdata.
+            rdata = None
+    elif not isinstance(rdata, str):
+        rdata = None
+    return {
+        "rrname": record.rrname.decode(),
+        "type": dnstypes.get(record.type, record.type),
+        "rclass": dnsclasses.get(record.rclass, record.rclass),
+        "ttl": record.ttl,
+        "rdlen": getattr(record, "rdlen", None),
+        "rdata": rdata,
+    }
+
+
+def _format_response(data):
+    """Format a raw DNS response into the rcode, question and answer of a dns_lookup result.
+
+    The response is decoded with the wire codec. scapy is only used to dissect the
+    response when it contains a record type that the codec can't present.
+
+    """
+    try:
+        response = dnswire.parse_response(data)
+    except dnswire.DNSWireError:
+        response = None
+    if response is None:
+        dns_packet = DNS(data)
+        # Some FORMERR and REFUSED responses don't echo the question back.
+        question = dns_packet.qd[0] if dns_packet.qdcount and dns_packet.qd else None
+        return {
+            "rcode": dnswire.RCODES.get(dns_packet.rcode, dns_packet.rcode),
+            "question": {
+                "qname": question.qname.decode(),
+                "qtype": dnstypes.get(question.qtype, question.qtype),
+                "qclass": dnsclasses.get(question.qclass, question.qclass),
+            }
+            if question is not None
+            else None,
+            "answer": [_format_scapy_record(dns_packet.an[i]) for i in range(dns_packet.ancount)],
+        }
+    formatted = {
+        "rcode": dnswire.RCODES.get(response["rcode"], response["rcode"]),
+        "question": None,
+        "answer": [],
+    }
+    if response["question"] is not None:
+        (qname, qtype, qclass) = response["question"]
+        formatted["question"] = {
+            "qname": qname,
+            "qtype": dnstypes.get(qtype, dnswire.get_rdtype_name(qtype)),
+            "qclass": dnsclasses.get(qclass, qclass),
+        }
+    dns_packet = None
+    for (index, (rrname, rdtype, rclass, ttl, rdlen, rdata)) in enumerate(response["answer"]):
+        if rdtype not in dnswire.DECODED_RDTYPES:
+            dns_packet = dns_packet if dns_packet is not None else DNS(data)
+            formatted["answer"].append(_format_scapy_record(dns_packet.an[index]))
+            continue
+        formatted["answer"].append(
+            {
+                "rrname": rrname,
+                "type": dnstypes.get(rdtype, dnswire.get_rdtype_name(rdtype)),
+                "rclass": dnsclasses.get(rclass, rclass),
+                "ttl": ttl,
+                "rdlen": rdlen,
+                "rdata": rdata,
+            }
+        )
+    return formatted
+
+
+def _new_response(nameserver, transport):
+    """Create the dict used to track a single nameserver's answer."""
+    return {
+        "ns": nameserver,
+        "rtt_ms": None,
+        "response": None,
+        "transport": transport,
+        "truncated": False,
+        "timings": {"connect_ms": None, "handshake_ms": None, "query_ms": None, "reused": False},
+    }
+
+
+def _query_nameservers(query, nameservers, race=False, port=53):
+    """Private function to send the same DNS query to every provided nameserver at once.
+
+    A single UDP socket is used per address family and every nameserver is given its own
+    transaction id so that answers can be matched back to the nameserver that sent them.
+
+    Args:
+        query       (bytearray): The wire format DNS query to send. Its transaction id is
+                                 patched in place.
+        nameservers (list)     : The resolved nameserver IP addresses to query.
+        race        (bool)     : Stop collecting answers as soon as the first one arrives.
+        port        (int)      : The nameserver port. Defaults to 53.
+
+    Returns:
+        list: Returns a list object with a dict per nameserver containing the nameserver,
+              the round-trip time and the raw DNS response (None if it timed out).
+
+    """
+    responses = [_new_response(nameserver, "udp") for nameserver in nameservers]
+    pending = {}
+    sockets = {}
+    selector = selectors.DefaultSelector()
+    txids = random.sample(range(1, 65536), len(nameservers))
+    for index, nameserver in enumerate(nameservers):
+        address = ipaddress.ip_address(nameserver)
+        family = socket.AF_INET6 if address.version == 6 else socket.AF_INET
+        if family not in sockets:
+            sockets[family] = socket.socket(family, socket.SOCK_DGRAM)
+            sockets[family].setblocking(False)
+            selector.register(sockets[family], selectors.EVENT_READ)
+        dnswire.set_txid(query, txids[index])
+        try:
+            sockets[family].sendto(query, (nameserver, port))
+        except OSError:
+            # Unreachable nameservers are simply reported as timeouts.
+            continue
+        pending[(txids[index], address)] = (index, time.time())
+    recv_deadline = time.time() + deadline.clamp(constants.DNS_TIMEOUT)
+    answered = False
+    while pending and time.time() < recv_deadline and not (race and answered):
+        for (key, _) in selector.select(timeout=recv_deadline - time.time()):
+            try:
+                data, addr = key.fileobj.recvfrom(65535)
+            except OSError:
+                continue
+            if len(data) < 12:
+                continue
+            txid = dnswire.get_txid(data)
+            match = pending.pop((txid, ipaddress.ip_address(addr[0])), None)
+            if match is None:
+                continue
+            responses[match[0]]["rtt_ms"] = (time.time() - match[1]) * 1000
+            responses[match[0]]["timings"]["query_ms"] = responses[match[0]]["rtt_ms"]
+            responses[match[0]]["response"] = data
+            answered = True
+    selector.close()
+    for sock in sockets.values():
+        sock.close()
+    return responses
+
+
+def _query_stream(query, nameserver, transport, port, **kwargs):
+    """Private function to send a DNS query over a persistent TCP, TLS or HTTPS connection.
+
+    Returns:
+        dict: Returns a dict in the same format as the ones returned by `_query_nameservers`.
+
+    """
+    response = _new_response(nameserver, transport)
+    dnswire.set_txid(query, random.randrange(1, 65536))
+    start_time = time.time()
+    # Shorten the timeout to the deadline. A timeout of 0 would make the sockets non-blocking.
+    timeout = max(deadline.clamp(constants.DNS_TIMEOUT), 0.001)
+    try:
+        (response["response"], response["timings"]) = dnstransport.query(
+            transport, query, nameserver, port, timeout, **kwargs
+        )
+    except dnstransport.DNSTransportError as error:
+        response["error"] = str(error)
+        return response
+    response["rtt_ms"] = (time.time() - start_time) * 1000
+    return response
+
+
+def _tcp_fallback(response, query, port):
+    """Retry a truncated UDP answer over TCP as described in RFC 7766."""
+    if response["response"] is None or not dnswire.parse_header(response["response"])[1] & 0x0200:
+        return response
+    retried = _query_stream(query, response["ns"], "tcp", port)
+    if retried["response"] is None:
+        # Keep the truncated UDP answer rather than failing the lookup.
+        response["truncated"] = True
+        return response
+    retried["truncated"] = True
+    retried["rtt_ms"] += response["rtt_ms"]
+    return retried
+
+
+def _dns_lookup_concurrent(query, nameservers, mode, port):
+    """Query every nameserver at once and build the dns_lookup result for the race and
+    compare modes.
+
+    The top level fields always describe the first answer received so that the result is a
+    drop-in replacement for a sequential lookup. The compare mode additionally returns every
+    nameserver's answer and round-trip time in `responses`.
+
+    """
+    nameservers = [_resolve(nameserver) for nameserver in nameservers]
+    start_time = time.time()
+    responses = _query_nameservers(query, nameservers, race=mode == "race", port=port)
+    responses = [_tcp_fallback(response, query, port) for response in responses]
+    elapsed_time = time.time() - start_time
+    result = {
+        "ns": None,
+        "mode": mode,
+        "transport": "udp",
+        "truncated": False,
+        "timings": None,
+        "rcode": None,
+        "elapsed_time": elapsed_time,
+        "timeout_count": 0,
+        "question": {"qname": None, "qtype": None, "qclass": None},
+        "answer": [],
+        "failed": True,
+    }
+    if mode == "compare":
+        result["responses"] = []
+    answered = sorted(
+        (response for response in responses if response["response"] is not None),
+        key=lambda response: response["rtt_ms"],
+    )
+    if not answered:
+        raise Exception(
+            f"Unable to get an answer back from any of the following nameservers: {nameservers}"
+        )
+    result["timeout_count"] = len(responses) - len(answered)
+    for response in responses:
+        if response["response"] is None:
+            if mode == "compare":
+                result["responses"].append(
+                    {
+                        "ns": response["ns"],
+                        "rtt_ms": None,
+                        "transport": response["transport"],
+                        "rcode": None,
+                        "answer": [],
+                    }
+                )
+            continue
+        formatted = _format_response(response["response"])
+        if response is answered[0]:
+            result["ns"] = response["ns"]
+            result["transport"] = response["transport"]
+            result["truncated"] = response["truncated"]
+            result["timings"] = response["timings"]
+            result.update(formatted)
+            if mode == "race":
+                result["elapsed_time"] = response["rtt_ms"] / 1000
+        if mode == "compare":
+            result["responses"].append(
+                {
+                    "ns": response["ns"],
+                    "rtt_ms": response["rtt_ms"],
+                    "transport": response["transport"],
+                    "rcode": formatted["rcode"],
+                    "answer": formatted["answer"],
+                }
+            )
+    result["failed"] = False
+    return result
+
+
 def dns_lookup(qname, **kwargs):
     """Function to perform DNS lookup queries.
 
@@ -46,59 +335,100 @@ def dns_lookup(qname, **kwargs):
                                    file for the listed nameservers and use those for querying.
         **rdtype       (str)     : Keyword argument to optionally specify the DNS record type to
                                    query for.
+        **mode         (str)     : Keyword argument to optionally specify how nameservers are
+                                   queried. "sequential" tries them one at a time, "race" queries
+                                   all of them at once and keeps the first answer, and "compare"
+                                   queries all of them at once and keeps every answer. Both
+                                   accept at most DNS_MAX_CONCURRENT_NS nameservers.
+                                   Defaults to "sequential". Only "sequential" is supported by
+                                   the stream transports.
+        **transport    (str)     : Keyword argument to optionally specify the transport. One of
+                                   "udp", "tcp", "tls" (DoT) or "https" (DoH). Truncated UDP
+                                   answers are retried over TCP. Defaults to "udp".
+        **port         (int)     : Keyword argument to optionally specify the nameserver port.
+                                   Defaults to 53, 853 for "tls" and 443 for "https".
+        **tls_hostname (str)     : Keyword argument to optionally specify the TLS server name
+                                   and DoH host. Defaults to the nameserver if it's a name.
+        **doh_path     (str)     : Keyword argument to optionally specify the DoH URL path.
+                                   Defaults to "/dns-query".
+        **ignore_ssl   (bool)    : Keyword argument to optionally specify whether or not to
+                                   disable certificate checks. Defaults to False.
 
     Returns:
         dict: Returns a dictionary object with test results.
 
     """
-    dnscodes = {
-        0: "ok",
-        1: "format-error",
-        2: "server-failure",
-        3: "name-error",
-        4: "not-implemented",
-        5: "refused",
-    }
     nameservers = kwargs.get("ns", None)
     rdtype = kwargs.get("rdtype", None)
+    mode = str(kwargs.get("mode", "sequential")).lower()
+    if mode not in constants.DNS_LOOKUP_MODES:
+        raise ValueError(
+            f"Provided 'mode' of '{mode}' is not supported. {constants.DNS_LOOKUP_MODES}."
+        )
+    transport = str(kwargs.get("transport", "udp")).lower()
+    if transport not in dnstransport.TRANSPORTS:
+        raise ValueError(
+            f"Provided 'transport' of '{transport}' is not supported. {dnstransport.TRANSPORTS}."
+        )
+    if transport != "udp" and mode != "sequential":
+        raise ValueError(f"Provided 'mode' of '{mode}' is only supported by the 'udp' transport.")
+    port = kwargs.get("port", dnstransport.DEFAULT_PORTS[transport])
+    if isinstance(port, str) and not port.isdigit():
+        raise TypeError(f"Provided 'port' of '{port}' must be an integer.")
+    port = abs(int(port))
+    if not 1 <= port <= 65535:
+        raise ValueError(f"Provided 'port' of '{port}' is not allowed. Min: 1, Max: 65535.")
+    ignore_ssl = kwargs.get("ignore_ssl", False)
+    if isinstance(ignore_ssl, str):
+        ignore_ssl = ignore_ssl.lower() in ("true", "1", "yes")
+    stream_options = {
+        "server_hostname": kwargs.get("tls_hostname", None),
+        "path": kwargs.get("doh_path", None),
+        "ignore_ssl": ignore_ssl,
+    }
     nameservers = nameservers if nameservers is not None else _get_nameservers()
     if isinstance(nameservers, str):
         nameservers = nameservers.split()
-    # Craft the UDP DNS packet.
-    if rdtype is None:
-        packet = UDP(sport=RandShort(), dport=53) / DNS(qd=DNSQR(qname=qname))
-    else:
-        rdtype = str(rdtype).upper()
-        try:
-            packet = UDP(sport=RandShort(), dport=53) / DNS(qd=DNSQR(qname=qname, qtype=rdtype))
-        except KeyError:
-            raise Exception(f"Provided record type of '{rdtype}' is not a recognized type.")
+    rdtype = "A" if rdtype is None else str(rdtype).upper()
+    # Craft the wire format DNS query once; only the transaction id changes per nameserver.
+    try:
+        query = dnswire.build_query(qname, _get_rdtype(rdtype))
+    except dnswire.DNSWireError as error:
+        raise Exception(str(error))
+    if mode != "sequential":
+        if len(nameservers) > constants.DNS_MAX_CONCURRENT_NS:
+            raise ValueError(
+                f"Provided 'ns' of {len(nameservers)} nameservers is not allowed in the "
+                f"'{mode}' mode. Max: {constants.DNS_MAX_CONCURRENT_NS}."
+            )
+        return _dns_lookup_concurrent(query, nameservers, mode, port)
     timeout_count = 0
+    response = None
     start_time = time.time()
-    # Tell Scapy to NOT ignore the inner packet source. This is to avoid issues with NAT.
-    conf.checkIPsrc = False
     # Loop through nameservers list until successfully query is achieved.
     for nameserver in nameservers:
-        nameserver = _resolve(nameserver)
-        iface = _get_route_dev(nameserver)
-        try:
-            ans = sr1(
-                IP(dst=nameserver) / packet,
-                iface=iface,
-                filter="udp",
-                timeout=constants.DNS_TIMEOUT,
-                retry=constants.PACKET_SEND_RETRY,
-                verbose=0,
-            )[0]
+        if deadline.is_expired():
             break
-        # I've found that requests exceeding the specified timeout value results in a generic
-        # TypeError message. We're handling that here.
-        except TypeError:
-            timeout_count += 1
-            continue
+        if transport == "udp":
+            response = _query_nameservers(query, [_resolve(nameserver)], port=port)[0]
+            response = _tcp_fallback(response, query, port)
+        else:
+            if stream_options["server_hostname"] is None and not _is_ip_address(nameserver):
+                stream_options["server_hostname"] = nameserver
+            response = _query_stream(
+                query, _resolve(nameserver), transport, port, **stream_options
+            )
+            stream_options["server_hostname"] = kwargs.get("tls_hostname", None)
+        if response["response"] is not None:
+            break
+        timeout_count += 1
     elapsed_time = time.time() - start_time
     result = {
         "ns": None,
+        "mode": mode,
+        "transport": transport,
+        "truncated": False,
+        "timings": None,
         "rcode": None,
         "elapsed_time": elapsed_time,
         "timeout_count": timeout_count,
@@ -107,33 +437,16 @@ def dns_lookup(qname, **kwargs):
         "failed": True,
     }
     # If we actually got an answer back; proceed with creating the returned data.
-    if timeout_count < len(nameservers):
-        for record in range(ans[0][0].ancount):
-            if not isinstance(ans[0][0].an[record].rdata, str):
-                try:
-                    rdata = ans[0][0].an[record].rdata.decode()
-                except UnicodeDecodeError:
-                    # Some record types return a raw byte string for rdata, such as SOA.
-                    rdata = None
-            else:
-                rdata = ans[0][0].an[record].rdata
-            result["answer"].append(
-                {
-                    "rrname": ans[0][0].an[record].rrname.decode(),
-                    "type": dnstypes[ans[0][0].an[record].type],
-                    "rclass": dnsclasses[ans[0][0].an[record].rclass],
-                    "ttl": ans[0][0].an[record].ttl,
-                    "rdlen": ans[0][0].an[record].rdlen,
-                    "rdata": rdata,
-                }
-            )
-        result["ns"] = ans.src
-        result["rcode"] = dnscodes[ans.rcode]
-        result["question"]["qname"] = ans[0][3].qname.decode()
-        result["question"]["qtype"] = dnstypes[ans[0][3].qtype]
-        result["question"]["qclass"] = dnsclasses[ans[0][3].qclass]
+    if response is not None and response["response"] is not None:
+        result["ns"] = response["ns"]
+        result["transport"] = response["transport"]
+        result["truncated"] = response["truncated"]
+        result["timings"] = response["timings"]
+        result.update(_format_response(response["response"]))
         result["failed"] = False
         return result
+    if response is not None and "error" in response:
+        raise Exception(response["error"])
     raise Exception(
         f"Unable to get an answer back from any of the following nameservers: {nameservers}"
     )
@@ -149,12 +462,20 @@ def dns_traceroute(qname, **kwargs):
                               and use the first entry.
         **max_ttl      (int): Keyword argument to optionally specify the max time-to-live
                               (max number of hops). Defaults to 32. Max value of 32.
+        **proto        (str): Keyword argument to optionally specify the transport protocol.
+                              "TCP" traces with SYN packets towards the TCP, DoT or DoH port of
+                              the nameserver. Defaults to UDP.
+        **dport        (int): Keyword argument to optionally specify the destination port.
+                              Defaults to 53.
+        **ip_version   (str): Keyword argument to optionally specify the IP version ("4" or "6")
+                              to resolve a nameserver name to. Defaults to IPv4 if the name has
+                              an A record and IPv6 otherwise.
 
     Returns:
         dict: Returns a dictionary object with test results.
 
     """
-    asn_mmdb_reader = geoip2.database.Reader("mmdb/GeoLite2-ASN.mmdb")
+    comment = None
     nameservers = kwargs.get("ns", None)
     nameservers = nameservers if nameservers is not None else _get_nameservers()
     if isinstance(nameservers, str):
@@ -168,57 +489,492 @@ def dns_traceroute(qname, **kwargs):
             f"Provided 'max_ttl' of '{max_ttl}' is not allowed. "
             f"Min: 0, Max: {constants.TRACE_MAX_TTL}."
         )
-    nameserver = _resolve(nameservers[0])
-    iface = _get_route_dev(nameserver)
-    # Craft the UDP DNS packet.
-    packet = UDP(sport=RandShort()) / DNS(qd=DNSQR(qname=qname))
+    proto = str(kwargs.get("proto", "UDP")).upper()
+    if proto not in ("UDP", "TCP"):
+        comment = (
+            f"Provided 'proto' of '{proto}' is not supported. Defaulting to UDP. ('UDP', 'TCP')."
+        )
+        proto = "UDP"
+    dport = kwargs.get("dport", 53)
+    if isinstance(dport, str) and not dport.isdigit():
+        raise TypeError(f"Provided 'dport' of '{dport}' must be an integer.")
+    dport = abs(int(dport))
+    if not 0 <= dport <= 65535:
+        raise ValueError(f"Provided 'dport' of '{dport}' is not allowed. Min: 0, Max: 65535.")
+    nameserver = _resolve(nameservers[0], version=_get_version(kwargs.get("ip_version", None)))
+    version = ipaddress.ip_address(nameserver).version
+    # Craft the UDP DNS packet. A DNS query can't be carried in a TCP SYN, so TCP traces
+    # use a bare SYN towards the nameserver's stream port.
+    payload = b""
+    if proto == "UDP":
+        payload = bytes(dnswire.build_query(qname, "A", random.randrange(1, 65536)))
+    template = ProbeTemplate(nameserver, proto, payload, dport=dport, df=True)
     result = {
         "qname": qname,
-        "proto": "UDP",
-        "dport": 53,
-        "payload_size": len(packet) - 8,
-        "packet_size": len(packet) + 20,
+        "proto": proto,
+        "dport": dport,
+        "ip_version": version,
+        "payload_size": len(payload),
+        "packet_size": len(payload) + IP_HEADER_SIZE[version] + PROTO_HEADER_SIZE[proto],
         "ns": nameservers[0],
         "trace": [],
+        "capture": None,
+        "comment": comment,
         "failed": True,
     }
-    # Tell Scapy to NOT ignore the inner packet source. This is to avoid issues with NAT.
-    conf.checkIPsrc = False
-    for ttl in range(constants.TRACE_MIN_TTL, max_ttl + 1):
-        hop_data = {
-            "asn": None,
-            "ttl": ttl,
-            "src": None,
-            "hostname": None,
-            "rtt_ms": None,
-            "no_response": True,
-        }
-        # Please note: Unlike our dns_lookup utility we will only trace to the first nameserver
-        # provided either by the client with the 'ns' option or from the on-disk resolv.conf.
-        # The reason for this is to keep the logic as simple as possible. I could not think
-        # of a straight forward way to determine if/when we should give up with a nameserver
-        # and continue to the next.
-        ans = sr(
-            IP(dst=nameserver, ttl=ttl, flags="DF", id=RandShort()) / packet,
-            iface=iface,
-            nofilter=0,
-            timeout=constants.PACKET_RECV_TIMEOUT,
-            retry=constants.PACKET_SEND_RETRY,
-            verbose=0,
-        )[0]
-        if ans and ans[0][1].src not in [hop["src"] for hop in result["trace"]]:
-            try:
-                hop_data["asn"] = asn_mmdb_reader.asn(ans[0][1].src).autonomous_system_number
-            except geoip2.errors.AddressNotFoundError:
-                pass
-            hop_data["src"] = ans[0][1].src
-            hop_data["hostname"] = _resolve(ans[0][1].src, reverse=True)
-            hop_data["rtt_ms"] = (ans[0][1].time - ans[0][0].sent_time) * 1000
-            hop_data["no_response"] = False
-            result["trace"].append(hop_data)
-            if ans[0][1].src == nameservers[0]:
-                result["failed"] = False
+    # Please note: Unlike our dns_lookup utility we will only trace to the first nameserver
+    # provided either by the client with the 'ns' option or from the on-disk resolv.conf.
+    # The reason for this is to keep the logic as simple as possible. I could not think
+    # of a straight forward way to determine if/when we should give up with a nameserver
+    # and continue to the next.
+    return _trace(template, max_ttl, result)
+
+
+def _parse_bulk_queries(queries):
+    """Normalize the provided dns_bulk queries into a list of (qname, rdtype) tuples."""
+    if not isinstance(queries, list):
+        raise TypeError(
+            f"Provided 'queries' must be a list of [qname, rdtype] pairs not a "
+            f"{type(queries).__name__}."
+        )
+    parsed = []
+    for query in queries:
+        if isinstance(query, str):
+            parsed.append((query, "A"))
+        elif isinstance(query, (list, tuple)) and 1 <= len(query) <= 2:
+            parsed.append((str(query[0]), str(query[1]).upper() if len(query) == 2 else "A"))
+        elif isinstance(query, dict) and "qname" in query:
+            parsed.append((str(query["qname"]), str(query.get("rdtype", "A")).upper()))
+        else:
+            raise TypeError(f"Provided query of '{query}' must be a [qname, rdtype] pair.")
+    return parsed
+
+
+def dns_bulk(queries, **kwargs):
+    """Function to perform a large number of DNS lookups against a single nameserver.
+
+    Every query is encoded once up front and pipelined over one UDP socket while keeping
+    at most `window` queries in flight. Responses are matched back to their query by the
+    transaction id and question, and decoded straight from the wire format.
+
+    Args:
+        queries        (list): A list of [qname, rdtype] pairs to query for. A plain qname
+                               string queries for an A record.
+        **ns           (str) : The nameserver to query. If not specified we will parse the
+                               on-disk /etc/resolv.conf file and use the first entry.
+        **port         (int) : Keyword argument to optionally specify the nameserver port.
+                               Defaults to 53.
+        **window       (int) : Keyword argument to optionally specify the maximum number of
+                               queries in flight. Defaults to 100. Max value of 1000.
+        **retry        (int) : Keyword argument to optionally specify how many times a query
+                               that timed out is resent. Defaults to 1.
+
+    Returns:
+        dict: Returns a dictionary object with test results. Each query result is a compact
+              [qname, rdtype, rcode, rtt_ms, answer] row, where answer is a list of
+              [type, ttl, rdata] rows.
+
+    """
+    nameservers = kwargs.get("ns", None)
+    nameservers = nameservers if nameservers is not None else _get_nameservers()
+    if isinstance(nameservers, str):
+        nameservers = nameservers.split()
+    window = kwargs.get("window", constants.DNS_BULK_WINDOW)
+    if isinstance(window, str) and not window.isdigit():
+        raise TypeError(f"Provided 'window' of '{window}' must be an integer.")
+    window = abs(int(window))
+    if not 1 <= window <= constants.DNS_BULK_MAX_WINDOW:
+        raise ValueError(
+            f"Provided 'window' of '{window}' is not allowed. "
+            f"Min: 1, Max: {constants.DNS_BULK_MAX_WINDOW}."
+        )
+    retry = kwargs.get("retry", constants.DNS_BULK_RETRY)
+    if isinstance(retry, str) and not retry.isdigit():
+        raise TypeError(f"Provided 'retry' of '{retry}' must be an integer.")
+    retry = min(abs(int(retry)), 3)
+    port = _get_int_option(kwargs, "port", 53, 1, 65535)
+    queries = _parse_bulk_queries(queries)
+    if not 1 <= len(queries) <= constants.DNS_BULK_MAX_QUERIES:
+        raise ValueError(
+            f"Provided number of queries of '{len(queries)}' is not allowed. "
+            f"Min: 1, Max: {constants.DNS_BULK_MAX_QUERIES}."
+        )
+    try:
+        wire_queries = [dnswire.build_query(qname, rdtype) for (qname, rdtype) in queries]
+    except dnswire.DNSWireError as error:
+        raise Exception(str(error))
+    nameserver = _resolve(nameservers[0])
+    result = {
+        "ns": nameserver,
+        "port": port,
+        "sent": 0,
+        "recv": 0,
+        "timeout_count": 0,
+        "window": window,
+        "elapsed_time": None,
+        "qps": None,
+        "fields": ["qname", "rdtype", "rcode", "rtt_ms", "answer"],
+        "results": [[qname, rdtype, None, None, []] for (qname, rdtype) in queries],
+        "failed": True,
+    }
+    family = socket.AF_INET6 if ipaddress.ip_address(nameserver).version == 6 else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    # A connected socket lets the kernel drop anything that isn't from our nameserver.
+    sock.connect((nameserver, port))
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    # Transaction id -> [query index, sent time, attempt].
+    inflight = {}
+    # Queries are always sent with the same timeout, only ever shortened to the test deadline,
+    # so deadlines are appended in order.
+    deadlines = collections.deque()
+    txid = random.randrange(65536)
+    buffer = bytearray(65535)
+    view = memoryview(buffer)
+    next_query = 0
+    start_time = time.time()
+    try:
+        while next_query < len(queries) or inflight:
+            # Stop at the deadline with the answers so far; queries in flight count as timed
+            # out and the ones that weren't sent yet keep no rcode.
+            if deadline.is_expired():
+                result["timeout_count"] += len(inflight)
                 break
+            # Top up the window with new queries.
+            while next_query < len(queries) and len(inflight) < window:
+                txid = (txid + 1) & 0xFFFF
+                while txid in inflight:
+                    txid = (txid + 1) & 0xFFFF
+                dnswire.set_txid(wire_queries[next_query], txid)
+                inflight[txid] = [next_query, time.time(), 0]
+                deadlines.append(
+                    (time.time() + deadline.clamp(constants.DNS_BULK_TIMEOUT), txid, next_query)
+                )
+                sock.send(wire_queries[next_query])
+                result["sent"] += 1
+                next_query += 1
+            # Expire and retry queries that timed out.
+            now = time.time()
+            while deadlines and deadlines[0][0] <= now:
+                (_, expired_txid, index) = deadlines.popleft()
+                query = inflight.get(expired_txid)
+                if query is None or query[0] != index:
+                    continue
+                del inflight[expired_txid]
+                if query[2] >= retry:
+                    result["timeout_count"] += 1
+                    continue
+                txid = (txid + 1) & 0xFFFF
+                while txid in inflight:
+                    txid = (txid + 1) & 0xFFFF
+                dnswire.set_txid(wire_queries[index], txid)
+                inflight[txid] = [index, now, query[2] + 1]
+                deadlines.append((now + deadline.clamp(constants.DNS_BULK_TIMEOUT), txid, index))
+                sock.send(wire_queries[index])
+                result["sent"] += 1
+            if not inflight:
+                continue
+            selector.select(timeout=max(deadlines[0][0] - time.time(), 0))
+            # Drain every response that is currently queued on the socket straight into
+            # our preallocated receive buffer.
+            while True:
+                try:
+                    size = sock.recv_into(buffer, 0, socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    break
+                received = time.time()
+                if size < 12:
+                    continue
+                data = view[:size]
+                # Keep `txid` for allocating the ids of the queries sent, sequentially.
+                response_txid = dnswire.get_txid(data)
+                query = inflight.get(response_txid)
+                if query is None:
+                    continue
+                wire_query = wire_queries[query[0]]
+                # Ensure the response is for the question we asked (case-insensitive).
+                if bytes(data[12 : len(wire_query)]).lower() != wire_query[12:].lower():
+                    continue
+                del inflight[response_txid]
+                try:
+                    response = dnswire.parse_response(data)
+                except dnswire.DNSWireError:
+                    continue
+                row = result["results"][query[0]]
+                row[2] = dnswire.RCODES.get(response["rcode"], response["rcode"])
+                row[3] = (received - query[1]) * 1000
+                row[4] = [
+                    [dnswire.get_rdtype_name(rdtype), ttl, rdata]
+                    for (_, rdtype, _, ttl, _, rdata) in response["answer"]
+                ]
+                result["recv"] += 1
+    except ConnectionRefusedError:
+        raise Exception(f"Nameserver '{nameserver}' is not accepting DNS queries.")
+    finally:
+        selector.close()
+        sock.close()
+    result["elapsed_time"] = time.time() - start_time
+    result["qps"] = result["recv"] / result["elapsed_time"] if result["elapsed_time"] else None
+    if result["recv"]:
+        result["failed"] = False
+    return result
+
+
+# Delegations (zone -> name servers and their addresses) learned by dns_delegation_trace, for
+# the TTL of their NS records. Pool processes only live for a payload, so the process running
+# the pools, like a uWSGI worker, keeps the cache: every trace starts from a snapshot of it and
+# the delegations that the trace learned are merged back, see `get_delegations`.
+_DELEGATION_CACHE = {}
+
+
+def get_delegations(qname):
+    """Get the unexpired cached delegations of the zones enclosing a domain name, to pass them
+    on to another process.
+
+    Returns:
+        dict: Returns a dictionary object of cache entries keyed by zone.
+
+    """
+    labels = qname.lower().rstrip(".").split(".")
+    zones = [".".join(labels[index:]) + "." for index in range(len(labels))]
+    now = time.time()
+    return {
+        zone: _DELEGATION_CACHE[zone]
+        for zone in zones
+        if zone in _DELEGATION_CACHE and _DELEGATION_CACHE[zone]["expires"] > now
+    }
+
+
+def merge_delegations(delegations):
+    """Merge delegations learned by another process into the cache, keeping whichever entry of a
+    zone expires last. Expired entries, and then the entries that expire first, are evicted once
+    there are more than DNS_DELEGATION_CACHE_MAX_ZONES zones."""
+    for (zone, entry) in delegations.items():
+        current = _DELEGATION_CACHE.get(zone)
+        if current is None or current["expires"] < entry["expires"]:
+            _DELEGATION_CACHE[zone] = entry
+    if len(_DELEGATION_CACHE) <= constants.DNS_DELEGATION_CACHE_MAX_ZONES:
+        return
+    now = time.time()
+    for zone in [zone for (zone, entry) in _DELEGATION_CACHE.items() if entry["expires"] <= now]:
+        del _DELEGATION_CACHE[zone]
+    excess = len(_DELEGATION_CACHE) - constants.DNS_DELEGATION_CACHE_MAX_ZONES
+    if excess > 0:
+        by_expiry = sorted(_DELEGATION_CACHE, key=lambda zone: _DELEGATION_CACHE[zone]["expires"])
+        for zone in by_expiry[:excess]:
+            del _DELEGATION_CACHE[zone]
+
+
+def _is_subdomain(name, zone):
+    """Check whether or not `name` is equal to or below `zone`."""
+    name = name.lower()
+    zone = zone.lower()
+    return zone == "." or name == zone or name.endswith(f".{zone}")
+
+
+def _get_cached_delegation(qname):
+    """Get the deepest cached delegation enclosing the provided qname."""
+    labels = qname.lower().rstrip(".").split(".")
+    for index in range(len(labels)):
+        zone = ".".join(labels[index:]) + "."
+        entry = _DELEGATION_CACHE.get(zone)
+        if entry is None:
+            continue
+        if entry["expires"] > time.time():
+            return zone, entry["servers"]
+        del _DELEGATION_CACHE[zone]
+    return None
+
+
+def _get_referral(response, zone, qname):
+    """Extract the child zone, name servers and glue from a referral response.
+
+    Returns:
+        tuple: Returns a tuple of the child zone, the sorted name server names, a dict of
+               name server addresses learned from glue and the delegation TTL. Returns None
+               if the response isn't a referral towards the qname.
+
+    """
+    ns_records = [
+        record
+        for record in response["authority"]
+        if record[1] == 2
+        and record[0].lower() != zone.lower()
+        and _is_subdomain(record[0], zone)
+        and _is_subdomain(qname, record[0])
+    ]
+    if not ns_records:
+        return None
+    child = ns_records[0][0].lower()
+    names = sorted({record[5].lower() for record in ns_records if record[0].lower() == child})
+    glue = {}
+    for (rrname, rdtype, _, _, _, rdata) in response["additional"]:
+        # Both A and AAAA glue.
+        if rdtype in (1, 28) and rrname.lower() in names:
+            glue.setdefault(rrname.lower(), []).append(rdata)
+    ttl = min(record[3] for record in ns_records)
+    return child, names, glue, ttl
+
+
+def _probe_delegation_level(query, zone, servers, qname):
+    """Query every name server of a zone at once and summarize their answers.
+
+    Returns:
+        tuple: Returns a tuple of the level data, the majority outcome and the raw response
+               of a server that gave the majority outcome.
+
+    """
+    responses = _query_nameservers(query, [address for (_, address) in servers])
+    level = {"zone": zone, "cached": False, "servers": [], "consistent": True, "rtt": None}
+    outcomes = []
+    referrals = {}
+    raw = {}
+    for ((name, address), response) in zip(servers, responses):
+        server = {
+            "name": name,
+            "ip": address,
+            "rtt_ms": response["rtt_ms"],
+            "rcode": None,
+            "aa": None,
+            "referral": None,
+            "answer": [],
+        }
+        level["servers"].append(server)
+        if response["response"] is None:
+            continue
+        try:
+            parsed = dnswire.parse_response(response["response"], full=True)
+        except dnswire.DNSWireError:
+            server["rcode"] = "malformed"
+            continue
+        server["rcode"] = dnswire.RCODES.get(parsed["rcode"], parsed["rcode"])
+        server["aa"] = parsed["aa"]
+        referral = _get_referral(parsed, zone, qname) if not parsed["answer"] else None
+        if parsed["answer"]:
+            server["answer"] = sorted(
+                f"{dnswire.get_rdtype_name(rdtype)} {rdata}"
+                for (_, rdtype, _, _, _, rdata) in parsed["answer"]
+            )
+            outcome = ("answer", tuple(server["answer"]))
+        elif referral is not None and parsed["rcode"] == 0:
+            server["referral"] = referral[0]
+            outcome = ("referral", referral[0], tuple(referral[1]))
+            merged = referrals.setdefault(outcome, {"glue": {}, "ttl": referral[3]})
+            for (ns_name, addresses) in referral[2].items():
+                merged["glue"].setdefault(ns_name, set()).update(addresses)
         else:
-            result["trace"].append(hop_data)
+            outcome = ("final", server["rcode"])
+        outcomes.append(outcome)
+        raw.setdefault(outcome, response["response"])
+    rtts = [server["rtt_ms"] for server in level["servers"] if server["rtt_ms"] is not None]
+    if rtts:
+        level["rtt"] = {"min": min(rtts), "max": max(rtts), "avg": sum(rtts) / len(rtts)}
+    if not outcomes:
+        return level, None, None, None
+    level["consistent"] = len(set(outcomes)) == 1
+    outcome = collections.Counter(outcomes).most_common(1)[0][0]
+    return level, outcome, raw[outcome], referrals.get(outcome)
+
+
+def _get_delegation_servers(names, glue):
+    """Build the (name, address) list of a delegation's name servers, IPv4 addresses first so
+    that they're kept if the list is cut short. Name servers without glue are resolved through
+    the system resolver, but only if there's no glue at all."""
+    servers = [
+        (name, address)
+        for version in (4, 6)
+        for name in names
+        for address in sorted(glue.get(name, ()))
+        if _is_ip_address(address) and ipaddress.ip_address(address).version == version
+    ]
+    if servers:
+        return servers[: constants.DNS_DELEGATION_MAX_NS]
+    for name in names[: constants.DNS_DELEGATION_MAX_GLUELESS]:
+        try:
+            address = _resolve(name.rstrip("."))
+        except Exception:  # pylint: disable=broad-except
+            continue
+        if _is_ip_address(address) and ipaddress.ip_address(address).version == 4:
+            servers.append((name, address))
+    return servers
+
+
+def dns_delegation_trace(qname, **kwargs):
+    """Function to trace the iterative resolution of a domain name from the root servers
+    down to its authoritative name servers.
+
+    Every name server of a zone is queried at once without recursion, so each level
+    reports the round-trip time of every server and whether or not they all agree.
+
+    Args:
+        qname          (str) : The domain name to trace the resolution of.
+        **rdtype       (str) : Keyword argument to optionally specify the DNS record type to
+                               query for. Defaults to A.
+        **use_cache    (bool): Keyword argument to optionally specify whether or not to start
+                               from the deepest delegation cached by a previous trace, see
+                               _DELEGATION_CACHE. Defaults to True.
+
+    Returns:
+        dict: Returns a dictionary object with test results.
+
+    """
+    rdtype = str(kwargs.get("rdtype", "A")).upper()
+    use_cache = kwargs.get("use_cache", True)
+    if isinstance(use_cache, str):
+        use_cache = use_cache.lower() not in ("false", "0", "no")
+    qname = qname if qname.endswith(".") else f"{qname}."
+    try:
+        query = dnswire.build_query(qname, _get_rdtype(rdtype), recursion=False)
+    except dnswire.DNSWireError as error:
+        raise Exception(str(error))
+    result = {
+        "qname": qname,
+        "qtype": rdtype,
+        "levels": [],
+        "rcode": None,
+        "answer": [],
+        "authoritative": [],
+        "elapsed_time": None,
+        "comment": None,
+        "failed": True,
+    }
+    zone = "."
+    servers = list(constants.DNS_ROOT_HINTS)
+    cached = _get_cached_delegation(qname) if use_cache else None
+    if cached is not None:
+        (zone, servers) = cached
+    start_time = time.time()
+    for _ in range(constants.DNS_DELEGATION_MAX_DEPTH):
+        # Stop at the deadline with the levels traced so far.
+        if deadline.is_expired():
+            result["comment"] = "Stopped at the test deadline."
+            break
+        (level, outcome, raw, referral) = _probe_delegation_level(query, zone, servers, qname)
+        # Flag the level whose name servers came from the cache; the levels above it were
+        # skipped entirely.
+        level["cached"] = cached is not None and zone == cached[0]
+        result["levels"].append(level)
+        if outcome is None:
+            result["comment"] = f"None of the name servers for '{zone}' responded."
+            break
+        if outcome[0] != "referral":
+            formatted = _format_response(raw)
+            result["rcode"] = formatted["rcode"]
+            result["answer"] = formatted["answer"]
+            result["authoritative"] = sorted({name for (name, _) in servers})
+            result["failed"] = False
+            break
+        child = outcome[1]
+        servers = _get_delegation_servers(list(outcome[2]), referral["glue"])
+        if not servers:
+            result["comment"] = f"Unable to find an address for any name server of '{child}'."
+            break
+        _DELEGATION_CACHE[child] = {
+            "expires": time.time() + min(referral["ttl"], constants.DNS_DELEGATION_CACHE_MAX_TTL),
+            "servers": servers,
+        }
+        zone = child
+    else:
+        result["comment"] = "Maximum delegation depth reached."
+    result["elapsed_time"] = time.time() - start_time
     return result
@@ -1,10 +1,17 @@
 # pylint: disable=locally-disabled, missing-docstring, c-extension-no-member
 
 from urllib.parse import urlparse
+import statistics
+import ipaddress
+import math
 import socket
 import re
+import time
+import hashlib
 import pycurl
+from lib.wrappers import _get_int_option
 import lib.constants as constants
+import lib.deadline as deadline
 
 
 class _ResponseHandler:
@@ -35,6 +42,77 @@ class _ResponseHandler:
                 self.data["reason"] = match.group(2)
 
 
+class _BodyCounter:
+    """Simple class to stream an HTTP response body through a byte counter without ever
+    holding it in memory.
+
+    The body can optionally be fed to a running digest. The number of bytes received is
+    sampled at a fixed interval to build a throughput curve, and the transfer is aborted
+    once `max_bytes` or `max_time` is reached.
+
+    Attributes:
+        bytes   (int) : The number of body bytes received.
+        capped  (str) : The name of the limit that aborted the transfer, if any.
+        samples (list): A list of [elapsed_ms, bytes] samples.
+
+    """
+
+    def __init__(self, digest=None, max_bytes=None, max_time=None, interval=None):
+        self.bytes = 0
+        self.capped = None
+        self.samples = []
+        self.digest = hashlib.new(digest) if digest is not None else None
+        self.max_bytes = max_bytes
+        self.max_time = max_time
+        self.interval = (interval or constants.CURL_STREAM_SAMPLE_INTERVAL) / 1000
+        self.start_time = None
+        self.next_sample = None
+
+    def write(self, chunk):
+        """Account for a chunk of the HTTP response body."""
+        now = time.time()
+        if self.start_time is None:
+            self.start_time = now
+            self.next_sample = now + self.interval
+        self.bytes += len(chunk)
+        if self.digest is not None:
+            self.digest.update(chunk)
+        if now >= self.next_sample:
+            self.samples.append([(now - self.start_time) * 1000, self.bytes])
+            self.next_sample = now + self.interval
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            self.capped = "max_bytes"
+        elif self.max_time is not None and now - self.start_time >= self.max_time:
+            self.capped = "max_time"
+        # Returning anything but None (or the chunk size) tells cURL to abort the transfer.
+        return 0 if self.capped else None
+
+    def summary(self):
+        """Summarize the streamed body and its throughput curve in bps."""
+        if self.start_time is not None:
+            self.samples.append([(time.time() - self.start_time) * 1000, self.bytes])
+        throughput = []
+        previous = [0, 0]
+        for sample in self.samples:
+            if sample[0] > previous[0]:
+                seconds = (sample[0] - previous[0]) / 1000
+                throughput.append((sample[1] - previous[1]) * 8 / seconds)
+            previous = sample
+        return {
+            "bytes": self.bytes,
+            "digest": self.digest.hexdigest() if self.digest is not None else None,
+            "capped": self.capped,
+            "samples": self.samples,
+            "throughput_bps": {
+                "min": min(throughput) if throughput else None,
+                "max": max(throughput) if throughput else None,
+                "avg": self.bytes * 8 / (self.samples[-1][0] / 1000)
+                if self.samples and self.samples[-1][0]
+                else None,
+            },
+        }
+
+
 def _parse_url(url):
     """Parse a given URL and split it into three required parts: scheme, domain and port."""
     data = {"scheme": None, "domain": None, "port": None}
@@ -54,7 +132,20 @@ def _parse_url(url):
     return data
 
 
-def _setup_curl(url, response_handler, **kwargs):
+def _get_http3_version():
+    """Get the cURL HTTP version used for HTTP/3 requests if libcurl was built with it.
+
+    HTTP/3 is requested without falling back to TCP, so the results always measure QUIC.
+
+    """
+    version = getattr(pycurl, "CURL_HTTP_VERSION_3ONLY", None)
+    version = version if version is not None else getattr(pycurl, "CURL_HTTP_VERSION_3", None)
+    if version is None or not pycurl.version_info()[4] & getattr(pycurl, "VERSION_HTTP3", 0):
+        raise Exception("HTTP/3 is not supported by the installed libcurl.")
+    return version
+
+
+def _setup_curl(url, response_handler, body_counter=None, **kwargs):
     """Setup the cURL request with all provided options."""
     version = str(kwargs.get("version", None))
     resolve = kwargs.get("resolve", None)
@@ -62,7 +153,7 @@ def _setup_curl(url, response_handler, **kwargs):
     method = kwargs.get("method", "HEAD").upper()
     ignore_ssl = kwargs.get("ignore_ssl", False)
     curl = pycurl.Curl()
-    if method == "GET":
+    if method == "GET" or body_counter is not None:
         curl.setopt(pycurl.HTTPGET, 1)
     else:
         curl.setopt(pycurl.NOBODY, 3)
@@ -70,44 +161,412 @@ def _setup_curl(url, response_handler, **kwargs):
         headers = [f"{key}: {value}" for (key, value) in headers.items()]
     curl.setopt(pycurl.HTTPHEADER, headers)
     curl.setopt(pycurl.FOLLOWLOCATION, 1)
-    # We're essentially sending the HTTP response body to /dev/null here.
-    curl.setopt(pycurl.WRITEFUNCTION, lambda x: None)
+    if body_counter is not None:
+        # Stream the body through the counter in large chunks to keep callbacks cheap.
+        curl.setopt(pycurl.WRITEFUNCTION, body_counter.write)
+        curl.setopt(pycurl.BUFFERSIZE, constants.CURL_STREAM_BUFFER_SIZE)
+        timeout = constants.CURL_TIMEOUT + int(body_counter.max_time)
+    else:
+        # We're essentially sending the HTTP response body to /dev/null here.
+        curl.setopt(pycurl.WRITEFUNCTION, lambda x: None)
+        timeout = constants.CURL_TIMEOUT
+    # Shorten the timeout to the deadline. A timeout of 0 would disable it altogether.
+    curl.setopt(pycurl.TIMEOUT_MS, max(int(deadline.clamp(timeout) * 1000), 1))
     curl.setopt(pycurl.HEADERFUNCTION, response_handler.store_header)
     curl.setopt(pycurl.SSL_VERIFYPEER, bool(ignore_ssl))
     curl.setopt(pycurl.SSL_VERIFYHOST, bool(ignore_ssl))
-    curl.setopt(pycurl.TIMEOUT, constants.CURL_TIMEOUT)
-    if version in ("2.0", "2"):
+    if version in ("3.0", "3"):
+        curl.setopt(pycurl.HTTP_VERSION, _get_http3_version())
+    elif version in ("2.0", "2"):
         curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2_0)
     elif version in ("1.0", "1"):
         curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_1_0)
     else:
         curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_1_1)
+    ip_version = str(kwargs.get("ip_version", None))
+    if ip_version in ("4", "6"):
+        curl.setopt(
+            pycurl.IPRESOLVE, pycurl.IPRESOLVE_V4 if ip_version == "4" else pycurl.IPRESOLVE_V6
+        )
     if resolve is not None:
         try:
-            socket.inet_aton(resolve)
+            address = ipaddress.ip_address(resolve)
             url_parts = _parse_url(url)
-            curl.setopt(pycurl.RESOLVE, [f"{url_parts['domain']}:{url_parts['port']}:{resolve}"])
-        except socket.error:
+            # cURL expects IPv6 addresses to be wrapped in brackets.
+            address = f"[{address}]" if address.version == 6 else str(address)
+            curl.setopt(pycurl.RESOLVE, [f"{url_parts['domain']}:{url_parts['port']}:{address}"])
+        except ValueError:
             pass
     curl.setopt(pycurl.URL, url)
     return curl
 
 
+def _setup_body_counter(**kwargs):
+    """Setup the body counter used by the streaming mode if it was requested."""
+    stream = kwargs.get("stream", False)
+    if isinstance(stream, str):
+        stream = stream.lower() in ("true", "1", "yes")
+    if not stream:
+        return None
+    digest = kwargs.get("digest", None)
+    if digest is not None:
+        digest = str(digest).lower()
+        if digest not in constants.CURL_STREAM_DIGESTS:
+            raise ValueError(
+                f"Provided 'digest' of '{digest}' is not supported. "
+                f"{constants.CURL_STREAM_DIGESTS}."
+            )
+    return _BodyCounter(
+        digest=digest,
+        max_bytes=_get_int_option(kwargs, "max_bytes", None, 1, 2 ** 40),
+        max_time=_get_int_option(
+            kwargs, "max_time", constants.CURL_TIMEOUT, 1, constants.CURL_STREAM_MAX_TIME
+        ),
+        interval=_get_int_option(
+            kwargs, "sample_interval", constants.CURL_STREAM_SAMPLE_INTERVAL, 10, 10000
+        ),
+    )
+
+
+def _new_result(url, method, comment, body_counter=None):
+    """Create the dict holding the results of a single http_request."""
+    result = {
+        "url": url,
+        "status": 0,
+        "reason": None,
+        "version": None,
+        "method": method,
+        "headers": {},
+        "time_namelookup": None,
+        "time_connect": None,
+        "time_appconnect": None,
+        "time_pretransfer": None,
+        "time_starttransfer": None,
+        "time_redirect": None,
+        "time_total": None,
+        "speed_download": None,
+        "primary_ip": None,
+        "comment": comment,
+        "failed": True,
+    }
+    if body_counter is not None:
+        result["body"] = None
+    return result
+
+
+def _store_error(result, error, body_counter=None):
+    """Store a cURL error in the result unless it was a streamed transfer that was aborted
+    on purpose."""
+    # Aborting a streamed transfer on purpose surfaces as a cURL write error.
+    capped = body_counter is not None and body_counter.capped is not None
+    if capped and error.args[0] == pycurl.E_WRITE_ERROR:
+        return
+    result["status"] = error.args[0]
+    result["reason"] = error.args[1]
+
+
+def _store_result(result, curl, response, body_counter=None):
+    """Store the response and timing information of a performed cURL in the result."""
+    result["status"] = curl.getinfo(pycurl.HTTP_CODE)
+    result["reason"] = response.data["reason"]
+    result["version"] = response.data["version"]
+    result["headers"] = response.data["headers"]
+    result["time_namelookup"] = format(curl.getinfo(pycurl.NAMELOOKUP_TIME), ".3f")
+    result["time_connect"] = format(curl.getinfo(pycurl.CONNECT_TIME), ".3f")
+    result["time_appconnect"] = format(curl.getinfo(pycurl.APPCONNECT_TIME), ".3f")
+    result["time_pretransfer"] = format(curl.getinfo(pycurl.PRETRANSFER_TIME), ".3f")
+    result["time_starttransfer"] = format(curl.getinfo(pycurl.STARTTRANSFER_TIME), ".3f")
+    result["time_redirect"] = format(curl.getinfo(pycurl.REDIRECT_TIME), ".3f")
+    result["time_total"] = format(curl.getinfo(pycurl.TOTAL_TIME), ".3f")
+    result["primary_ip"] = curl.getinfo(pycurl.PRIMARY_IP)
+    # Original value returned by cURL is Bps. I converted it to bps.
+    result["speed_download"] = curl.getinfo(pycurl.SPEED_DOWNLOAD) * 8
+    if body_counter is not None:
+        result["body"] = body_counter.summary()
+    result["failed"] = False
+
+
+def _get_timings(curl):
+    """Get the connection phase timings of the last transfer of a cURL handle as floats."""
+    return {
+        "time_namelookup": curl.getinfo(pycurl.NAMELOOKUP_TIME),
+        "time_connect": curl.getinfo(pycurl.CONNECT_TIME),
+        "time_appconnect": curl.getinfo(pycurl.APPCONNECT_TIME),
+        "time_pretransfer": curl.getinfo(pycurl.PRETRANSFER_TIME),
+        "time_starttransfer": curl.getinfo(pycurl.STARTTRANSFER_TIME),
+        "time_redirect": curl.getinfo(pycurl.REDIRECT_TIME),
+        "time_total": curl.getinfo(pycurl.TOTAL_TIME),
+        # The number of new connections cURL had to open for this transfer.
+        "num_connects": curl.getinfo(pycurl.NUM_CONNECTS),
+    }
+
+
+def _percentile(values, percent):
+    """Get the nearest-rank percentile of a sorted list of values."""
+    if not values:
+        return None
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def _repeat_requests(curl, response, result, repeat):
+    """Repeat an already performed request on the same cURL handle.
+
+    The handle keeps the connection and TLS session of the first (cold) request alive, so
+    the following (warm) requests measure latency without handshake noise.
+
+    Returns:
+        dict: Returns a dictionary object with the cold request timings and statistics of
+              the warm requests.
+
+    """
+    cold = _get_timings(curl)
+    warm = []
+    errors = []
+    for _ in range(repeat - 1):
+        response.data["headers"] = {}
+        try:
+            curl.perform()
+        except pycurl.error as error:
+            errors.append({"status": error.args[0], "reason": error.args[1]})
+            continue
+        warm.append(_get_timings(curl))
+    warm_stats = {
+        "count": len(warm),
+        "failed_count": len(errors),
+        "errors": errors,
+        "reused_connections": len([timings for timings in warm if timings["num_connects"] == 0]),
+    }
+    for key in (
+        "time_connect",
+        "time_appconnect",
+        "time_pretransfer",
+        "time_starttransfer",
+        "time_total",
+    ):
+        values = sorted(timings[key] for timings in warm)
+        warm_stats[key] = {
+            "min": values[0] if values else None,
+            "max": values[-1] if values else None,
+            "avg": sum(values) / len(values) if values else None,
+            "p50": _percentile(values, 50),
+            "p90": _percentile(values, 90),
+            "p99": _percentile(values, 99),
+        }
+    result["failed"] = result["failed"] or bool(errors and not warm)
+    return {"count": repeat, "cold": cold, "warm": warm_stats}
+
+
+def _perform_multi(curls):
+    """Perform several cURL handles concurrently in a single CurlMulti loop.
+
+    Returns:
+        dict: Returns a dictionary object mapping every failed handle to its pycurl.error.
+
+    """
+    multi = pycurl.CurlMulti()
+    for curl in curls:
+        multi.add_handle(curl)
+    errors = {}
+    remaining = len(curls)
+    while remaining:
+        while multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+            pass
+        while True:
+            (queued, succeeded, failed) = multi.info_read()
+            for (curl, errno, errmsg) in failed:
+                errors[curl] = pycurl.error(errno, errmsg)
+            remaining -= len(succeeded) + len(failed)
+            if not queued:
+                break
+        if remaining:
+            multi.select(1.0)
+    for curl in curls:
+        multi.remove_handle(curl)
+    multi.close()
+    return errors
+
+
+def _get_fanout_addresses(url, resolve):
+    """Get the list of IP addresses to send the same request to. A value of "all" resolves
+    every A and AAAA record of the URL's domain."""
+    if isinstance(resolve, list):
+        addresses = []
+        for address in resolve:
+            try:
+                addresses.append(str(ipaddress.ip_address(str(address).strip("[]"))))
+            except ValueError:
+                raise ValueError(f"Provided 'resolve' address of '{address}' is not an IP address.")
+    else:
+        url_parts = _parse_url(url)
+        try:
+            records = socket.getaddrinfo(
+                url_parts["domain"], url_parts["port"], proto=socket.IPPROTO_TCP
+            )
+        except socket.gaierror as error:
+            raise Exception(f"Unable to resolve host '{url_parts['domain']}': {error}")
+        addresses = [record[4][0] for record in records]
+    # Remove duplicates while keeping the original order.
+    addresses = list(dict.fromkeys(addresses))
+    if not 1 <= len(addresses) <= constants.CURL_MAX_RESOLVE:
+        raise ValueError(
+            f"Provided number of 'resolve' addresses of '{len(addresses)}' is not allowed. "
+            f"Min: 1, Max: {constants.CURL_MAX_RESOLVE}."
+        )
+    return addresses
+
+
+def _summarize_timings(results):
+    """Summarize the timings of every successful request with their min, max and median."""
+    summary = {}
+    succeeded = [result for result in results if not result["failed"]]
+    for key in (
+        "time_namelookup",
+        "time_connect",
+        "time_appconnect",
+        "time_starttransfer",
+        "time_total",
+    ):
+        values = [float(result[key]) for result in succeeded]
+        summary[key] = {
+            "min": min(values) if values else None,
+            "max": max(values) if values else None,
+            "median": statistics.median(values) if values else None,
+        }
+    return summary
+
+
+def _http_request_fanout(url, method, comment, **kwargs):
+    """Send the same request to every provided IP address at once in one CurlMulti loop.
+
+    Returns:
+        dict: Returns a dictionary object with a result per IP address and a summary of the
+              timings of the successful requests.
+
+    """
+    addresses = _get_fanout_addresses(url, kwargs.get("resolve"))
+    requests = []
+    for address in addresses:
+        body_counter = _setup_body_counter(**kwargs)
+        response = _ResponseHandler()
+        options = dict(kwargs, resolve=address)
+        result = _new_result(url, method, comment, body_counter)
+        result["resolve"] = address
+        curl = _setup_curl(url, response, body_counter, **options)
+        requests.append((curl, response, body_counter, result))
+    errors = _perform_multi([request[0] for request in requests])
+    results = []
+    for (curl, response, body_counter, result) in requests:
+        if curl in errors:
+            _store_error(result, errors[curl], body_counter)
+        if result["status"] == 0:
+            _store_result(result, curl, response, body_counter)
+        curl.close()
+        results.append(result)
+    failed_count = len([result for result in results if result["failed"]])
+    return {
+        "url": url,
+        "method": method,
+        "resolve": addresses,
+        "results": results,
+        "summary": _summarize_timings(results),
+        "failed_count": failed_count,
+        "comment": comment,
+        "failed": failed_count == len(results),
+    }
+
+
+def _http_request_happy_eyeballs(url, method, comment, **kwargs):
+    """Race the same request over IPv4 and IPv6 in one CurlMulti loop.
+
+    A third request is left to cURL's own happy eyeballs algorithm to show which address
+    family a regular dual-stack client ends up with.
+
+    Returns:
+        dict: Returns a dictionary object with a result per address family, the family that
+              connected first and by how many milliseconds.
+
+    """
+    requests = {}
+    for (family, ip_version) in (("ipv4", "4"), ("ipv6", "6"), ("auto", None)):
+        body_counter = _setup_body_counter(**kwargs)
+        response = _ResponseHandler()
+        options = dict(kwargs, ip_version=ip_version)
+        curl = _setup_curl(url, response, body_counter, **options)
+        result = _new_result(url, method, comment, body_counter)
+        requests[family] = (curl, response, body_counter, result)
+    errors = _perform_multi([request[0] for request in requests.values()])
+    results = {}
+    connected = []
+    for (family, (curl, response, body_counter, result)) in requests.items():
+        if curl in errors:
+            _store_error(result, errors[curl], body_counter)
+        if result["status"] == 0:
+            _store_result(result, curl, response, body_counter)
+            if family != "auto":
+                connected.append((curl.getinfo(pycurl.CONNECT_TIME), family))
+        curl.close()
+        results[family] = result
+    data = {
+        "url": url,
+        "method": method,
+        "results": results,
+        "winner": None,
+        "margin_ms": None,
+        "auto_family": None,
+        "comment": comment,
+        "failed": results["ipv4"]["failed"] and results["ipv6"]["failed"],
+    }
+    if not results["auto"]["failed"] and results["auto"]["primary_ip"]:
+        version = ipaddress.ip_address(results["auto"]["primary_ip"]).version
+        data["auto_family"] = f"ipv{version}"
+    connected.sort()
+    if connected:
+        data["winner"] = connected[0][1]
+        if len(connected) == 2:
+            data["margin_ms"] = (connected[1][0] - connected[0][0]) * 1000
+    return data
+
+
 def http_request(url, **kwargs):
     """Function to perform HTTP requests via PyCurl and return the results.
 
     Args:
         url          (str) : The URL to cURL.
         **version    (str) : Keyword argument to optionally specify the HTTP version to use when
-                             performing an HTTP request. Defaults to 1.1 if not specified.
+                             performing an HTTP request. "3" requests HTTP/3 over QUIC when
+                             libcurl supports it. Defaults to 1.1 if not specified.
         **resolve    (str) : Keyword argument to optionally specify the resolved IP
-                             address for the provided domain in the `url` arg.
+                             address for the provided domain in the `url` arg. A list of IP
+                             addresses, or "all" for every A/AAAA record of the domain, sends
+                             the same request to each of them concurrently.
         **headers    (list): Keyword argument to optionally specify a list of HTTP header to
                              inject into the request body.
         **method     (str) : Keyword argument to optionally specify the HTTP method. Defaults to
                              GET.
         **ignore_ssl (bool): Keyword argument to optionally specify whether or not to disable SSL
                              checks. Defaults to False.
+        **stream     (bool): Keyword argument to optionally specify whether or not to GET and
+                             stream the response body through a byte counter, sampling the
+                             throughput as it goes. The body is never held in memory.
+                             Defaults to False.
+        **digest     (str) : Keyword argument to optionally specify a digest algorithm to hash
+                             the streamed body with. One of md5, sha1, sha256 or sha512.
+        **max_bytes  (int) : Keyword argument to optionally specify the number of body bytes
+                             after which the streamed transfer is stopped.
+        **max_time   (int) : Keyword argument to optionally specify the number of seconds
+                             after which the streamed transfer is stopped. Defaults to 10.
+                             Max value of 60.
+        **sample_interval (int): Keyword argument to optionally specify the throughput sampling
+                                 interval in milliseconds. Defaults to 100.
+        **ip_version (str) : Keyword argument to optionally pin the address family to "4" or "6".
+                             Defaults to cURL's own choice.
+        **happy_eyeballs (bool): Keyword argument to optionally specify whether or not to race
+                                 the request over IPv4 and IPv6 and report which family
+                                 connected first and by how much. Defaults to False.
+        **repeat     (int) : Keyword argument to optionally specify the number of times the
+                             request is sent on the same connection. The first (cold) request
+                             is reported separately from the statistics of the following
+                             (warm) ones. Defaults to 1. Max value of 100.
 
     Returns:
         dict: Returns a dictionary object with test results.
@@ -118,40 +577,36 @@ def http_request(url, **kwargs):
     if method not in ("GET", "HEAD"):
         comment = f"Provided HTTP method of '{method}' is not supported. Using HEAD."
         method = "HEAD"
-    result = {
-        "url": url,
-        "status": 0,
-        "reason": None,
-        "version": None,
-        "method": method,
-        "headers": {},
-        "time_namelookup": None,
-        "time_connect": None,
-        "time_appconnect": None,
-        "time_starttransfer": None,
-        "time_total": None,
-        "speed_download": None,
-        "comment": comment,
-        "failed": True,
-    }
+    body_counter = _setup_body_counter(**kwargs)
+    if body_counter is not None:
+        method = "GET"
+    repeat = _get_int_option(kwargs, "repeat", 1, 1, constants.CURL_MAX_REPEAT)
+    fanout = isinstance(kwargs.get("resolve"), list) or str(kwargs.get("resolve")).lower() == "all"
+    if repeat > 1 and (fanout or body_counter is not None):
+        raise ValueError(
+            "Provided 'repeat' can't be combined with 'stream' or multiple 'resolve' addresses."
+        )
+    happy_eyeballs = kwargs.get("happy_eyeballs", False)
+    if isinstance(happy_eyeballs, str):
+        happy_eyeballs = happy_eyeballs.lower() in ("true", "1", "yes")
+    if happy_eyeballs and (fanout or repeat > 1 or kwargs.get("resolve") is not None):
+        raise ValueError(
+            "Provided 'happy_eyeballs' can't be combined with 'repeat' or 'resolve'."
+        )
+    if fanout:
+        return _http_request_fanout(url, method, comment, **kwargs)
+    if happy_eyeballs:
+        return _http_request_happy_eyeballs(url, method, comment, **kwargs)
+    result = _new_result(url, method, comment, body_counter)
     response = _ResponseHandler()
-    curl = _setup_curl(url, response, **kwargs)
+    curl = _setup_curl(url, response, body_counter, **kwargs)
     try:
         curl.perform()
-        result["status"] = curl.getinfo(pycurl.HTTP_CODE)
-        result["reason"] = response.data["reason"]
-        result["version"] = response.data["version"]
-        result["headers"] = response.data["headers"]
-        result["time_namelookup"] = format(curl.getinfo(pycurl.NAMELOOKUP_TIME), ".3f")
-        result["time_connect"] = format(curl.getinfo(pycurl.CONNECT_TIME), ".3f")
-        result["time_appconnect"] = format(curl.getinfo(pycurl.APPCONNECT_TIME), ".3f")
-        result["time_starttransfer"] = format(curl.getinfo(pycurl.STARTTRANSFER_TIME), ".3f")
-        result["time_total"] = format(curl.getinfo(pycurl.TOTAL_TIME), ".3f")
-        # Original value returned by cURL is Bps. I converted it to bps.
-        result["speed_download"] = curl.getinfo(pycurl.SPEED_DOWNLOAD) * 8
-        result["failed"] = False
     except pycurl.error as error:
-        result["status"] = error.args[0]
-        result["reason"] = error.args[1]
+        _store_error(result, error, body_counter)
+    if result["status"] == 0:
+        _store_result(result, curl, response, body_counter)
+        if repeat > 1:
+            result["repeat"] = _repeat_requests(curl, response, result, repeat)
     curl.close()
     return result
@@ -2,14 +2,31 @@
 
 import os
 import time
+import errno
+import random
+import socket
+import struct
+import selectors
+import ipaddress
 import geoip2
 import geoip2.database
-from scapy.layers.inet import IP, ICMP, TCP, conf
-from scapy.volatile import RandShort, RandString
-from scapy.packet import Raw
-from scapy.sendrecv import sr
-from lib.wrappers import _resolve, _get_route_dev
+from lib.engine import ProbeSession, ProbeSet, ProbeTemplate, send_probes
+from lib.wrappers import _resolve, _get_route_dev, _get_version, _get_dev_mtu, _get_int_option
 import lib.constants as constants
+import lib.deadline as deadline
+import lib.engine.timestamps as timestamps
+
+# The size of the IP header, keyed by IP version.
+IP_HEADER_SIZE = {4: 20, 6: 40}
+# The size of the transport header, keyed by protocol.
+PROTO_HEADER_SIZE = {"ICMP": 8, "TCP": 20, "UDP": 8}
+# The ICMP type and code of a port unreachable, keyed by IP version.
+PORT_UNREACHABLE = {4: (3, 3), 6: (1, 4)}
+
+
+def _get_max_payload_size(version):
+    """Get the largest ICMP payload that fits a 1500 byte MTU for the IP version."""
+    return 1500 - IP_HEADER_SIZE[version] - 8
 
 
 def ping(dst, **kwargs):
@@ -21,7 +38,10 @@ def ping(dst, **kwargs):
         **count        (int): Keyword argument to optionally specify the number of ping packets
                               to send in a single test. Defaults to 10. Max value of 20.
         **payload_size (int): Keyword argument to optionally specify the ICMP packet's payload size.
-                              Defaults to 56. Max value of 1472.
+                              Defaults to 56. Max value of 1472, or 1452 over IPv6.
+        **ip_version   (str): Keyword argument to optionally specify the IP version ("4" or "6")
+                              to resolve `dst` to. Defaults to IPv4 if the name has an A record
+                              and IPv6 otherwise.
 
     Returns:
         dict: Returns a dictionary object with test results.
@@ -40,57 +60,51 @@ def ping(dst, **kwargs):
     if isinstance(payload_size, str) and not payload_size.isdigit():
         raise TypeError(f"Provided 'payload_size' of '{payload_size}' must be an integer.")
     payload_size = abs(int(payload_size))
-    if not 0 <= payload_size <= 1472:
+    address = _resolve(dst, version=_get_version(kwargs.get("ip_version", None)))
+    version = ipaddress.ip_address(address).version
+    max_payload_size = _get_max_payload_size(version)
+    if not 0 <= payload_size <= max_payload_size:
         raise ValueError(
-            f"Provided 'packet_size' of '{payload_size}' is not allowed. Min: 0, Max: 1472."
+            f"Provided 'packet_size' of '{payload_size}' is not allowed. "
+            f"Min: 0, Max: {max_payload_size}."
         )
     result = {
         "dst": dst,
+        "ip_version": version,
         "sent": count,
         "recv": None,
         "payload_size": payload_size,
-        "packet_size": payload_size + 28,
+        "packet_size": payload_size + IP_HEADER_SIZE[version] + 8,
         "loss": None,
         "rtt": {"min": None, "max": None, "avg": None},
         "replies": [],
+        "capture": None,
         "comment": comment,
         "failed": True,
     }
-    dst = _resolve(dst)
-    # Get the correct egress interface name for the provided destination. This is to solve
-    # issues with testing via a VPN.
-    iface = _get_route_dev(dst)
-    # Tell Scapy to NOT ignore the inner packet source. This is to avoid issues with NAT.
-    conf.checkIPsrc = False
-    # After much testing within our network I found that if we don't limit the number of
-    # packets that Scapy receives in a single sniff it will essentially clog up and never
-    # return from its receive loop. Adding a custom BPF filter stops this from occurring.
-    packet_filter = f"(src host {dst} or dst host {dst}) and icmp"
-    for seq in range(0, count):
-        packet = ICMP(id=os.getpid(), seq=seq) / Raw(RandString(size=payload_size))
-        ans = sr(
-            IP(dst=dst, id=os.getpid()) / packet,
-            iface=iface,
-            filter=packet_filter,
-            timeout=constants.PACKET_RECV_TIMEOUT,
-            retry=constants.PACKET_SEND_RETRY,
-            verbose=0,
-        )[0]
-        # Check if we got an echo-reply.
-        if ans and ans[0][1][1].code == 0:
-            rtt_ms = (ans[0][1].time - ans[0][0].sent_time) * 1000.0
-            rtt.append(rtt_ms)
-            result["replies"].append(
-                {
-                    "seq": ans[0][1].seq,
-                    "ttl": ans[0][1].ttl,
-                    "len": ans[0][1].len - 20,  # Bytes received minus the IP header.
-                    "rtt_ms": rtt_ms,
-                }
-            )
-        time.sleep(constants.PACKET_SEND_DELAY)
+    dst = address
+    # The echo request is built once and only its sequence number is patched in per packet.
+    template = ProbeTemplate(dst, "ICMP", os.urandom(payload_size), ident=os.getpid() & 0xFFFF)
+    with ProbeSession(template, 1) as session:
+        for seq in range(0, count):
+            # Stop at the deadline with the replies so far rather than send the whole count.
+            if deadline.is_expired():
+                result["sent"] = seq
+                break
+            timeout = deadline.clamp(constants.PACKET_RECV_TIMEOUT)
+            replies = session.run([(seq, constants.PACKET_TTL)], timeout)
+            # Check if we got an echo-reply.
+            if seq in replies and not replies[seq][0].error:
+                (reply, rtt_ms) = replies[seq]
+                rtt.append(rtt_ms)
+                result["replies"].append(
+                    {"seq": seq, "ttl": reply.ttl, "len": reply.size, "rtt_ms": rtt_ms}
+                )
+            time.sleep(deadline.clamp(constants.PACKET_SEND_DELAY))
+        result["capture"] = session.get_capture()
     # Calculate packet loss.
-    result["loss"] = abs((100 * (len(rtt) - count) / count))
+    if result["sent"]:
+        result["loss"] = abs((100 * (len(rtt) - result["sent"]) / result["sent"]))
     # Set RTT timings if packets were received.
     if rtt:
         result["rtt"]["min"] = format(min(rtt), ".3f")
@@ -111,16 +125,18 @@ def traceroute(dst, **kwargs):
         **dport        (int) : Keyword argument to optionally specify the destination port.
                                Defaults to 80 if `proto` is TCP, and None if ICMP.
         **payload_size (int) : Keyword argument to optionally specify the ICMP/TCP packet's payload
-                               size. Defaults to 56. Max value of 1472.
+                               size. Defaults to 56. Max value of 1472, or 1452 over IPv6.
         **max_ttl      (int) : Keyword argument to optionally specify the max time-to-live
                                (max number of hops). Defaults to 32. Max value of 32.
+        **ip_version   (str) : Keyword argument to optionally specify the IP version ("4" or "6")
+                               to resolve `dst` to. Defaults to IPv4 if the name has an A
+                               record and IPv6 otherwise.
 
     Returns:
         dict: Returns a dictionary object with test results.
 
     """
     comment = None
-    asn_mmdb_reader = geoip2.database.Reader("mmdb/GeoLite2-ASN.mmdb")
     proto = kwargs.get("proto", "ICMP").upper()
     if proto not in ("ICMP", "TCP"):
         comment = (
@@ -137,12 +153,16 @@ def traceroute(dst, **kwargs):
     if isinstance(payload_size, str) and not payload_size.isdigit():
         raise TypeError(f"Provided 'payload_size' of '{payload_size}' must be an integer.")
     payload_size = abs(int(payload_size))
+    address = _resolve(dst, version=_get_version(kwargs.get("ip_version", None)))
+    version = ipaddress.ip_address(address).version
     # ICMP has a maximum payload size of 1472 bytes which is significantly less than TCP's
     # supported maximum of 65535 bytes, but since we need to support both and I do not want
-    # to exceed any MTUs; I'll leave 1472 as max.
-    if not 0 <= payload_size <= 1472:
+    # to exceed any MTUs; I'll leave 1472 as max. IPv6's larger header leaves 1452.
+    max_payload_size = _get_max_payload_size(version)
+    if not 0 <= payload_size <= max_payload_size:
         raise ValueError(
-            f"Provided 'packet_size' of '{payload_size}' is not allowed. Min: 0, Max: 1472."
+            f"Provided 'packet_size' of '{payload_size}' is not allowed. "
+            f"Min: 0, Max: {max_payload_size}."
         )
     max_ttl = kwargs.get("max_ttl", constants.TRACE_MAX_TTL)
     if isinstance(max_ttl, str) and not max_ttl.isdigit():
@@ -155,53 +175,533 @@ def traceroute(dst, **kwargs):
         )
     result = {
         "dst": dst,
+        "ip_version": version,
         "proto": proto,
         "dport": dport,
         "payload_size": payload_size,
-        "packet_size": payload_size + {"ICMP": 28, "TCP": 40}[proto],
+        "packet_size": payload_size + IP_HEADER_SIZE[version] + {"ICMP": 8, "TCP": 20}[proto],
         "trace": [],
+        "capture": None,
         "comment": comment,
         "failed": True,
     }
-    dst = _resolve(dst)
-    # Get the correct egress interface name for the provided destination. This is to solve
-    # issues with testing via a VPN.
-    iface = _get_route_dev(dst)
-    packet = (TCP(dport=dport, flags="S") if proto == "TCP" else ICMP()) / Raw(
-        RandString(size=payload_size)
+    dst = address
+    payload = os.urandom(payload_size)
+    if proto == "TCP":
+        template = ProbeTemplate(dst, "TCP", payload, dport=dport, df=True)
+    else:
+        template = ProbeTemplate(dst, "ICMP", payload, df=True)
+    return _trace(template, max_ttl, result)
+
+
+def _trace(template, max_ttl, result):
+    """Probe every hop towards the template's destination and fill in the trace of `result`.
+
+    All the probes are sent in a single batch, one per TTL, instead of one round trip at a
+    time. Waiting for replies stops as soon as the destination and every hop before it have
+    answered.
+
+    Args:
+        template (ProbeTemplate): The template of the probes.
+        max_ttl  (int)          : The max time-to-live to probe.
+        result   (dict)         : The test results to add the trace to.
+
+    Returns:
+        dict: Returns the dictionary object with test results.
+
+    """
+    dst = template.dst
+    ttls = range(constants.TRACE_MIN_TTL, max_ttl + 1)
+
+    def done(replies):
+        reached = [ttl for (ttl, (reply, _)) in replies.items() if reply.src == dst]
+        return bool(reached) and all(ttl in replies for ttl in range(ttls.start, min(reached)))
+
+    # The reader is closed with the trace rather than left to leak its file and mapping.
+    with geoip2.database.Reader(constants.ASN_MMDB_PATH) as asn_mmdb_reader:
+        probes = [(ttl, ttl) for ttl in ttls]
+        replies, result["capture"] = send_probes(
+            template, probes, deadline.clamp(constants.TRACE_TIMEOUT), done
+        )
+        for ttl in ttls:
+            hop_data = {
+                "asn": None,
+                "ttl": ttl,
+                "src": None,
+                "hostname": None,
+                "rtt_ms": None,
+                "no_response": True,
+            }
+            src = replies[ttl][0].src if ttl in replies else None
+            if src is not None and src not in [hop["src"] for hop in result["trace"]]:
+                try:
+                    hop_data["asn"] = asn_mmdb_reader.asn(src).autonomous_system_number
+                except geoip2.errors.AddressNotFoundError:
+                    pass
+                hop_data["src"] = src
+                hop_data["hostname"] = _resolve(src, reverse=True)
+                hop_data["rtt_ms"] = replies[ttl][1]
+                hop_data["no_response"] = False
+                result["trace"].append(hop_data)
+                if src == dst:
+                    result["failed"] = False
+                    break
+            else:
+                result["trace"].append(hop_data)
+    return result
+
+
+def _classify_pmtu_reply(reply):
+    """Classify the reply to a PMTU probe.
+
+    Returns:
+        tuple: Returns a tuple of the status and the next-hop MTU reported by an ICMP
+               fragmentation needed or ICMPv6 packet too big message. The status is "ok" if
+               the probe reached the destination, "too_big" if a hop refused to forward it
+               and "error" for any other ICMP error.
+
+    """
+    # An echo reply, or any TCP answer to our SYN, be it a SYN-ACK or a RST.
+    if not reply.error:
+        return "ok", None
+    if reply.mtu is not None:
+        return "too_big", reply.mtu
+    # A port unreachable can only come from the destination itself.
+    version = 6 if len(reply.src_packed) == 16 else 4
+    port_unreachable = (reply.icmp_type, reply.icmp_code) == PORT_UNREACHABLE[version]
+    return ("ok" if port_unreachable else "error"), None
+
+
+def pmtu(dst, **kwargs):
+    """Function to discover the path MTU towards a destination.
+
+    The MTU is searched for in rounds. Each round sends `probes` DF packets of evenly spread
+    sizes between the largest size known to get through and the smallest size known not to,
+    all at once over a single socket, so every round costs a single RTT. ICMP fragmentation
+    needed (or ICMPv6 packet too big) messages narrow the search down to the MTU reported by
+    the limiting hop, while probes that are silently dropped point to a PMTU black hole.
+
+    Args:
+        dst          (str): The destination address. Can be either a FQDN or an IP address.
+        **proto      (str): Keyword argument to optionally specify the probe protocol, one of
+                            ICMP, TCP (SYN) or UDP. Defaults to ICMP. UDP relies on the ICMP
+                            port unreachable messages of the destination, which most hosts
+                            rate limit, so lost replies may be mistaken for a black hole.
+        **dport      (int): Keyword argument to optionally specify the destination port of TCP
+                            and UDP probes. Defaults to 80 for TCP and 33434 for UDP.
+        **min_mtu    (int): Keyword argument to optionally specify the smallest MTU to search
+                            from. Defaults to 68, or 1280 over IPv6.
+        **max_mtu    (int): Keyword argument to optionally specify the largest MTU to search
+                            up to. Defaults to 1500. Max value of 9216. The MTU of the egress
+                            interface is never exceeded.
+        **probes     (int): Keyword argument to optionally specify the number of probe sizes
+                            sent per round. Defaults to 8. Max value of 32.
+        **ip_version (str): Keyword argument to optionally specify the IP version ("4" or "6")
+                            to resolve `dst` to. Defaults to IPv4 if the name has an A record
+                            and IPv6 otherwise.
+
+    Returns:
+        dict: Returns a dictionary object with test results.
+
+    """
+    comment = None
+    proto = str(kwargs.get("proto", "ICMP")).upper()
+    if proto not in PROTO_HEADER_SIZE:
+        comment = (
+            f"Provided 'proto' of '{proto}' is not supported. Defaulting to ICMP. "
+            "('ICMP', 'TCP', 'UDP')."
+        )
+        proto = "ICMP"
+    dport = _get_int_option(kwargs, "dport", 80 if proto == "TCP" else 33434, 0, 65535)
+    address = _resolve(dst, version=_get_version(kwargs.get("ip_version", None)))
+    version = ipaddress.ip_address(address).version
+    header_size = IP_HEADER_SIZE[version] + PROTO_HEADER_SIZE[proto]
+    min_mtu = max(
+        _get_int_option(
+            kwargs,
+            "min_mtu",
+            constants.PMTU_MIN_MTU[version],
+            constants.PMTU_MIN_MTU[version],
+            constants.PMTU_MAX_MTU_LIMIT,
+        ),
+        header_size,
     )
-    # Tell Scapy to NOT ignore the inner packet source. This is to avoid issues with NAT.
-    conf.checkIPsrc = False
-    for ttl in range(constants.TRACE_MIN_TTL, max_ttl + 1):
-        hop_data = {
-            "asn": None,
-            "ttl": ttl,
-            "src": None,
-            "hostname": None,
-            "rtt_ms": None,
-            "no_response": True,
+    max_mtu = _get_int_option(
+        kwargs, "max_mtu", constants.PMTU_MAX_MTU, min_mtu, constants.PMTU_MAX_MTU_LIMIT
+    )
+    probes = _get_int_option(kwargs, "probes", constants.PMTU_PROBES, 1, constants.PMTU_MAX_PROBES)
+    iface = _get_route_dev(address)
+    local_mtu = _get_dev_mtu(iface)
+    result = {
+        "dst": dst,
+        "ip_version": version,
+        "proto": proto,
+        "dport": dport if proto != "ICMP" else None,
+        "local_mtu": local_mtu,
+        "path_mtu": None,
+        "limiting_hop": None,
+        "black_hole": False,
+        "converged": False,
+        "rounds": 0,
+        "probes": [],
+        "capture": None,
+        "comment": comment,
+        "failed": True,
+    }
+    # Never probe beyond the egress interface, the kernel would refuse to send it anyway.
+    high = min(max_mtu, local_mtu) if local_mtu else max_mtu
+    if local_mtu is not None and local_mtu < max_mtu:
+        result["limiting_hop"] = {"src": None, "hostname": None, "mtu": local_mtu}
+    dst = address
+    low = min_mtu
+    sport = random.randint(1024, 65535 - constants.PMTU_MAX_ROUNDS * (probes + 1))
+    # Every round goes over the same socket, and the kernel sends every size as is.
+    with ProbeSet(version, proto, df=True) as probe_set:
+        _search_pmtu(probe_set, dst, result, low, high, probes, sport)
+        result["capture"] = probe_set.get_capture()
+    if result["limiting_hop"] is not None and result["limiting_hop"]["src"] is not None:
+        result["limiting_hop"]["hostname"] = _resolve(result["limiting_hop"]["src"], reverse=True)
+    return result
+
+
+def _search_pmtu(probe_set, dst, result, low, high, probes, sport):
+    """Run the rounds of the path MTU search over `probe_set` and store their outcome into
+    `result`.
+
+    Every probe size gets its own template, while every probe of the test carries its own
+    sequence number, so that replies and ICMP errors can be matched back to their size. The
+    search stops at the test deadline with the bounds found so far, unconverged.
+
+    """
+    proto, dport = result["proto"], result["dport"]
+    header_size = IP_HEADER_SIZE[ipaddress.ip_address(dst).version] + PROTO_HEADER_SIZE[proto]
+    seq = 0
+    while result["rounds"] == 0 or (result["rounds"] < constants.PMTU_MAX_ROUNDS and low < high):
+        if result["rounds"] and deadline.is_expired():
+            break
+        sizes = {low + -(-(high - low) * index // probes) for index in range(1, probes + 1)}
+        # The first round also checks that the smallest size gets through at all.
+        if result["rounds"] == 0:
+            sizes.add(low)
+        round_probes = {}
+        for size in sorted(sizes):
+            payload = bytes(size - header_size)
+            template = ProbeTemplate(
+                dst, proto, payload, sport=sport, dport=dport, ident=sport, df=True
+            )
+            round_probes[(template, seq)] = size
+            seq += 1
+        replies = probe_set.run(
+            [(template, probe_seq, constants.PACKET_TTL) for (template, probe_seq) in round_probes],
+            deadline.clamp(constants.PACKET_RECV_TIMEOUT),
+        )
+        result["rounds"] += 1
+        probes_data = []
+        for (key, size) in round_probes.items():
+            probe = {
+                "round": result["rounds"],
+                "size": size,
+                "status": "no_response",
+                "src": None,
+                "reported_mtu": None,
+                "rtt_ms": None,
+            }
+            if key in replies:
+                (reply, probe["rtt_ms"]) = replies[key]
+                probe["status"], probe["reported_mtu"] = _classify_pmtu_reply(reply)
+                probe["src"] = reply.src
+            probes_data.append(probe)
+        result["probes"] += probes_data
+        if result["rounds"] == 1 and probes_data[0]["status"] != "ok":
+            result["comment"] = (
+                f"The smallest probe of {low} bytes did not get through "
+                f"({probes_data[0]['status']}). Unable to discover the path MTU."
+            )
+            return
+        for probe in probes_data:
+            if probe["status"] == "ok":
+                low = max(low, probe["size"])
+        for probe in probes_data:
+            # Failures below a size that got through are just lost packets.
+            if probe["status"] == "ok" or not low < probe["size"] <= high:
+                continue
+            high = probe["size"] - 1
+            if probe["status"] == "too_big":
+                # The reported next-hop MTU is an upper bound. Older routers report 0.
+                if probe["reported_mtu"] and low <= probe["reported_mtu"] < high:
+                    high = probe["reported_mtu"]
+                result["limiting_hop"] = {
+                    "src": probe["src"],
+                    "hostname": None,
+                    "mtu": probe["reported_mtu"] or None,
+                }
+            else:
+                result["limiting_hop"] = None
+            result["black_hole"] = probe["status"] == "no_response"
+            break
+    result["path_mtu"] = low
+    result["converged"] = low == high
+    result["failed"] = False
+
+
+def _parse_tcp_targets(targets, version):
+    """Normalize the provided tcp_ping targets into a list of (target, address, port) tuples.
+
+    Targets can either be "host:port" strings, with IPv6 addresses wrapped in brackets, or
+    [host, port] pairs. Every host name is only resolved once.
+
+    """
+    if isinstance(targets, str):
+        targets = targets.replace(",", " ").split()
+    if not isinstance(targets, list):
+        raise TypeError(
+            f"Provided 'targets' must be a list of 'host:port' strings not a "
+            f"{type(targets).__name__}."
+        )
+    if not 1 <= len(targets) <= constants.TCP_PING_MAX_TARGETS:
+        raise ValueError(
+            f"Provided 'targets' of {len(targets)} entries is not allowed. "
+            f"Min: 1, Max: {constants.TCP_PING_MAX_TARGETS}."
+        )
+    addresses = {}
+    parsed = []
+    for target in targets:
+        if isinstance(target, (list, tuple)) and len(target) == 2:
+            host, port = str(target[0]), target[1]
+        elif isinstance(target, str) and target.startswith("[") and "]:" in target:
+            host, port = target[1:].split("]:", 1)
+        elif isinstance(target, str) and target.count(":") == 1:
+            host, port = target.split(":")
+        else:
+            raise ValueError(f"Provided target of '{target}' is not a 'host:port' pair.")
+        port = _get_int_option({"port": port}, "port", None, 1, 65535)
+        if host not in addresses:
+            addresses[host] = _resolve(host, version=version)
+        label = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+        parsed.append((label, addresses[host], port))
+    return parsed
+
+
+def _record_tcp_reply(result, state, rtt_ms=None):
+    """Account for the outcome of a single tcp_ping probe.
+
+    Both a SYN/ACK and a RST count as a reply since either proves that the host is
+    reachable, but the port is only reported as open if it accepted at least one SYN.
+
+    """
+    if rtt_ms is not None:
+        result["recv"] += 1
+        result["rtt_ms"].append(rtt_ms)
+    if result["state"] != "open":
+        result["state"] = state
+
+
+def _classify_tcp_reply(reply):
+    """Classify the reply to a TCP SYN as "open", "closed" or "unreachable"."""
+    # ICMP errors quote the SYN, so they have to be ruled out before looking at TCP.
+    if reply.error or len(reply.l4) < 14:
+        return "unreachable"
+    return "open" if reply.l4[13] & 0x12 == 0x12 else "closed"
+
+
+def _tcp_ping_syn(targets, results, count):
+    """Send `count` rounds of SYNs to every target, all at once per round and IP version, and
+    reset every connection that was accepted. Rounds stop at the test deadline.
+
+    Returns:
+        list: Returns the capture of every IP version that had targets, see
+              `ProbeSet.get_capture`.
+
+    """
+    captures = []
+    for version in (4, 6):
+        indexes = [
+            index
+            for (index, target) in enumerate(targets)
+            if ipaddress.ip_address(target[1]).version == version
+        ]
+        if not indexes:
+            continue
+        # Every target gets its own source port, which is what replies are dispatched with.
+        sport = random.randint(1024, 65535 - len(targets))
+        templates = {
+            index: ProbeTemplate(
+                targets[index][1], "TCP", sport=sport + index, dport=targets[index][2]
+            )
+            for index in indexes
         }
-        ans = sr(
-            IP(dst=dst, ttl=ttl, flags="DF", id=RandShort()) / packet,
-            iface=iface,
-            nofilter=0,
-            timeout=constants.PACKET_RECV_TIMEOUT,
-            retry=constants.PACKET_SEND_RETRY,
-            verbose=0,
-        )[0]
-        if ans and ans[0][1].src not in [hop["src"] for hop in result["trace"]]:
-            try:
-                hop_data["asn"] = asn_mmdb_reader.asn(ans[0][1].src).autonomous_system_number
-            except geoip2.errors.AddressNotFoundError:
-                pass
-            hop_data["src"] = ans[0][1].src
-            hop_data["hostname"] = _resolve(ans[0][1].src, reverse=True)
-            hop_data["rtt_ms"] = (ans[0][1].time - ans[0][0].sent_time) * 1000
-            hop_data["no_response"] = False
-            result["trace"].append(hop_data)
-            if ans[0][1].src == dst:
-                result["failed"] = False
+        resets = {}
+        with ProbeSet(version, "TCP") as probe_set:
+            # Every round is a sequence number of its own, which keeps late SYN/ACKs to a
+            # previous round from being matched to this one.
+            for seq in range(count):
+                if deadline.is_expired():
+                    for index in indexes:
+                        results[index]["sent"] = seq
+                    break
+                replies = probe_set.run(
+                    [(templates[index], seq, constants.PACKET_TTL) for index in indexes],
+                    deadline.clamp(constants.PACKET_RECV_TIMEOUT),
+                )
+                reset_probes = []
+                for index in indexes:
+                    if (templates[index], seq) not in replies:
+                        _record_tcp_reply(results[index], "filtered")
+                        continue
+                    (reply, rtt_ms) = replies[(templates[index], seq)]
+                    state = _classify_tcp_reply(reply)
+                    if state == "unreachable":
+                        rtt_ms = None
+                    _record_tcp_reply(results[index], state, rtt_ms)
+                    if state == "open":
+                        if index not in resets:
+                            resets[index] = templates[index].get_reset()
+                        reset_probes.append((resets[index], seq, constants.PACKET_TTL))
+                # Tear the half-open connections down rather than leaving it to the kernel,
+                # which may have been told to drop our unsolicited SYN/ACKs.
+                probe_set.send(reset_probes)
+            captures.append(probe_set.get_capture())
+    return captures
+
+
+def _tcp_connect_batch(targets, results, offset):
+    """Open a non-blocking connection to every target of the batch and time each connect()
+    through a single selector."""
+    selector = selectors.DefaultSelector()
+    try:
+        for (index, (_, address, port)) in enumerate(targets, offset):
+            version = ipaddress.ip_address(address).version
+            sock = socket.socket(
+                socket.AF_INET6 if version == 6 else socket.AF_INET, socket.SOCK_STREAM
+            )
+            sock.setblocking(False)
+            # Reset the connection when closing it, so probes don't pile up in TIME_WAIT.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            start_time = time.time()
+            error = sock.connect_ex((address, port))
+            if error in (0, errno.EINPROGRESS):
+                selector.register(sock, selectors.EVENT_WRITE, (index, start_time))
+            else:
+                sock.close()
+                _record_tcp_reply(results[index], "unreachable")
+        recv_deadline = time.time() + deadline.clamp(constants.PACKET_RECV_TIMEOUT)
+        while selector.get_map():
+            remaining = recv_deadline - time.time()
+            if remaining <= 0:
                 break
-        else:
-            result["trace"].append(hop_data)
+            for (key, _) in selector.select(remaining):
+                now = time.time()
+                index, start_time = key.data
+                error = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                if error == 0:
+                    _record_tcp_reply(results[index], "open", (now - start_time) * 1000)
+                elif error == errno.ECONNREFUSED:
+                    _record_tcp_reply(results[index], "closed", (now - start_time) * 1000)
+                else:
+                    _record_tcp_reply(results[index], "unreachable")
+    finally:
+        for key in list(selector.get_map().values()):
+            selector.unregister(key.fileobj)
+            key.fileobj.close()
+            _record_tcp_reply(results[key.data[0]], "filtered")
+        selector.close()
+
+
+def _tcp_ping_connect(targets, results, count):
+    """Time `count` rounds of full TCP connects to every target, in batches of concurrent
+    non-blocking sockets. Rounds stop at the test deadline."""
+    for round_index in range(count):
+        if deadline.is_expired():
+            for result in results:
+                result["sent"] = round_index
+            return
+        for offset in range(0, len(targets), constants.TCP_PING_MAX_CONCURRENT):
+            batch = targets[offset : offset + constants.TCP_PING_MAX_CONCURRENT]
+            _tcp_connect_batch(batch, results, offset)
+
+
+def tcp_ping(targets, **kwargs):
+    """Function to measure TCP reachability and handshake latency towards many targets.
+
+    Every round probes all targets concurrently, either with raw SYNs over a single socket per
+    IP version, where the SYN to SYN/ACK (or RST) time is measured and accepted connections
+    are reset straight away, or with full non-blocking connect() calls multiplexed through a
+    selector.
+
+    Args:
+        targets      (list): A list of "host:port" strings or [host, port] pairs. IPv6
+                             addresses must be wrapped in brackets, e.g. "[2001:db8::1]:443".
+                             Max of 1000 targets.
+        **mode       (str) : Keyword argument to optionally specify the probe mode, either "syn"
+                             or "connect". Defaults to "syn".
+        **count      (int) : Keyword argument to optionally specify the number of probes sent to
+                             every target. Defaults to 3. Max value of 20.
+        **ip_version (str) : Keyword argument to optionally specify the IP version ("4" or "6")
+                             to resolve host names to. Defaults to IPv4 if the name has an A
+                             record and IPv6 otherwise.
+
+    Returns:
+        dict: Returns a dictionary object with test results.
+
+    """
+    mode = str(kwargs.get("mode", "syn")).lower()
+    if mode not in constants.TCP_PING_MODES:
+        raise ValueError(
+            f"Provided 'mode' of '{mode}' is not supported. {constants.TCP_PING_MODES}."
+        )
+    count = _get_int_option(
+        kwargs, "count", constants.TCP_PING_COUNT, 1, constants.TCP_PING_MAX_COUNT
+    )
+    targets = _parse_tcp_targets(targets, _get_version(kwargs.get("ip_version", None)))
+    results = [
+        {
+            "target": target,
+            "dst": address,
+            "port": port,
+            "sent": count,
+            "recv": 0,
+            "loss": None,
+            "state": None,
+            "rtt": {"min": None, "max": None, "avg": None},
+            "rtt_ms": [],
+        }
+        for (target, address, port) in targets
+    ]
+    result = {
+        "mode": mode,
+        "count": count,
+        "targets": results,
+        "summary": {"open": 0, "closed": 0, "unreachable": 0, "filtered": 0},
+        "time_ms": None,
+        "capture": None,
+        "comment": None,
+        "failed": True,
+    }
+    start_time = time.time()
+    if mode == "syn":
+        captures = _tcp_ping_syn(targets, results, count)
+        # Both IP versions share the receiver of the process, one after the other.
+        result["capture"] = {
+            "backend": captures[0]["backend"],
+            "drops": sum(capture["drops"] for capture in captures),
+            "timestamp_source": timestamps.get_least_accurate(
+                [capture["timestamp_source"] for capture in captures]
+            ),
+        }
+    else:
+        _tcp_ping_connect(targets, results, count)
+    result["time_ms"] = (time.time() - start_time) * 1000
+    for target in results:
+        if target["sent"]:
+            target["loss"] = abs(100 * (target["recv"] - target["sent"]) / target["sent"])
+        if target["rtt_ms"]:
+            target["rtt"]["min"] = format(min(target["rtt_ms"]), ".3f")
+            target["rtt"]["max"] = format(max(target["rtt_ms"]), ".3f")
+            target["rtt"]["avg"] = format(sum(target["rtt_ms"]) / len(target["rtt_ms"]), ".3f")
+            result["failed"] = False
+        # Targets that the deadline left unprobed have no state.
+        if target["state"] is not None:
+            result["summary"][target["state"]] += 1
     return result
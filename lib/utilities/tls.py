@@ -0,0 +1,405 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import os
+import ssl
+import time
+import errno
+import socket
+import selectors
+import ipaddress
+import collections
+import concurrent.futures
+from lib.wrappers import _get_version, _get_int_option
+import lib.constants as constants
+import lib.deadline as deadline
+import lib.x509 as x509
+
+
+def _parse_tls_targets(targets):
+    """Normalize the provided tls_probe targets into a list of (target, host, port, sni)
+    tuples.
+
+    Targets can either be "host:port:sni" strings, where the port and SNI are optional and
+    IPv6 addresses are wrapped in brackets, or [host, port, sni] lists. The SNI defaults to
+    the host. Host names are resolved by the probes, see `_get_address`.
+
+    """
+    if isinstance(targets, str):
+        targets = targets.replace(",", " ").split()
+    if not isinstance(targets, list):
+        raise TypeError(
+            f"Provided 'targets' must be a list of 'host:port:sni' strings not a "
+            f"{type(targets).__name__}."
+        )
+    if not 1 <= len(targets) <= constants.TLS_PROBE_MAX_TARGETS:
+        raise ValueError(
+            f"Provided 'targets' of {len(targets)} entries is not allowed. "
+            f"Min: 1, Max: {constants.TLS_PROBE_MAX_TARGETS}."
+        )
+    parsed = []
+    for target in targets:
+        if isinstance(target, (list, tuple)) and 1 <= len(target) <= 3:
+            parts = [str(part) for part in target if part is not None]
+        elif isinstance(target, str) and target.startswith("[") and "]" in target:
+            host, rest = target[1:].split("]", 1)
+            parts = [host] + rest.lstrip(":").split(":", 1) if rest else [host]
+        elif isinstance(target, str) and target.count(":") <= 2:
+            parts = target.split(":")
+        else:
+            raise ValueError(f"Provided target of '{target}' is not a 'host:port:sni' triple.")
+        host = parts[0]
+        port = _get_int_option({"port": parts[1] if len(parts) > 1 else 443}, "port", 443, 1, 65535)
+        sni = parts[2] if len(parts) > 2 and parts[2] else host
+        label = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+        parsed.append((f"{label}:{sni}", host, port, sni))
+    return parsed
+
+
+def _get_address(host, version):
+    """Resolve a host name through getaddrinfo, preferring an IPv4 address unless `version`
+    asks for either one, like `_resolve` does.
+
+    Raises:
+        OSError: Raised if the host name doesn't resolve to an address of the IP version.
+
+    """
+    families = {None: (socket.AF_INET, socket.AF_INET6), 4: (socket.AF_INET,)}
+    error = None
+    for family in families.get(version, (socket.AF_INET6,)):
+        try:
+            return socket.getaddrinfo(host, None, family, socket.SOCK_STREAM)[0][4][0]
+        except socket.gaierror as gaierror:
+            error = gaierror
+    raise OSError(f"Unable to resolve '{host}': {error.strerror}")
+
+
+def _submit_resolutions(executor, targets, version):
+    """Resolve every host name of the targets once, concurrently, so that a name that doesn't
+    resolve only fails its own targets.
+
+    Returns:
+        list: Returns a list of the futures of the target addresses, in target order.
+
+    """
+    resolutions = {}
+    for (_, host, _, _) in targets:
+        if host not in resolutions:
+            resolutions[host] = executor.submit(_get_address, host, version)
+    return [resolutions[host] for (_, host, _, _) in targets]
+
+
+def _create_contexts(ignore_ssl, alpn):
+    """Create the verifying and the non-verifying client contexts.
+
+    The non-verifying context is used to still inspect certificates that failed to verify.
+
+    """
+    contexts = {}
+    for verify in (True, False):
+        context = ssl.create_default_context()
+        if not verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if alpn:
+            context.set_alpn_protocols(alpn)
+        contexts[verify] = context
+    if ignore_ssl:
+        contexts[True] = contexts[False]
+    return contexts
+
+
+def _handshake(address, port, sni, context, session=None):
+    """Connect and perform a TLS handshake on a non-blocking socket.
+
+    This is a generator to be driven by `_run_probes`. It yields every time it has to wait
+    for the socket.
+
+    Returns:
+        tuple: Returns a tuple of the established SSLSocket and a dict of the connect and
+               handshake times in milliseconds.
+
+    """
+    family = socket.AF_INET6 if ipaddress.ip_address(address).version == 6 else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        start_time = time.time()
+        error = sock.connect_ex((address, port))
+        if error == errno.EINPROGRESS:
+            yield sock, selectors.EVENT_WRITE, None
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            raise OSError(error, os.strerror(error))
+        connect_ms = (time.time() - start_time) * 1000
+        start_time = time.time()
+        sock = context.wrap_socket(
+            sock, server_hostname=sni, do_handshake_on_connect=False, session=session
+        )
+        while True:
+            try:
+                sock.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                yield sock, selectors.EVENT_READ, None
+            except ssl.SSLWantWriteError:
+                yield sock, selectors.EVENT_WRITE, None
+    except BaseException:
+        sock.close()
+        raise
+    return sock, {"connect_ms": connect_ms, "handshake_ms": (time.time() - start_time) * 1000}
+
+
+def _receive_tickets(sock):
+    """Wait briefly for the session tickets that TLS 1.3 servers send after the handshake.
+
+    Unlike earlier versions, TLS 1.3 only makes a session resumable once its tickets have
+    been read off the connection.
+
+    """
+    if sock.version() != "TLSv1.3":
+        return
+    while True:
+        try:
+            if not sock.recv(1):
+                return
+        except ssl.SSLWantReadError:
+            if sock.session is not None and sock.session.has_ticket:
+                return
+            ready = yield sock, selectors.EVENT_READ, constants.TLS_TICKET_WAIT
+            if not ready:
+                return
+
+
+def _summarize_chain(sock):
+    """Summarize the certificate chain sent by the server, if this Python exposes it."""
+    get_chain = getattr(sock, "get_unverified_chain", None)
+    if get_chain is None:
+        return None
+    chain = []
+    for cert in get_chain() or []:
+        cert = x509.parse_certificate(cert if isinstance(cert, bytes) else cert.public_bytes())
+        chain.append(
+            {key: cert[key] for key in ("subject", "issuer", "not_after", "expires_in_days")}
+        )
+    return chain
+
+
+def _probe(target, result, contexts, resume, resolution):
+    """Probe a single target, once `resolution`, the future of its address, is done. This is a
+    generator to be driven by `_run_probes`."""
+    _, _, port, sni = target
+    sock = None
+    try:
+        if deadline.is_expired():
+            raise socket.timeout("Stopped at the test deadline.")
+        while not resolution.done():
+            yield None, None, constants.TLS_RESOLVE_POLL
+        address = resolution.result()
+        result["dst"] = address
+        context = contexts[True]
+        try:
+            sock, timings = yield from _handshake(address, port, sni, context)
+        except ssl.SSLCertVerificationError as error:
+            # Handshake again without verification so that the certificate can be inspected.
+            result["verified"] = False
+            result["verify_error"] = error.verify_message
+            context = contexts[False]
+            sock, timings = yield from _handshake(address, port, sni, context)
+        else:
+            if context.verify_mode != ssl.CERT_NONE:
+                result["verified"] = True
+        result["timings"].update(timings)
+        cipher = sock.cipher()
+        result["version"] = sock.version()
+        result["cipher"] = cipher[0] if cipher else None
+        result["bits"] = cipher[2] if cipher else None
+        result["alpn"] = sock.selected_alpn_protocol()
+        der = sock.getpeercert(binary_form=True)
+        result["certificate"] = x509.parse_certificate(der) if der else None
+        result["chain"] = _summarize_chain(sock)
+        session = None
+        if resume:
+            yield from _receive_tickets(sock)
+            session = sock.session
+        sock.close()
+        sock = None
+        # The resumed handshake is only extra timing, so it's skipped past the test deadline.
+        if session is not None and not deadline.is_expired():
+            sock, timings = yield from _handshake(address, port, sni, context, session)
+            result["resumed"] = sock.session_reused
+            result["timings"]["resumed_connect_ms"] = timings["connect_ms"]
+            result["timings"]["resumed_handshake_ms"] = timings["handshake_ms"]
+    except (OSError, ssl.SSLError, x509.X509Error) as error:
+        result["error"] = str(error)
+    finally:
+        if sock is not None:
+            sock.close()
+
+
+def _select(selector, timeout):
+    """Wait up to `timeout` seconds for the registered sockets, or just sleep if there are none,
+    as the selector can't wait without any socket registered on every platform.
+
+    Returns:
+        set: Returns a set of the probes whose socket is ready.
+
+    """
+    if not selector.get_map():
+        time.sleep(timeout)
+        return set()
+    return {key.data for (key, _) in selector.select(timeout)}
+
+
+def _run_probes(probes, concurrency, timeout):
+    """Drive the probe generators concurrently through a single selector.
+
+    A probe yields a (socket, events, wait) tuple whenever it has to wait for its socket, and
+    is resumed with True once the socket is ready, or with False if `wait` seconds went by
+    first. A probe that only has to wait yields a None socket. A probe that doesn't finish
+    within `timeout` seconds, or by the test deadline, is failed with a timeout.
+
+    """
+    selector = selectors.DefaultSelector()
+    queue = collections.deque(probes)
+    waiting = {}
+    deadlines = {}
+
+    def resume(probe, value):
+        try:
+            fileobj, events, wait = probe.send(value)
+        except StopIteration:
+            del deadlines[probe]
+            return
+        wait_deadline = time.time() + wait if wait is not None else deadlines[probe]
+        if fileobj is not None:
+            selector.register(fileobj, events, probe)
+        waiting[probe] = (fileobj, min(wait_deadline, deadlines[probe]))
+
+    try:
+        while queue or waiting:
+            while queue and len(deadlines) < concurrency:
+                probe = queue.popleft()
+                deadlines[probe] = time.time() + deadline.clamp(timeout)
+                resume(probe, None)
+            if not waiting:
+                continue
+            next_deadline = min(wait_deadline for (_, wait_deadline) in waiting.values())
+            ready = _select(selector, max(next_deadline - time.time(), 0))
+            now = time.time()
+            for (probe, (fileobj, wait_deadline)) in list(waiting.items()):
+                if probe not in ready and wait_deadline > now:
+                    continue
+                if fileobj is not None:
+                    selector.unregister(fileobj)
+                del waiting[probe]
+                if probe not in ready and deadlines[probe] <= now:
+                    del deadlines[probe]
+                    try:
+                        probe.throw(socket.timeout("Timed out."))
+                    except StopIteration:
+                        pass
+                else:
+                    resume(probe, probe in ready)
+    finally:
+        for probe in list(waiting):
+            probe.close()
+        selector.close()
+
+
+def tls_probe(targets, **kwargs):
+    """Function to inspect the TLS handshake and certificate of many endpoints concurrently.
+
+    Every target gets a full handshake, after which the session is resumed on a new
+    connection (from a TLS 1.3 session ticket or a TLS 1.2 session) to time an abbreviated
+    handshake. No HTTP request is ever sent. All handshakes are driven by a single selector.
+
+    Args:
+        targets       (list): A list of "host:port:sni" strings or [host, port, sni] lists. The
+                              port defaults to 443 and the SNI to the host. IPv6 addresses must
+                              be wrapped in brackets, e.g. "[2001:db8::1]:443:example.com".
+                              Max of 500 targets.
+        **ignore_ssl  (bool): Keyword argument to optionally disable certificate verification.
+                              Certificates that fail to verify are still inspected either way.
+                              Defaults to False.
+        **resume      (bool): Keyword argument to optionally specify whether or not to time a
+                              resumed handshake. Defaults to True.
+        **alpn        (list): Keyword argument to optionally specify the ALPN protocols to
+                              offer, e.g. ["h2", "http/1.1"]. Defaults to none.
+        **expiry_days (int) : Keyword argument to optionally specify how many days ahead of
+                              expiry a certificate is flagged as expiring. Defaults to 30.
+        **ip_version  (str) : Keyword argument to optionally specify the IP version ("4" or
+                              "6") to resolve host names to. Defaults to IPv4 if the name has
+                              an A record and IPv6 otherwise.
+
+    Returns:
+        dict: Returns a dictionary object with test results.
+
+    """
+    ignore_ssl = kwargs.get("ignore_ssl", False)
+    if isinstance(ignore_ssl, str):
+        ignore_ssl = ignore_ssl.lower() in ("true", "1", "yes")
+    resume = kwargs.get("resume", True)
+    if isinstance(resume, str):
+        resume = resume.lower() in ("true", "1", "yes")
+    alpn = kwargs.get("alpn", None)
+    if isinstance(alpn, str):
+        alpn = alpn.replace(",", " ").split()
+    expiry_days = _get_int_option(
+        kwargs, "expiry_days", constants.TLS_EXPIRY_WARNING_DAYS, 0, 3650
+    )
+    version = _get_version(kwargs.get("ip_version", None))
+    targets = _parse_tls_targets(targets)
+    contexts = _create_contexts(ignore_ssl, alpn)
+    results = [
+        {
+            "target": target[0],
+            "dst": None,
+            "version": None,
+            "cipher": None,
+            "bits": None,
+            "alpn": None,
+            "verified": None,
+            "verify_error": None,
+            "certificate": None,
+            "chain": None,
+            "expiring": None,
+            "resumed": None,
+            "timings": {
+                "connect_ms": None,
+                "handshake_ms": None,
+                "resumed_connect_ms": None,
+                "resumed_handshake_ms": None,
+            },
+            "error": None,
+        }
+        for target in targets
+    ]
+    result = {
+        "targets": results,
+        "summary": {"ok": 0, "failed": 0, "unverified": 0, "expiring": 0},
+        "time_ms": None,
+        "comment": None,
+        "failed": True,
+    }
+    start_time = time.time()
+    executor = concurrent.futures.ThreadPoolExecutor(constants.TLS_RESOLVE_WORKERS)
+    try:
+        resolutions = _submit_resolutions(executor, targets, version)
+        probes = [
+            _probe(target, results[index], contexts, resume, resolutions[index])
+            for (index, target) in enumerate(targets)
+        ]
+        _run_probes(probes, constants.TLS_PROBE_MAX_CONCURRENT, constants.TLS_PROBE_TIMEOUT)
+    finally:
+        # Don't wait for the resolutions of the probes that timed out.
+        executor.shutdown(wait=False)
+    result["time_ms"] = (time.time() - start_time) * 1000
+    for target in results:
+        if target["certificate"] is not None:
+            target["expiring"] = target["certificate"]["expires_in_days"] < expiry_days
+            result["summary"]["expiring"] += target["expiring"]
+        if target["verified"] is False:
+            result["summary"]["unverified"] += 1
+        result["summary"]["failed" if target["error"] else "ok"] += 1
+    result["failed"] = not result["summary"]["ok"]
+    return result
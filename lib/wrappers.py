@@ -1,10 +1,11 @@
 # pylint: disable=locally-disabled, missing-docstring
 
-
+import os
+import time
 import subprocess
 import ipaddress
 
-def _resolve(addr, reverse=False):
+def _resolve(addr, reverse=False, version=None):
     """Private function to perform both reverse and non-reverse DNS resolutions
     via the dig command.
 
@@ -12,37 +13,90 @@ def _resolve(addr, reverse=False):
         addr    (str) : Either an IP address or domain name.
         reverse (bool): Specify whether or not to perform reverse resolutions.
                         Defaults to False. I.e. expects to resolve names to IPs.
+        version (int) : Specify the IP version (4 or 6) to resolve names to. Defaults to None,
+                        which prefers an A record and falls back to an AAAA record.
 
     Returns:
-        str: Returns a str object with the first item in the dig query's response.
+        str: Returns a str object with the first address in the dig query's response, or the
+             first name if `reverse` is set.
 
     Examples:
         Resolve a domain name (default).
         >>> _resolve("dns.google")
         '8.8.4.4'
 
+        Resolve a domain name to an IPv6 address.
+        >>> _resolve("dns.google", version=6)
+        '2001:4860:4860::8844'
+
         Perform the reverse.
         >>> _resolve("8.8.4.4", reverse=True)
         'dns.google'
 
     """
-    cmd = ["dig", addr, "+timeout=1", "+tries=1", "+short"]
     if reverse:
-        cmd.insert(1, "-x")
+        names = _dig(["-x", addr])
+        return names[0] if names is not None else addr
+    # Check if we're attempting to perform a non-reverse lookup on an IP address.
+    # If it's a domain; proceed to the next block to attempt resolution.
+    try:
+        address = ipaddress.ip_address(addr)
+    except ValueError:
+        pass
     else:
-        # Check if we're attempting to perform a non-reverse lookup on an IP address.
-        # If it's a domain; proceed to the next block to attempt resolution.
-        try:
-            return str(ipaddress.ip_address(addr))
-        except ValueError:
-            pass
+        if version is not None and address.version != int(version):
+            raise Exception(f"Provided address '{addr}' is not an IPv{version} address.")
+        return str(address)
+    rdtypes = {None: ("A", "AAAA"), 4: ("A",), 6: ("AAAA",)}[_get_version(version)]
+    for rdtype in rdtypes:
+        # The short output lists any CNAME chain before the addresses, so skip every line
+        # that isn't an address.
+        for line in _dig([addr, rdtype]) or []:
+            try:
+                return str(ipaddress.ip_address(line))
+            except ValueError:
+                continue
+    raise Exception(f"Unable to resolve host '{addr}'.")
+
+
+def _get_version(version):
+    """Normalize an IP version option of 4, 6 or None, raising on anything else."""
+    if version is None:
+        return None
+    if str(version) not in ("4", "6"):
+        raise ValueError(f"Provided 'ip_version' of '{version}' is not allowed. ('4', '6').")
+    return int(version)
+
+
+def _get_int_option(kwargs, name, default, minimum, maximum):
+    """Get an integer option from the provided kwargs and ensure that it's within bounds."""
+    value = kwargs.get(name, default)
+    if value is None:
+        return None
+    if isinstance(value, str) and not value.isdigit():
+        raise TypeError(f"Provided '{name}' of '{value}' must be an integer.")
+    value = abs(int(value))
+    if not minimum <= value <= maximum:
+        raise ValueError(
+            f"Provided '{name}' of '{value}' is not allowed. Min: {minimum}, Max: {maximum}."
+        )
+    return value
+
+
+def _dig(args):
+    """Run dig with the provided arguments.
+
+    Returns:
+        list: Returns a list of the short output's lines, with an empty string standing in for
+              an empty output, or None if dig failed.
+
+    """
+    cmd = ["dig"] + args + ["+timeout=1", "+tries=1", "+short"]
     try:
-        result = subprocess.check_output(cmd).decode("utf-8").strip().split("\n")[0]
-        if not result and not reverse:
-            raise Exception(f"Unable to resolve host '{addr}.'")
-        return result.rstrip(".")
+        output = subprocess.check_output(cmd).decode("utf-8").strip()
     except subprocess.CalledProcessError:
-        return addr
+        return None
+    return [line.rstrip(".") for line in output.split("\n")]
 
 
 def _get_route_dev(addr):
@@ -71,3 +125,156 @@ def _get_route_dev(addr):
             return None
     except subprocess.CalledProcessError:
         return None
+
+
+def _get_dev_mtu(dev):
+    """Read the MTU of a network device from sysfs.
+
+    Args:
+        dev (str): The device name, as returned by `_get_route_dev`.
+
+    Returns:
+        int: Returns the device's MTU, or None if it can't be read.
+
+    """
+    try:
+        with open(f"/sys/class/net/{dev}/mtu") as mtu_file:
+            return int(mtu_file.read().strip())
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _get_child_pids(pid):
+    """List the PIDs of a process' direct children, across all of its threads.
+
+    Children are listed under the thread that forked them, e.g. the thread of a worker pool.
+
+    """
+    pids = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return pids
+    for task in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as children:
+                pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _get_descendant_pids(pid):
+    """List the PIDs of every descendant of a process."""
+    pids = []
+    children = _get_child_pids(pid)
+    while children:
+        pids.extend(children)
+        children = [grandchild for child in children for grandchild in _get_child_pids(child)]
+    return pids
+
+
+def _get_process_memory(pid):
+    """Read the memory usage of a process from procfs.
+
+    The PSS splits every page shared copy-on-write evenly among the processes sharing it, so
+    unlike the RSS it adds up across processes.
+
+    Args:
+        pid (int): The process ID.
+
+    Returns:
+        dict: Returns a dictionary object with the RSS, PSS and shared memory in KiB. Values
+              that can't be read are None.
+
+    """
+    memory = {"rss_kb": None, "pss_kb": None, "shared_kb": None}
+    fields = {"Rss:": "rss_kb", "Pss:": "pss_kb", "Shared_Clean:": "shared_kb"}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            for line in smaps:
+                parts = line.split()
+                if parts[0] == "Shared_Dirty:" and memory["shared_kb"] is not None:
+                    memory["shared_kb"] += int(parts[1])
+                elif parts[0] in fields:
+                    memory[fields[parts[0]]] = int(parts[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    if memory["rss_kb"] is None:
+        # Kernels before 4.14 have no smaps_rollup; fall back to the RSS alone.
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        memory["rss_kb"] = int(line.split()[1])
+        except (OSError, IndexError, ValueError):
+            pass
+    return memory
+
+
+def _get_orphaned_pids(names):
+    """List the PIDs of the processes with one of the provided command names that were
+    orphaned, i.e. reparented to init once their parent died."""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                data = stat.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split it out by its parentheses.
+        (name, fields) = (data[data.find("(") + 1 : data.rfind(")")], data[data.rfind(")") + 2 :])
+        # Zombies were already killed, and are only waiting for init to reap them.
+        (state, ppid) = fields.split()[:2]
+        if name in names and ppid == "1" and state != "Z":
+            pids.append(int(entry))
+    return pids
+
+
+def _get_available_memory():
+    """Read the memory available to start new processes, without swapping, from procfs.
+
+    Returns:
+        int: Returns the available memory in KiB, or None if it can't be read.
+
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def _get_cpu_times():
+    """Read the busy and total CPU time of the machine since boot from procfs.
+
+    Returns:
+        tuple: Returns a tuple of the busy and total CPU time in clock ticks, or None if they
+               can't be read.
+
+    """
+    try:
+        with open("/proc/stat") as stat:
+            times = [int(value) for value in stat.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # The idle and iowait times are the 4th and 5th values.
+    return sum(times) - sum(times[3:5]), sum(times)
+
+
+def _get_process_start_time(pid):
+    """Get the time at which a process was started, as a UNIX timestamp, or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # The command name may contain spaces, so count the fields from its closing ")".
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            boot_time = time.time() - float(uptime.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
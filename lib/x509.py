@@ -0,0 +1,184 @@
+# pylint: disable=locally-disabled, missing-docstring
+
+import hashlib
+import datetime
+import ipaddress
+
+# Short names of the distinguished name attributes we report, keyed by their encoded OID.
+NAME_ATTRIBUTES = {
+    "2.5.4.3": "CN",
+    "2.5.4.6": "C",
+    "2.5.4.7": "L",
+    "2.5.4.8": "ST",
+    "2.5.4.10": "O",
+    "2.5.4.11": "OU",
+}
+
+ALGORITHMS = {
+    "1.2.840.113549.1.1.1": "rsa",
+    "1.2.840.113549.1.1.5": "sha1-rsa",
+    "1.2.840.113549.1.1.10": "rsa-pss",
+    "1.2.840.113549.1.1.11": "sha256-rsa",
+    "1.2.840.113549.1.1.12": "sha384-rsa",
+    "1.2.840.113549.1.1.13": "sha512-rsa",
+    "1.2.840.10045.2.1": "ec",
+    "1.2.840.10045.4.3.2": "sha256-ecdsa",
+    "1.2.840.10045.4.3.3": "sha384-ecdsa",
+    "1.2.840.10045.4.3.4": "sha512-ecdsa",
+    "1.3.101.112": "ed25519",
+    "1.3.101.113": "ed448",
+}
+
+SUBJECT_ALT_NAME = "2.5.29.17"
+
+
+class X509Error(Exception):
+    """Raised when a DER encoded certificate can't be decoded."""
+
+
+def _read_tlv(data, offset):
+    """Read the DER tag and length at `offset`.
+
+    Returns:
+        tuple: Returns a tuple of the tag, the offset of the value and the offset right
+               after it.
+
+    """
+    if offset + 2 > len(data):
+        raise X509Error("Truncated DER element.")
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset : offset + size], "big")
+        offset += size
+    if offset + length > len(data):
+        raise X509Error("Truncated DER element.")
+    return tag, offset, offset + length
+
+
+def _children(data, start, end):
+    """List the (tag, start, end) elements contained in a constructed DER value."""
+    children = []
+    while start < end:
+        tag, value_start, value_end = _read_tlv(data, start)
+        children.append((tag, value_start, value_end))
+        start = value_end
+    return children
+
+
+def _decode_oid(value):
+    """Decode a DER object identifier into its dotted form."""
+    arcs = []
+    arc = 0
+    for byte in value:
+        arc = (arc << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+    if not arcs:
+        return ""
+    first = min(arcs[0] // 40, 2)
+    return ".".join(str(part) for part in [first, arcs[0] - first * 40] + arcs[1:])
+
+
+def _decode_name(data, start, end):
+    """Decode a distinguished name into an "CN=...,O=..." string of the attributes we know."""
+    parts = []
+    for (_, set_start, set_end) in _children(data, start, end):
+        for (_, attribute_start, attribute_end) in _children(data, set_start, set_end):
+            (_, oid_start, oid_end), (_, value_start, value_end) = _children(
+                data, attribute_start, attribute_end
+            )[:2]
+            name = NAME_ATTRIBUTES.get(_decode_oid(data[oid_start:oid_end]))
+            if name is not None:
+                parts.append(f"{name}={str(data[value_start:value_end], 'utf-8', 'replace')}")
+    return ",".join(parts)
+
+
+def _decode_time(tag, value):
+    """Decode an UTCTime or GeneralizedTime into an aware datetime."""
+    value = str(value, "ascii").rstrip("Z")
+    if tag == 0x17:
+        # UTCTime years of 50 and above belong to the twentieth century (RFC 5280).
+        year = int(value[:2])
+        value = f"{1900 + year if year >= 50 else 2000 + year}{value[2:]}"
+    return datetime.datetime.strptime(value[:14], "%Y%m%d%H%M%S").replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def _decode_subject_alt_names(data, start, end):
+    """Decode the DNS names and IP addresses of a subjectAltName extension value."""
+    names = []
+    (_, names_start, names_end) = _children(data, start, end)[0]
+    for (tag, value_start, value_end) in _children(data, names_start, names_end):
+        if tag == 0x82:
+            names.append(str(data[value_start:value_end], "ascii", "replace"))
+        elif tag == 0x87:
+            names.append(str(ipaddress.ip_address(bytes(data[value_start:value_end]))))
+    return names
+
+
+def parse_certificate(der, now=None):
+    """Summarize a DER encoded X.509 certificate.
+
+    Only the fields needed to check who a certificate was issued to and when it expires are
+    decoded, which keeps this independent of the certificate verification mode.
+
+    Args:
+        der (bytes)            : The DER encoded certificate.
+        now (datetime.datetime): The time to compute the remaining validity from. Defaults to
+                                 the current time.
+
+    Returns:
+        dict: Returns a dictionary object with the subject, issuer, subject alternative names,
+              serial number, validity period, days until expiry, key and signature algorithms
+              and the SHA-256 fingerprint of the certificate.
+
+    """
+    data = memoryview(der)
+    try:
+        (_, cert_start, cert_end) = _read_tlv(data, 0)
+        cert = _children(data, cert_start, cert_end)
+        tbs = _children(data, cert[0][1], cert[0][2])
+        # The version is optional and explicitly tagged [0].
+        index = 1 if tbs[0][0] == 0xA0 else 0
+        serial, _, issuer, validity, subject, key_info = tbs[index : index + 6]
+        not_before, not_after = [
+            _decode_time(tag, data[start:end])
+            for (tag, start, end) in _children(data, validity[1], validity[2])
+        ]
+        key_algorithm = _children(data, key_info[1], key_info[2])[0]
+        key_oid = _children(data, key_algorithm[1], key_algorithm[2])[0]
+        signature_algorithm = _children(data, cert[1][1], cert[1][2])[0]
+        subject_alt_names = []
+        for (tag, start, end) in tbs[index + 6 :]:
+            # Extensions are explicitly tagged [3].
+            if tag != 0xA3:
+                continue
+            (_, extensions_start, extensions_end) = _children(data, start, end)[0]
+            for (_, ext_start, ext_end) in _children(data, extensions_start, extensions_end):
+                fields = _children(data, ext_start, ext_end)
+                if _decode_oid(data[fields[0][1] : fields[0][2]]) == SUBJECT_ALT_NAME:
+                    subject_alt_names = _decode_subject_alt_names(
+                        data, fields[-1][1], fields[-1][2]
+                    )
+    except (ValueError, IndexError) as error:
+        raise X509Error(f"Unable to decode certificate: {error}")
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    key_algorithm = _decode_oid(data[key_oid[1] : key_oid[2]])
+    signature_algorithm = _decode_oid(data[signature_algorithm[1] : signature_algorithm[2]])
+    return {
+        "subject": _decode_name(data, subject[1], subject[2]),
+        "issuer": _decode_name(data, issuer[1], issuer[2]),
+        "san": subject_alt_names,
+        "serial": data[serial[1] : serial[2]].hex(),
+        "not_before": not_before.isoformat(),
+        "not_after": not_after.isoformat(),
+        "expires_in_days": (not_after - now).total_seconds() / 86400,
+        "key_algorithm": ALGORITHMS.get(key_algorithm, key_algorithm),
+        "signature_algorithm": ALGORITHMS.get(signature_algorithm, signature_algorithm),
+        "sha256": hashlib.sha256(der).hexdigest(),
+    }